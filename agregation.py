@@ -0,0 +1,126 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+
+import bilan
+import etp
+
+# Variables utilisées pour le calcul de l'ETP et du bilan hydrique
+# et leur méthode d'agrégation journalière
+VARIABLES_POUR_CALCULS = dict(
+    **etp.VARIABLES_CALCUL_ETP,
+    **bilan.VARIABLES_CALCUL_BILAN)
+VARIABLES_POUR_CALCULS_SANS_ETP = VARIABLES_POUR_CALCULS.copy()
+del VARIABLES_POUR_CALCULS_SANS_ETP['etp']
+
+# Fuseaux horaires des journées d'agrégation
+FUSEAUX = {
+    'utc': 'UTC',
+    'locale': 'Europe/Paris'
+}
+
+# Largeur de la fenêtre glissante
+FENETRE_GLISSANTE = pd.Timedelta(hours=24)
+
+def _methodes(df, variables):
+    '''Méthodes d'agrégation des variables présentes dans la donnée.'''
+    return {variable: methode for variable, methode in variables.items()
+            if variable in df.columns}
+
+def agreger_jours(df, variables=VARIABLES_POUR_CALCULS, tz='UTC'):
+    '''Agrégation par journée civile dans le fuseau horaire donné.
+
+    Toutes les variables sont agrégées en une passe groupée selon leur
+    méthode ('mean' ou 'sum'). Les journées sont indexées par leur début
+    dans le fuseau horaire (journées de 23 h ou 25 h aux changements
+    d'heure en heure locale).
+    '''
+    df = df.tz_convert(tz)
+
+    return df.resample('D').agg(_methodes(df, variables))
+
+def agreger_glissant(df, variables=VARIABLES_POUR_CALCULS,
+                     fenetre=FENETRE_GLISSANTE):
+    '''Agrégation sur une fenêtre glissante se terminant à chaque heure.'''
+    return df.rolling(fenetre).agg(_methodes(df, variables))
+
+def agreger(df, variables=VARIABLES_POUR_CALCULS, fenetre=FENETRE_GLISSANTE):
+    '''Agrégations journalières (UTC et heure locale) et glissante.'''
+    agregats = {nom: agreger_jours(df, variables, tz=tz)
+                for nom, tz in FUSEAUX.items()}
+    agregats['glissant'] = agreger_glissant(df, variables, fenetre=fenetre)
+
+    return agregats
+
+class Agregateur(object):
+    '''Agrégation incrémentale, heure par heure, des variables météo.
+
+    Chaque nouvelle heure met à jour en temps constant les sommes et les
+    nombres de valeurs de la fenêtre glissante et des journées en cours
+    (UTC et heure locale). Les journées terminées sont gardées dans
+    jours. Les résultats sont ceux de agreger_glissant et agreger_jours.
+    '''
+    def __init__(self, variables=VARIABLES_POUR_CALCULS,
+                 fenetre=FENETRE_GLISSANTE):
+        self.variables = list(variables)
+        self._est_somme = np.array([variables[_] == 'sum' for _ in self.variables])
+        self.fenetre = fenetre
+        self._fenetre = deque()
+        self._somme_fenetre = np.zeros(len(self.variables))
+        self._nombre_fenetre = np.zeros(len(self.variables), dtype=int)
+        self._jours_courants = {nom: None for nom in FUSEAUX}
+        self.jours = {nom: [] for nom in FUSEAUX}
+
+    def _agregat(self, somme, nombre, glissant=False):
+        '''Sommes ou moyennes des variables à partir des sommes et nombres.'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            valeurs = np.where(self._est_somme, somme, somme / nombre)
+        if glissant:
+            # Aucune valeur dans la fenêtre
+            valeurs = np.where(nombre > 0, valeurs, np.nan)
+
+        return pd.Series(valeurs, index=self.variables)
+
+    def ajouter(self, temps, valeurs):
+        '''Ajout d'une heure et agrégat glissant se terminant à cette heure.'''
+        temps = pd.Timestamp(temps)
+        valeurs = pd.Series(valeurs).reindex(self.variables).to_numpy(dtype=float)
+        valide = ~np.isnan(valeurs)
+        valeurs = np.where(valide, valeurs, 0.)
+
+        # Fenêtre glissante : ajout de l'heure et retrait des heures sorties
+        self._fenetre.append((temps, valeurs, valide))
+        self._somme_fenetre += valeurs
+        self._nombre_fenetre += valide
+        while self._fenetre[0][0] <= temps - self.fenetre:
+            _, valeurs_sortie, valide_sortie = self._fenetre.popleft()
+            self._somme_fenetre -= valeurs_sortie
+            self._nombre_fenetre -= valide_sortie
+
+        # Journées en cours
+        for nom, tz in FUSEAUX.items():
+            jour = temps.tz_convert(tz).normalize()
+            courant = self._jours_courants[nom]
+            if (courant is None) or (courant[0] != jour):
+                if courant is not None:
+                    self.jours[nom].append(self._agregat_jour(courant))
+                courant = [jour, np.zeros(len(self.variables)),
+                           np.zeros(len(self.variables), dtype=int)]
+                self._jours_courants[nom] = courant
+            courant[1] += valeurs
+            courant[2] += valide
+
+        return self._agregat(self._somme_fenetre, self._nombre_fenetre,
+                             glissant=True).rename(temps)
+
+    def _agregat_jour(self, courant):
+        jour, somme, nombre = courant
+        return self._agregat(somme, nombre).rename(jour)
+
+    def jours_frame(self, nom='utc', jour_courant=True):
+        '''Agrégats des journées terminées (et de la journée en cours).'''
+        l_jours = list(self.jours[nom])
+        if jour_courant and (self._jours_courants[nom] is not None):
+            l_jours.append(self._agregat_jour(self._jours_courants[nom]))
+
+        return pd.DataFrame(l_jours, columns=self.variables)
@@ -0,0 +1,120 @@
+'''Mémoire et temps de la climatologie horaire complète et par morceaux.
+
+Un cube synthétique de stations horaires est créé année par année. La
+climatologie journalière de la station de référence (interpolation,
+ETP et agrégation) est ensuite calculée dans un processus distinct
+pour chaque mode, dont le pic de mémoire résidente est mesuré :
+- complet : toute la donnée des stations en mémoire, comme dans le
+  notebook de climatologie horaire,
+- morceaux : climatologie.agreger_par_morceaux, mois par mois.
+
+Utilisation : python benchmarks/bench_climatologie_morceaux.py [nombre_stations] [nombre_annees]
+'''
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import agregation
+import climatologie
+import cube
+import etp
+import geo
+import meteofrance
+
+# Nombre de stations et d'années par défaut
+NOMBRE_STATIONS = 50
+NOMBRE_ANNEES = 5
+
+# Première année de la période
+ANNEE_DEB = 2000
+
+# Site de référence (latitude, longitude, altitude)
+SITE = (45., 5., 200.)
+
+# Étiquettes des variables DPClim horaires
+CLIENT = meteofrance.Client('DPClim')
+VARIABLES = list(CLIENT.variables_labels['horaire'].values())
+
+
+def creer_cube(dirpath, nombre_stations, nombre_annees):
+    '''Cube synthétique rempli année par année.'''
+    stations = range(13000001, 13000001 + nombre_stations)
+    date_deb = pd.Timestamp(f'{ANNEE_DEB}-01-01', tz='UTC')
+    date_fin = pd.Timestamp(f'{ANNEE_DEB + nombre_annees - 1}-12-31 23:00',
+                            tz='UTC')
+    cube_stations = cube.CubeStations.creer(
+        dirpath, stations, date_deb, date_fin, VARIABLES,
+        CLIENT.id_station_donnee_label, CLIENT.time_label)
+    rng = np.random.default_rng(0)
+    for annee in range(ANNEE_DEB, ANNEE_DEB + nombre_annees):
+        pos = cube_stations.positions(
+            date_deb=f'{annee}-01-01', date_fin=f'{annee}-12-31 23:00')[1]
+        heures = cube_stations.temps[pos].hour.to_numpy()
+        forme = (nombre_stations, len(heures))
+        jour = np.clip(np.sin((heures - 6) / 12 * np.pi), 0., None)
+        cube_stations.donnee[:, pos] = np.stack([
+            300. * jour * rng.random(forme),
+            10. + 10. * rng.random(forme),
+            50. + 50. * rng.random(forme),
+            5. * rng.random(forme),
+            rng.random(forme) * (rng.random(forme) > 0.9)], axis=-1)
+    cube_stations.donnee.flush()
+
+    return date_deb, date_fin
+
+
+def distances(nombre_stations):
+    return pd.Series(np.linspace(2., 30., nombre_stations),
+                     index=range(13000001, 13000001 + nombre_stations))
+
+
+def climatologie_complete(cube_stations, s_dist_km, date_deb, date_fin):
+    '''Calcul sur toute la période à partir de la donnée des stations.'''
+    df_meteo = cube_stations.vers_frame(date_deb=date_deb, date_fin=date_fin)
+    df_ref = geo.interpolation_inverse_distance_carre(df_meteo, s_dist_km)
+    df_si = meteofrance.normaliser(CLIENT, df_ref, 'horaire')
+    df_si['etp'] = etp.calcul_etp(df_si, *SITE)
+
+    return agregation.agreger_jours(df_si, tz='UTC')
+
+
+def executer_mode(mode, dirpath, nombre_stations, date_deb, date_fin):
+    cube_stations = cube.CubeStations(Path(dirpath))
+    s_dist_km = distances(nombre_stations)
+    debut = time.perf_counter()
+    if mode == 'complet':
+        df = climatologie_complete(cube_stations, s_dist_km, date_deb, date_fin)
+    else:
+        df = climatologie.agreger_par_morceaux(
+            CLIENT, cube_stations, s_dist_km, date_deb, date_fin, *SITE)
+    duree = time.perf_counter() - debut
+    # Pic de mémoire résidente (Ko sous Linux)
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    print(f"{mode:<10} {duree:8.2f} s {pic:10.1f} Mo (pic) {len(df):6d} jours")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--mode']:
+        mode, dirpath, nombre_stations, date_deb, date_fin = sys.argv[2:]
+        executer_mode(mode, dirpath, int(nombre_stations), date_deb, date_fin)
+        sys.exit()
+
+    nombre_stations = (int(sys.argv[1]) if len(sys.argv) > 1
+                       else NOMBRE_STATIONS)
+    nombre_annees = int(sys.argv[2]) if len(sys.argv) > 2 else NOMBRE_ANNEES
+    print(f"{nombre_stations} stations x {nombre_annees} années horaires "
+          f"x {len(VARIABLES)} variables")
+    with tempfile.TemporaryDirectory() as dirpath:
+        date_deb, date_fin = creer_cube(
+            Path(dirpath), nombre_stations, nombre_annees)
+        for mode in ['complet', 'morceaux']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, dirpath,
+                            str(nombre_stations), date_deb.isoformat(),
+                            date_fin.isoformat()], check=True)
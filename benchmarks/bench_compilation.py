@@ -0,0 +1,71 @@
+'''Mesure du temps et de la mémoire de la compilation des données des stations.
+
+Compare la compilation historique par `pd.concat` dans la boucle à la
+concaténation unique des DataFrames produits par un générateur
+(`meteofrance.concatener`), en float64 et en float32, pour des stations
+synthétiques horaires sur une année.
+
+Utilisation : python benchmarks/bench_compilation.py [nombre_stations]
+'''
+from pathlib import Path
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import meteofrance
+
+# Nombre de stations par défaut
+NOMBRE_STATIONS = 120
+
+# Période d'une année horaire
+PERIODE = pd.date_range('2024-01-01', '2024-12-31 23:00', freq='h', tz='UTC')
+
+# Étiquettes des variables DPClim horaires
+VARIABLES = list(meteofrance.VARIABLES_LABELS['DPClim']['horaire'].values())
+
+
+def generer_stations(nombre_stations, dtype=float):
+    '''Production de DataFrames synthétiques indexés par station et par date.'''
+    rng = np.random.default_rng(0)
+    for id_station in range(13000001, 13000001 + nombre_stations):
+        index = pd.MultiIndex.from_product(
+            [[id_station], PERIODE], names=['POSTE', 'DATE'])
+        valeurs = rng.random((len(PERIODE), len(VARIABLES))).astype(dtype)
+        yield pd.DataFrame(valeurs, index=index, columns=VARIABLES)
+
+
+def compilation_boucle(frames):
+    '''Compilation historique par concaténations successives.'''
+    df = pd.DataFrame(dtype=float)
+    for df_station in frames:
+        df = pd.concat([df, df_station])
+
+    return df
+
+
+def mesurer(nom, fonction, nombre_stations, dtype):
+    tracemalloc.start()
+    debut = time.perf_counter()
+    df = fonction(generer_stations(nombre_stations, dtype=dtype))
+    duree = time.perf_counter() - debut
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    taille = df.memory_usage(deep=True).sum()
+    print(f"{nom:<28} {np.dtype(dtype).name:<8} {duree:8.2f} s "
+          f"{pic / 1e6:10.1f} Mo (pic) {taille / 1e6:10.1f} Mo (final)")
+
+
+if __name__ == '__main__':
+    nombre_stations = (int(sys.argv[1]) if len(sys.argv) > 1
+                       else NOMBRE_STATIONS)
+    print(f"{nombre_stations} stations x {len(PERIODE)} heures "
+          f"x {len(VARIABLES)} variables")
+    for dtype in [np.float64, np.float32]:
+        mesurer('concat dans la boucle', compilation_boucle,
+                nombre_stations, dtype)
+        mesurer('générateur + concat unique', meteofrance.concatener,
+                nombre_stations, dtype)
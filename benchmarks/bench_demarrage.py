@@ -0,0 +1,105 @@
+'''Profil des imports et temps avant le premier rendu de l'application.
+
+Chaque module est importé dans un interpréteur neuf avec
+`-X importtime`. Le script affiche le temps d'import cumulé de chaque
+module et les paquets les plus lents. Il mesure aussi le temps de
+construction des vues de l'application (jusqu'au premier rendu) et le
+compare au temps cible.
+
+Utilisation : python benchmarks/bench_demarrage.py [module ...]
+'''
+from pathlib import Path
+import subprocess
+import sys
+
+import pandas as pd
+
+# Racine du dépôt, dossier de travail des interpréteurs
+RACINE = Path(__file__).resolve().parents[1]
+
+# Modules profilés par défaut
+MODULES = ['viewer_bilan_observations', 'datastore_observations',
+           'agregation', 'etp', 'geo', 'bilan']
+
+# Nombre de paquets les plus lents affichés par module
+NOMBRE_PAQUETS = 8
+
+# Temps cible (s) entre le lancement et le premier rendu de l'application
+TEMPS_CIBLE_PREMIER_RENDU = 3.
+
+# Construction de l'application du notebook app_bilan_hydrique.ipynb
+CODE_PREMIER_RENDU = '''
+import time
+debut = time.perf_counter()
+import panel as pn
+from datastore_observations import DataStoreObservations
+from viewer_bilan_observations import (
+    ViewerIntroduction, ViewerMeteoObservations, ViewerBilanObservations)
+datastore = DataStoreObservations()
+vues = [vue(datastore=datastore) for vue in [
+    ViewerIntroduction, ViewerMeteoObservations, ViewerBilanObservations]]
+pn.Column(datastore, *vues).get_root()
+print(time.perf_counter() - debut)
+'''
+
+
+def executer(*args):
+    return subprocess.run([sys.executable, *args], cwd=RACINE,
+                          capture_output=True, text=True)
+
+
+def profil_imports(module):
+    '''Niveau, temps propre et cumulé (s) des paquets importés par le module.'''
+    resultat = executer('-X', 'importtime', '-c', f'import {module}')
+    if resultat.returncode != 0:
+        raise ImportError(resultat.stderr.strip().splitlines()[-1])
+    lignes = []
+    for ligne in resultat.stderr.splitlines():
+        if not ligne.startswith('import time:') or 'self [us]' in ligne:
+            continue
+        propre, cumule, paquet = ligne[len('import time:'):].split('|')
+        # Indentation de deux espaces par niveau d'import
+        niveau = (len(paquet) - len(paquet.lstrip()) - 1) // 2
+        lignes.append((paquet.strip(), niveau, int(propre) * 1.e-6,
+                       int(cumule) * 1.e-6))
+
+    return pd.DataFrame(lignes, columns=['paquet', 'niveau', 'propre', 'cumule'])
+
+
+def temps_premier_rendu():
+    '''Temps (s) d'import et de construction des vues de l'application.'''
+    resultat = executer('-c', CODE_PREMIER_RENDU)
+    if resultat.returncode != 0:
+        raise ImportError(resultat.stderr.strip().splitlines()[-1])
+
+    return float(resultat.stdout.split()[-1])
+
+
+if __name__ == '__main__':
+    modules = sys.argv[1:] or MODULES
+    for module in modules:
+        try:
+            df = profil_imports(module)
+        except ImportError as exc:
+            print(f"{module:<28} non importable : {exc}")
+            continue
+        # Le module suit les paquets qu'il importe, depuis le précédent
+        # import de premier niveau (imports du démarrage de l'interpréteur)
+        i_module = df.index[df['paquet'] == module][-1]
+        i_debut = df.index[(df['niveau'] == 0) & (df.index < i_module)].max()
+        i_debut = -1 if pd.isnull(i_debut) else i_debut
+        print(f"{module:<28} {df.loc[i_module, 'cumule']:8.3f} s")
+        # Paquets importés directement par le module les plus lents
+        df_directs = df.loc[i_debut + 1:i_module - 1]
+        df_directs = df_directs[df_directs['niveau'] == 1]
+        for _, ligne in df_directs.nlargest(
+                NOMBRE_PAQUETS, 'cumule').iterrows():
+            print(f"    {ligne['paquet']:<24} {ligne['cumule']:8.3f} s")
+
+    try:
+        duree = temps_premier_rendu()
+        statut = 'OK' if duree <= TEMPS_CIBLE_PREMIER_RENDU else 'AU-DELÀ'
+        print(f"premier rendu {duree:8.3f} s (cible "
+              f"{TEMPS_CIBLE_PREMIER_RENDU:.1f} s) {statut}")
+    except ImportError as exc:
+        print(f"premier rendu non mesuré : {exc}")
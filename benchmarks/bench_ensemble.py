@@ -0,0 +1,91 @@
+'''Temps de l'ensemble de Monte-Carlo du bilan hydrique par site.
+
+Pour un site et ses stations voisines synthétiques, les précipitations
+des membres sont tirées (ensemble.tirer_precipitations) puis le bilan
+de tous les membres est résumé (ensemble.calcul_bilan_ensemble), pour
+un jour et pour une saison. Le script affiche le temps par site en
+fonction du nombre de membres et vérifie qu'un ensemble sans
+dispersion redonne bilan.calcul_bilan.
+
+Utilisation : python benchmarks/bench_ensemble.py [nombre_stations]
+'''
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+RACINE = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RACINE))
+import bilan
+import ensemble
+
+# Nombre de stations voisines par défaut
+NOMBRE_STATIONS = 5
+
+# Nombres de membres et de jours mesurés
+NOMBRES_MEMBRES = [1000, 10000, 100000]
+NOMBRES_JOURS = [1, 183]
+
+# Paramètres du bilan (sol, culture et irrigation), au premier stade
+PARAMETRES_BILAN = dict(
+    texture='Terres limoneuses', fraction_cailloux=0.1, culture='Tomate',
+    fraction_ru_remplie=0.8, ru_vers_rfu=0.67, seuil_irrigation=0.1,
+    hauteur_vers_duree_irrigation=10.)
+
+
+def creer_donnee(nombre_stations, nombre_jours, rng):
+    '''Précipitations des stations, distances et météo journalière au site.'''
+    dates = pd.date_range('2026-04-01', periods=nombre_jours)
+    stations = pd.Index(range(1, nombre_stations + 1), name='station')
+    index = pd.MultiIndex.from_product([stations, dates])
+    s_precipitation = pd.Series(
+        10. * rng.random(len(index)) * (rng.random(len(index)) > 0.6),
+        index=index)
+    s_dist_km = pd.Series(np.linspace(3., 25., nombre_stations),
+                          index=stations)
+    df_meteo = pd.DataFrame({
+        'etp': 3. + 2. * rng.random(nombre_jours),
+        'precipitation': s_precipitation.groupby(level=1).mean()},
+        index=dates)
+
+    return s_precipitation, s_dist_km, df_meteo
+
+
+if __name__ == '__main__':
+    nombre_stations = (int(sys.argv[1]) if len(sys.argv) > 1
+                       else NOMBRE_STATIONS)
+    bilan.FILEPATH_KC = RACINE / bilan.FILEPATH_KC
+    PARAMETRES_BILAN['stade'] = next(iter(
+        bilan.lire_kc()[PARAMETRES_BILAN['culture']]))
+    rng = np.random.default_rng(0)
+
+    # Sans dispersion, chaque membre est le bilan de référence
+    s_precipitation, s_dist_km, df_meteo = creer_donnee(
+        nombre_stations, NOMBRES_JOURS[-1], rng)
+    membres = ensemble.calcul_bilan_membres(
+        df_meteo, **PARAMETRES_BILAN, nombre_membres=2,
+        ecarts_types={nom: 0. for nom in ensemble.ECARTS_TYPES})
+    identique = np.array_equal(
+        membres['besoin_irrigation'][0],
+        bilan.calcul_bilan(df_meteo, **PARAMETRES_BILAN)[
+            'besoin_irrigation'].to_numpy())
+    print(f"sans dispersion : {'identique' if identique else 'DIFFÉRENT'} "
+          f"à bilan.calcul_bilan")
+
+    for nombre_jours in NOMBRES_JOURS:
+        s_precipitation, s_dist_km, df_meteo = creer_donnee(
+            nombre_stations, nombre_jours, rng)
+        for nombre_membres in NOMBRES_MEMBRES:
+            debut = time.perf_counter()
+            precipitation_membres = ensemble.tirer_precipitations(
+                s_precipitation, s_dist_km, nombre_membres, rng=rng)
+            df = ensemble.calcul_bilan_ensemble(
+                df_meteo, **PARAMETRES_BILAN,
+                precipitation_membres=precipitation_membres,
+                nombre_membres=nombre_membres, rng=rng)
+            duree = time.perf_counter() - debut
+            print(f"{nombre_jours:4d} jours {nombre_membres:7d} membres "
+                  f"{duree * 1e3:9.2f} ms  P(irrigation) premier jour "
+                  f"{df['probabilite_irrigation'].iloc[0]:.3f}")
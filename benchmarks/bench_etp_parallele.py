@@ -0,0 +1,85 @@
+'''Temps du calcul de l'ETP horaire en série et par blocs en parallèle.
+
+Des séries horaires synthétiques sont créées pour plusieurs sites et
+plusieurs années. L'ETP est calculée en série (etp.calcul_etp site par
+site) puis par etp_parallele.calcul_etp_sites avec 1 à N processus.
+Le script affiche le temps et l'accélération de chaque calcul et
+vérifie que le résultat parallèle est identique au résultat en série.
+
+Utilisation : python benchmarks/bench_etp_parallele.py [nombre_sites] [nombre_annees] [nombre_processus_max]
+'''
+import os
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import etp
+import etp_parallele
+
+# Nombre de sites et d'années par défaut
+NOMBRE_SITES = 8
+NOMBRE_ANNEES = 5
+
+# Première année de la période
+ANNEE_DEB = 2000
+
+
+def creer_donnee(nombre_sites, nombre_annees):
+    '''Dates, entrées (sites x heures x variables) et sites synthétiques.'''
+    temps = pd.date_range(f'{ANNEE_DEB}-01-01',
+                          f'{ANNEE_DEB + nombre_annees - 1}-12-31 23:00',
+                          freq='h', tz='UTC')
+    rng = np.random.default_rng(0)
+    forme = (nombre_sites, len(temps))
+    heures = temps.hour.to_numpy()
+    jour = np.clip(np.sin((heures - 6) / 12 * np.pi), 0., None)
+    variables = {
+        'vitesse_vent_10m': 5. * rng.random(forme),
+        'temperature_2m': 275. + 20. * rng.random(forme),
+        'humidite_relative': 0.3 + 0.7 * rng.random(forme),
+        'rayonnement_global': 3.e6 * jour * rng.random(forme)}
+    donnee = np.stack([variables[_] for _ in etp_parallele.VARIABLES], axis=-1)
+    sites = np.column_stack([rng.uniform(42., 51., nombre_sites),
+                             rng.uniform(-4., 8., nombre_sites),
+                             rng.uniform(0., 1500., nombre_sites)])
+
+    return temps, donnee, sites
+
+
+def calcul_serie(temps, donnee, sites):
+    return np.stack([etp.calcul_etp(pd.DataFrame(
+        donnee[i_site], index=temps, columns=etp_parallele.VARIABLES),
+        *site).to_numpy() for i_site, site in enumerate(sites)])
+
+
+if __name__ == '__main__':
+    nombre_sites = int(sys.argv[1]) if len(sys.argv) > 1 else NOMBRE_SITES
+    nombre_annees = int(sys.argv[2]) if len(sys.argv) > 2 else NOMBRE_ANNEES
+    nombre_processus_max = (int(sys.argv[3]) if len(sys.argv) > 3
+                            else os.cpu_count())
+    temps, donnee, sites = creer_donnee(nombre_sites, nombre_annees)
+    print(f"{nombre_sites} sites x {nombre_annees} années horaires "
+          f"({nombre_sites * nombre_annees} blocs)")
+
+    debut = time.perf_counter()
+    etp_serie = calcul_serie(temps, donnee, sites)
+    duree_serie = time.perf_counter() - debut
+    print(f"{'série':<14} {duree_serie:8.2f} s")
+
+    nombre_processus = 1
+    while True:
+        debut = time.perf_counter()
+        etp_sites = etp_parallele.calcul_etp_sites(
+            temps, donnee, sites, max_workers=nombre_processus)
+        duree = time.perf_counter() - debut
+        identique = np.array_equal(etp_sites, etp_serie, equal_nan=True)
+        print(f"{nombre_processus:3d} processus {duree:8.2f} s "
+              f"x{duree_serie / duree:5.2f} "
+              f"{'identique' if identique else 'DIFFÉRENT'}")
+        if nombre_processus >= nombre_processus_max:
+            break
+        nombre_processus = min(2 * nombre_processus, nombre_processus_max)
@@ -0,0 +1,110 @@
+'''Temps de construction et de lecture de l'index des normales climatologiques.
+
+Une série journalière synthétique d'ETP et de précipitation est créée
+sur plusieurs années. L'index des normales est construit par l'étape
+de la chaîne de climatologie (pipeline.etape_normales, client DPClim)
+dans un dossier temporaire, puis relu comme le fait l'application
+(client DPPaquetObs). La normale et l'anomalie de dates tirées au
+hasard sont lues date par date et pour toutes les dates à la fois. Le
+script affiche ces temps, les compare au calcul direct de la normale
+dans l'historique et vérifie qu'ils donnent la même valeur.
+
+Utilisation : python benchmarks/bench_normales.py [nombre_annees]
+'''
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import meteofrance
+import normales
+import pipeline
+
+# Nombre d'années de la série par défaut
+NOMBRE_ANNEES = 30
+
+# Nombre de dates lues
+NOMBRE_DATES = 10000
+
+# Site de l'index
+SITE = 'Site de test'
+
+# API et fréquence de la chaîne de climatologie qui construit l'index
+METEOFRANCE_API = 'DPClim'
+METEOFRANCE_FREQUENCE = 'quotidienne'
+
+
+def creer_serie(nombre_annees, rng):
+    '''ETP saisonnière et précipitation intermittente journalières.'''
+    dates = pd.date_range(end='2024-12-31', periods=nombre_annees * 365,
+                          freq='D')
+    saison = np.sin(2. * np.pi * (dates.dayofyear.to_numpy() - 100) / 365.)
+
+    return pd.DataFrame({
+        'etp': 3. + 2. * saison + rng.random(len(dates)),
+        'precipitation': 10. * rng.random(len(dates)) * (
+            rng.random(len(dates)) > 0.7)}, index=dates)
+
+
+def normale_directe(df, date, variable, demi_fenetre):
+    '''Normale calculée dans l'historique (sans index).'''
+    ecart = np.abs(normales.jours_annee(df.index) - normales.jour_annee(date))
+    ecart = np.minimum(ecart, normales.NOMBRE_JOURS - ecart)
+
+    return df.loc[ecart <= demi_fenetre, variable].mean()
+
+
+if __name__ == '__main__':
+    nombre_annees = (int(sys.argv[1]) if len(sys.argv) > 1
+                     else NOMBRE_ANNEES)
+    rng = np.random.default_rng(0)
+    df = creer_serie(nombre_annees, rng)
+    dates = df.index[rng.integers(len(df), size=NOMBRE_DATES)]
+    print(f"{nombre_annees} années, {NOMBRE_DATES} dates lues")
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        # Stockage local (data/) dans le dossier temporaire
+        os.chdir(dirpath)
+        client = meteofrance.Client(METEOFRANCE_API)
+
+        debut = time.perf_counter()
+        sortie = pipeline.etape_normales(
+            client, METEOFRANCE_FREQUENCE, df, SITE)
+        print(f"{'construction':<22} {time.perf_counter() - debut:8.3f} s")
+
+        # Lecture par l'application (viewer_bilan_observations)
+        debut = time.perf_counter()
+        index_normales = normales.lire_normales(SITE)
+        print(f"{'ouverture':<22} "
+              f"{(time.perf_counter() - debut) * 1e3:8.3f} ms")
+        if index_normales.filepath.resolve() != Path(
+                sortie['filepath']).resolve():
+            raise RuntimeError(
+                f"L'application lit {index_normales.filepath} et non "
+                f"l'index construit {sortie['filepath']}.")
+
+        debut = time.perf_counter()
+        for date in dates:
+            index_normales.anomalie(date, 4., 'etp')
+        duree = (time.perf_counter() - debut) / len(dates)
+        print(f"{'anomalie par date':<22} {duree * 1e6:8.2f} µs")
+
+        debut = time.perf_counter()
+        s_anomalies = index_normales.anomalies(df.loc[dates, 'etp'])
+        duree = time.perf_counter() - debut
+        print(f"{'anomalies vectorisées':<22} {duree * 1e3:8.3f} ms "
+              f"({len(s_anomalies)} dates)")
+
+        debut = time.perf_counter()
+        normale = normale_directe(df, dates[0], 'etp',
+                                  normales.DEMI_FENETRE_JOURS)
+        duree = time.perf_counter() - debut
+        print(f"{'calcul direct':<22} {duree * 1e3:8.3f} ms par date")
+
+        ecart = abs(index_normales.normale(dates[0], 'etp') - normale)
+        print(f"écart index - calcul direct : {ecart:.2e} mm")
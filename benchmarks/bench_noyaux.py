@@ -0,0 +1,111 @@
+'''Temps des noyaux fusionnés de l'ETP et du bilan face à la référence.
+
+L'ETP horaire (géométrie solaire et clareté déjà calculées) et le
+bilan journalier sont calculés sur des séries synthétiques par
+l'implémentation de référence (etp.calcul_etp_clarete,
+bilan.calcul_bilan) puis par chaque moteur de noyaux disponible. Le
+script affiche le meilleur temps de chaque calcul et l'écart maximal
+à la référence.
+
+Utilisation : python benchmarks/bench_noyaux.py [nombre_annees]
+'''
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+RACINE = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RACINE))
+import bilan
+import etp
+import noyaux
+
+# Nombre d'années horaires par défaut
+NOMBRE_ANNEES = 20
+
+# Nombre de répétitions de chaque calcul (le meilleur temps est gardé)
+REPETITIONS = 5
+
+# Site (latitude, longitude, altitude)
+SITE = (45., 5., 200.)
+
+# Paramètres du bilan (sol, culture et irrigation), au premier stade
+PARAMETRES_BILAN = dict(
+    texture='Terres limoneuses', fraction_cailloux=0.1, culture='Tomate',
+    fraction_ru_remplie=0.8, ru_vers_rfu=0.66, seuil_irrigation=-5.,
+    hauteur_vers_duree_irrigation=2.)
+
+
+def creer_donnee(nombre_annees):
+    '''Donnée horaire synthétique en unités SI et donnée journalière du bilan.'''
+    temps = pd.date_range('2000-01-01',
+                          f'{2000 + nombre_annees - 1}-12-31 23:00',
+                          freq='h', tz='UTC')
+    rng = np.random.default_rng(0)
+    n = len(temps)
+    jour = np.clip(np.sin((temps.hour.to_numpy() - 6) / 12 * np.pi), 0., None)
+    df = pd.DataFrame({
+        'vitesse_vent_10m': 5. * rng.random(n),
+        'temperature_2m': 275. + 20. * rng.random(n),
+        'humidite_relative': 0.3 + 0.7 * rng.random(n),
+        'rayonnement_global': 3.e6 * jour * rng.random(n)}, index=temps)
+    df_jour = pd.DataFrame({
+        'etp': 0.1 * df['temperature_2m'].resample('D').mean() - 25.,
+        'precipitation': 10. * (rng.random(n // 24) > 0.7)})
+
+    return df, df_jour
+
+
+def meilleur_temps(calcul):
+    durees = []
+    for _ in range(REPETITIONS):
+        debut = time.perf_counter()
+        resultat = calcul()
+        durees.append(time.perf_counter() - debut)
+
+    return min(durees), resultat
+
+
+def afficher(nom, duree, duree_ref, ecart):
+    print(f"{nom:<24} {duree * 1e3:9.2f} ms x{duree_ref / duree:6.2f} "
+          f"écart max {ecart:.2e}")
+
+
+if __name__ == '__main__':
+    nombre_annees = int(sys.argv[1]) if len(sys.argv) > 1 else NOMBRE_ANNEES
+    df, df_jour = creer_donnee(nombre_annees)
+    site = etp.creer_site(*SITE)
+    zenith, clarete = etp.calcul_clarete(df, site)
+    # Numba n'est mesuré que s'il est installé (moteur par défaut)
+    moteurs = noyaux.MOTEURS if noyaux.MOTEUR == 'numba' else ['numpy']
+    print(f"{len(df)} heures, {len(df_jour)} jours, moteurs {moteurs}")
+
+    duree_ref, etp_ref = meilleur_temps(
+        lambda: etp.calcul_etp_clarete(df, site, zenith, clarete))
+    afficher('etp référence', duree_ref, duree_ref, 0.)
+    for moteur in moteurs:
+        # Compilation éventuelle hors mesure
+        noyaux.calcul_etp_clarete(df.iloc[:24], site, zenith.iloc[:24],
+                                  clarete.iloc[:24], moteur=moteur)
+        duree, etp_noyau = meilleur_temps(lambda: noyaux.calcul_etp_clarete(
+            df, site, zenith, clarete, moteur=moteur))
+        afficher(f'etp {moteur}', duree, duree_ref,
+                 np.nanmax(np.abs(etp_noyau - etp_ref)))
+
+    # Le fichier des coefficients culturaux est lu depuis la racine
+    bilan.FILEPATH_KC = RACINE / bilan.FILEPATH_KC
+    PARAMETRES_BILAN['stade'] = next(iter(
+        bilan.lire_kc()[PARAMETRES_BILAN['culture']]))
+    duree_ref, df_ref = meilleur_temps(
+        lambda: bilan.calcul_bilan(df_jour, **PARAMETRES_BILAN))
+    afficher('bilan référence', duree_ref, duree_ref, 0.)
+    for moteur in moteurs:
+        noyaux.calcul_bilan(df_jour.iloc[:2], **PARAMETRES_BILAN,
+                            moteur=moteur)
+        duree, df_noyau = meilleur_temps(lambda: noyaux.calcul_bilan(
+            df_jour, **PARAMETRES_BILAN, moteur=moteur))
+        ecart = np.nanmax(np.abs(
+            df_noyau['duree_irrigation'] - df_ref['duree_irrigation']))
+        afficher(f'bilan {moteur}', duree, duree_ref, ecart)
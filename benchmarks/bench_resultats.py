@@ -0,0 +1,78 @@
+'''Temps d'enregistrement et de requête des résultats du bilan par parcelle.
+
+Des bilans journaliers synthétiques sont enregistrés pour de nombreuses
+parcelles dans une base temporaire, puis les bilans du dernier jour
+sont mis à jour (recalcul quotidien). Le script affiche ces temps et
+la latence médiane et maximale de la liste des parcelles à irriguer
+du jour (resultats.irrigations_du_jour).
+
+Utilisation : python benchmarks/bench_resultats.py [nombre_parcelles] [nombre_jours]
+'''
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import resultats
+
+# Nombre de parcelles et de jours par défaut
+NOMBRE_PARCELLES = 1000
+NOMBRE_JOURS = 365
+
+# Nombre de requêtes de la liste du jour
+NOMBRE_REQUETES = 100
+
+# Seuil d'irrigation (mm) et facteur de durée (min mm-1) des bilans
+SEUIL_IRRIGATION = -5.
+HAUTEUR_VERS_DUREE_IRRIGATION = 2.
+
+
+def creer_bilans(nombre_parcelles, nombre_jours):
+    '''Bilans synthétiques indexés par parcelle et par date.'''
+    dates = pd.date_range(end=pd.Timestamp.now().normalize(),
+                          periods=nombre_jours)
+    index = pd.MultiIndex.from_product(
+        [[f'parcelle_{_:05d}' for _ in range(nombre_parcelles)], dates],
+        names=['parcelle', 'date'])
+    besoin = np.random.default_rng(0).normal(-8., 5., len(index))
+    irrigation = besoin > SEUIL_IRRIGATION
+
+    return pd.DataFrame({
+        'besoin_irrigation': besoin,
+        'irrigation': irrigation,
+        'duree_irrigation': HAUTEUR_VERS_DUREE_IRRIGATION * np.where(
+            irrigation, besoin, 0.)}, index=index)
+
+
+if __name__ == '__main__':
+    nombre_parcelles = (int(sys.argv[1]) if len(sys.argv) > 1
+                        else NOMBRE_PARCELLES)
+    nombre_jours = int(sys.argv[2]) if len(sys.argv) > 2 else NOMBRE_JOURS
+    df_bilans = creer_bilans(nombre_parcelles, nombre_jours)
+    date = df_bilans.index.get_level_values('date').max()
+    print(f"{nombre_parcelles} parcelles x {nombre_jours} jours")
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = Path(dirpath) / resultats.NOM_FICHIER_RESULTATS
+        debut = time.perf_counter()
+        resultats.enregistrer_bilans(df_bilans, filepath=filepath)
+        print(f"{'enregistrement':<22} {time.perf_counter() - debut:8.3f} s")
+
+        debut = time.perf_counter()
+        resultats.enregistrer_bilans(
+            df_bilans.xs(date, level='date', drop_level=False),
+            filepath=filepath)
+        print(f"{'mise à jour du jour':<22} {time.perf_counter() - debut:8.3f} s")
+
+        durees = []
+        for _ in range(NOMBRE_REQUETES):
+            debut = time.perf_counter()
+            df_jour = resultats.irrigations_du_jour(date, filepath=filepath)
+            durees.append(time.perf_counter() - debut)
+        print(f"{'liste du jour':<22} {np.median(durees) * 1e3:8.2f} ms "
+              f"(médiane), {max(durees) * 1e3:.2f} ms (max), "
+              f"{len(df_jour)} parcelles à irriguer")
@@ -0,0 +1,141 @@
+'''Latences du service HTTP local sous des demandes simultanées.
+
+Un stockage local synthétique (liste des stations et paquets horaires
+de deux départements) est créé dans un dossier temporaire. Le service
+y est démarré dans le processus, puis des vagues de demandes
+simultanées sont envoyées à /meteo et /bilan pour plusieurs sites :
+la première vague calcule (demandes regroupées), les suivantes sont
+servies par le cache. Le script affiche les latences p50/p99 et les
+compteurs des caches rapportés par /statistiques.
+
+Utilisation : python benchmarks/bench_service_api.py [nombre_sites] [nombre_demandes]
+'''
+import asyncio
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+
+RACINE = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RACINE))
+import bilan
+import meteofrance
+import service_api
+
+# Nombre de sites et de demandes simultanées par site par défaut
+NOMBRE_SITES = 4
+NOMBRE_DEMANDES = 25
+
+# Nombre de vagues de demandes
+NOMBRE_VAGUES = 3
+
+# Départements et nombre de stations par département
+DEPARTEMENTS = [13, 84]
+NOMBRE_STATIONS_DEPARTEMENT = 30
+
+# Paramètres du bilan
+PARAMETRES_BILAN = {
+    'texture': 'Terres limoneuses', 'fraction_cailloux': 0.1,
+    'culture': 'Tomate', 'fraction_ru_remplie': 1., 'ru_vers_rfu': 0.67,
+    'seuil_irrigation': 0.1, 'hauteur_vers_duree_irrigation': 10}
+
+
+def creer_stockage(client, heure):
+    '''Liste des stations et paquets des dernières 24 h des départements.'''
+    rng = np.random.default_rng(0)
+    id_stations = np.concatenate([
+        id_dep * 1000000 + 1000 + np.arange(NOMBRE_STATIONS_DEPARTEMENT)
+        for id_dep in DEPARTEMENTS])
+    lat_label, lon_label = client.latlon_labels
+    df_liste_stations = pd.DataFrame({
+        lat_label: rng.uniform(43.3, 44.2, len(id_stations)),
+        lon_label: rng.uniform(4.5, 5.5, len(id_stations)),
+        client.altitude_label: rng.uniform(0., 800., len(id_stations))},
+        index=pd.Index(id_stations, name=client.id_station_label))
+    df_liste_stations.to_csv(meteofrance.get_filepath_liste_stations(client))
+
+    temps = pd.date_range(end=heure, periods=24, freq='h')
+    jour = np.clip(np.sin((temps.hour.to_numpy() - 6) / 12 * np.pi), 0., None)
+    labels = client.variables_labels[service_api.METEOFRANCE_FREQUENCE]
+    for id_dep in DEPARTEMENTS:
+        stations = id_stations[id_stations // 1000000 == id_dep]
+        index = pd.MultiIndex.from_product(
+            [stations, temps],
+            names=[client.id_station_donnee_label, client.time_label])
+        forme = (len(stations), len(temps))
+        df = pd.DataFrame({
+            labels['rayonnement_global']: (
+                3.e6 * jour * rng.random(forme)).ravel(),
+            labels['temperature_2m']: 285. + 10. * rng.random(len(index)),
+            labels['humidite_relative']: 40. + 60. * rng.random(len(index)),
+            labels['vitesse_vent_10m']: 5. * rng.random(len(index)),
+            labels['precipitation']: rng.random(len(index)) * (
+                rng.random(len(index)) > 0.9)}, index=index)
+        df.to_pickle(meteofrance.get_filepath_paquet(
+            client, id_dep, heure, frequence=service_api.METEOFRANCE_FREQUENCE))
+
+
+async def demander(client_http, url):
+    reponse = await client_http.fetch(url, raise_error=False)
+    if reponse.code != 200:
+        raise RuntimeError(f"{url} : {reponse.code} {reponse.body.decode()}")
+
+    return json.loads(reponse.body)
+
+
+async def executer(nombre_sites, nombre_demandes):
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.netutil import bind_sockets
+    from tornado.httpserver import HTTPServer
+
+    service = service_api.Service()
+    heure = meteofrance.get_heure_publication()
+    creer_stockage(service.client, heure)
+
+    sockets = bind_sockets(0, service_api.ADRESSE)
+    port = sockets[0].getsockname()[1]
+    serveur = HTTPServer(service_api.creer_application(service))
+    serveur.add_sockets(sockets)
+    base = f"http://{service_api.ADRESSE}:{port}"
+
+    stade = next(iter(bilan.lire_kc()[PARAMETRES_BILAN['culture']]))
+    urls = []
+    for lat, lon in zip(np.linspace(43.5, 44., nombre_sites),
+                        np.linspace(4.7, 5.3, nombre_sites)):
+        site = {'lat': round(lat, 4), 'lon': round(lon, 4), 'altitude': 100.}
+        urls.append(f"{base}/meteo?{urlencode(site)}")
+        urls.append(f"{base}/bilan?" + urlencode(
+            {**site, **PARAMETRES_BILAN, 'stade': stade}))
+
+    client_http = AsyncHTTPClient(max_clients=nombre_demandes * len(urls))
+    for vague in range(NOMBRE_VAGUES):
+        reponses = await asyncio.gather(*[
+            demander(client_http, url)
+            for url in urls for _ in range(nombre_demandes)])
+        print(f"vague {vague + 1} : {len(reponses)} demandes")
+    statistiques = await demander(client_http, f"{base}/statistiques")
+    serveur.stop()
+
+    for route, latences in statistiques['latences'].items():
+        print(f"{route:<10} {latences['nombre']:6d} demandes "
+              f"p50 {latences['p50_ms']:8.2f} ms p99 {latences['p99_ms']:8.2f} ms")
+    for nom, compteurs in statistiques['caches'].items():
+        print(f"cache {nom:<9} " + ' '.join(
+            f"{cle} {valeur}" for cle, valeur in compteurs.items()))
+
+
+if __name__ == '__main__':
+    nombre_sites = int(sys.argv[1]) if len(sys.argv) > 1 else NOMBRE_SITES
+    nombre_demandes = (int(sys.argv[2]) if len(sys.argv) > 2
+                       else NOMBRE_DEMANDES)
+    # Le fichier des coefficients culturaux est lu depuis la racine
+    bilan.FILEPATH_KC = RACINE / bilan.FILEPATH_KC
+    with tempfile.TemporaryDirectory() as dirpath:
+        # Stockage local (data/) dans le dossier temporaire
+        os.chdir(dirpath)
+        asyncio.run(executer(nombre_sites, nombre_demandes))
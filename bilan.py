@@ -1,3 +1,4 @@
+from functools import cache
 import json
 import numpy as np
 import pandas as pd
@@ -7,9 +8,17 @@ from pathlib import Path
 # Coefficients culturaux (KC) par culture et par stade
 FILEPATH_KC = Path("coefficients_culturaux_ardepi.json")
 
-# Lecture des coefficients culturaux
-with open(FILEPATH_KC) as f:
-    KC = json.load(f)
+@cache
+def lire_kc():
+    '''Lecture des coefficients culturaux à la première utilisation.'''
+    with open(FILEPATH_KC) as f:
+        return json.load(f)
+
+def __getattr__(name):
+    # bilan.KC reste disponible sans lecture du fichier à l'import
+    if name == 'KC':
+        return lire_kc()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Réserve Utile (RU) par cm de terre fine (mm/cm de terre fine) en fonction de la texture du sol
 RU_PAR_CM_DE_TF = {
@@ -78,7 +87,7 @@ def calcul_reserve_facilement_utilisable(ru_remplie, ru_vers_rfu):
 def calcul_etm_culture(culture, stade, df_meteo):
     ''' Calcul de l'évalotranspiration maximale de la culture (mm).'''
     # KC de la culture pour ce stade
-    kc_culture = KC[culture][stade]
+    kc_culture = lire_kc()[culture][stade]
 
     etm_culture = kc_culture * df_meteo['etp']
 
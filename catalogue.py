@@ -0,0 +1,340 @@
+from contextlib import closing
+import os
+from pathlib import Path
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+
+import meteofrance
+import stockage
+
+# Fichier SQLite du catalogue des données locales
+NOM_FICHIER_CATALOGUE = 'catalogue.sqlite'
+
+# Fréquence des fichiers dont le nom ne la précise pas
+FREQUENCE_DEFAUT = 'horaire'
+
+# Pas de temps des données en fonction de la fréquence Météo-France
+FREQ_FREQUENCE = {
+    'horaire': 'h',
+    'quotidienne': 'D',
+    'quotidienne_estimee': 'D'
+}
+
+# Motif des noms de fichiers de meteofrance.get_filepath_donnee_periode
+MOTIF_FICHIER_DONNEE = re.compile(
+    r"donnees_(?P<api>[^_]+)"
+    r"(?:_(?P<frequence>horaire|quotidienne_estimee|quotidienne))?"
+    r"_(?P<site>.+)_nn(?P<nn_nombre>\d+)"
+    r"(?:_(?P<date_deb>\d{8}T\d{6}Z?))?(?:_(?P<date_fin>\d{8}T\d{6}Z?))?"
+    r"(?:_(?P<empreinte>[0-9a-f]+))?"
+    r"_(?P<type>ref|stations)\.csv")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fichiers (
+    id INTEGER PRIMARY KEY,
+    chemin TEXT UNIQUE NOT NULL,
+    api TEXT NOT NULL,
+    frequence TEXT,
+    site TEXT,
+    ref INTEGER NOT NULL,
+    nn_nombre INTEGER,
+    date_deb TEXT,
+    date_fin TEXT,
+    date_modification REAL
+);
+CREATE TABLE IF NOT EXISTS couvertures (
+    fichier_id INTEGER NOT NULL REFERENCES fichiers(id) ON DELETE CASCADE,
+    id_station INTEGER,
+    date_deb TEXT NOT NULL,
+    date_fin TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_couvertures_station
+    ON couvertures (id_station, date_deb, date_fin);
+CREATE INDEX IF NOT EXISTS idx_fichiers_api
+    ON fichiers (api, frequence, ref, site);
+'''
+
+# Catalogues (chemin, inode) déjà initialisés par le processus
+_CATALOGUES_INITIALISES = set()
+
+def get_filepath_catalogue():
+    meteofrance.DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+    return meteofrance.DATA_DIR / NOM_FICHIER_CATALOGUE
+
+def connexion(filepath=None):
+    '''Connexion au catalogue, créé au besoin.
+
+    Le journal et le schéma ne sont initialisés qu'à la première
+    connexion du processus à un fichier.
+    '''
+    if filepath is None:
+        filepath = get_filepath_catalogue()
+    con = sqlite3.connect(filepath, timeout=30.)
+    # Réglage propre à chaque connexion
+    con.execute('PRAGMA foreign_keys = ON')
+    cle = (str(Path(filepath).resolve()), os.stat(filepath).st_ino)
+    if cle not in _CATALOGUES_INITIALISES:
+        # Journal WAL (gardé par le fichier) : lectures concurrentes des
+        # écritures des autres processus
+        con.execute('PRAGMA journal_mode = WAL')
+        con.executescript(SCHEMA)
+        _CATALOGUES_INITIALISES.add(cle)
+
+    return con
+
+def _vers_iso(date):
+    '''Date UTC au format ISO (triable comme une chaîne).'''
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        date = date.tz_localize(meteofrance.TZ)
+
+    return date.tz_convert(meteofrance.TZ).isoformat()
+
+def intervalles_continus(temps, freq='h'):
+    '''Intervalles [début, fin] des pas de temps consécutifs d'un indice temporel.'''
+    temps = pd.DatetimeIndex(temps).unique().sort_values()
+    if len(temps) == 0:
+        return []
+    ruptures = np.flatnonzero(np.diff(temps.asi8) != pd.Timedelta(
+        1, unit=freq).value) + 1
+    debuts = np.concatenate([[0], ruptures])
+    fins = np.concatenate([ruptures - 1, [len(temps) - 1]])
+
+    return [(temps[d], temps[f]) for d, f in zip(debuts, fins)]
+
+def enregistrer_fichier(client, filepath, df, ref_station_name=None,
+                        frequence=None, ref=False, nn_nombre=None,
+                        intervalle=None, id_stations=None,
+                        filepath_catalogue=None):
+    '''Enregistrement (ou mise à jour) d'un fichier de donnée et de sa couverture.
+
+    La couverture est enregistrée par station (indice station, date)
+    ou pour le site de référence (indice date seul) sous forme
+    d'intervalles de pas de temps consécutifs. Avec intervalle (début,
+    fin) d'un téléchargement, la couverture de chaque station demandée
+    (id_stations, celles de df par défaut) est tout l'intervalle : les
+    heures sans donnée chez Météo-France ne sont pas redemandées.
+    '''
+    frequence = frequence or FREQUENCE_DEFAUT
+    freq = FREQ_FREQUENCE[frequence]
+    if intervalle is not None:
+        if id_stations is None:
+            id_stations = df.index.unique(level=client.id_station_donnee_label)
+        couvertures = [(None if ref else int(id_station), [intervalle])
+                       for id_station in ([None] if ref else id_stations)]
+        date_deb, date_fin = intervalle
+    else:
+        temps = df.index.get_level_values(client.time_label)
+        if ref:
+            couvertures = [(None, intervalles_continus(df.index, freq))]
+        else:
+            id_stations = df.index.get_level_values(
+                client.id_station_donnee_label)
+            couvertures = [
+                (int(id_station), intervalles_continus(temps[id_stations == id_station], freq))
+                for id_station in id_stations.unique()]
+        date_deb, date_fin = temps.min(), temps.max()
+    site = (None if ref_station_name is None
+            else ref_station_name.lower().replace(' ', ''))
+
+    with closing(connexion(filepath_catalogue)) as con, con:
+        con.execute('DELETE FROM fichiers WHERE chemin = ?', (str(filepath),))
+        curseur = con.execute(
+            'INSERT INTO fichiers (chemin, api, frequence, site, ref, nn_nombre, '
+            'date_deb, date_fin, date_modification) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(filepath), client.api, frequence, site, int(ref), nn_nombre,
+             _vers_iso(date_deb), _vers_iso(date_fin),
+             filepath.stat().st_mtime if filepath.exists() else None))
+        fichier_id = curseur.lastrowid
+        con.executemany(
+            'INSERT INTO couvertures (fichier_id, id_station, date_deb, date_fin) '
+            'VALUES (?, ?, ?, ?)',
+            [(fichier_id, id_station, _vers_iso(deb), _vers_iso(fin))
+             for id_station, intervalles in couvertures
+             for deb, fin in intervalles])
+
+def indexer_dossier(client, filepath_catalogue=None):
+    '''Enregistrement des fichiers de donnée de data/<api>/ absents du catalogue ou modifiés.'''
+    parent = meteofrance.DATA_DIR / client.api
+    with closing(connexion(filepath_catalogue)) as con, con:
+        dates_modification = dict(con.execute(
+            'SELECT chemin, date_modification FROM fichiers WHERE api = ?',
+            (client.api,)).fetchall())
+
+    for filepath in sorted(parent.glob('donnees_*.csv')):
+        correspondance = MOTIF_FICHIER_DONNEE.fullmatch(filepath.name)
+        if ((correspondance is None) or
+            (dates_modification.get(str(filepath)) == filepath.stat().st_mtime)):
+            continue
+        ref = correspondance['type'] == 'ref'
+        index_col = ([client.time_label] if ref else
+                     [client.id_station_donnee_label, client.time_label])
+        df = pd.read_csv(filepath, parse_dates=[client.time_label],
+                         index_col=index_col, usecols=index_col)
+        enregistrer_fichier(
+            client, filepath, df, ref_station_name=correspondance['site'],
+            frequence=correspondance['frequence'], ref=ref,
+            nn_nombre=int(correspondance['nn_nombre']),
+            filepath_catalogue=filepath_catalogue)
+
+def _requete_couvertures(client, id_stations, date_deb, date_fin,
+                         frequence=None, ref=False, site=None, nn_nombre=None,
+                         filepath_catalogue=None):
+    '''Intervalles enregistrés recoupant la période.
+
+    La sélection se fait par stations (toutes si id_stations est None)
+    ou, pour les fichiers de référence, par site et nombre de stations.
+    '''
+    requete = ('SELECT f.chemin, f.date_modification, '
+               'c.id_station, c.date_deb, c.date_fin '
+               'FROM couvertures c JOIN fichiers f ON c.fichier_id = f.id '
+               'WHERE f.api = ? AND f.frequence = ? AND f.ref = ? '
+               'AND c.date_deb <= ? AND c.date_fin >= ?')
+    params = [client.api, frequence or FREQUENCE_DEFAUT, int(ref),
+              _vers_iso(date_fin), _vers_iso(date_deb)]
+    if (id_stations is not None) and not ref:
+        id_stations = [int(_) for _ in id_stations]
+        requete += f" AND c.id_station IN ({', '.join('?' * len(id_stations))})"
+        params += id_stations
+    if site is not None:
+        requete += ' AND f.site = ?'
+        params.append(site.lower().replace(' ', ''))
+    if nn_nombre is not None:
+        requete += ' AND f.nn_nombre = ?'
+        params.append(nn_nombre)
+    with closing(connexion(filepath_catalogue)) as con, con:
+        df = pd.read_sql_query(requete, con, params=params)
+    df['date_deb'] = pd.to_datetime(df['date_deb'], utc=True)
+    df['date_fin'] = pd.to_datetime(df['date_fin'], utc=True)
+
+    return df
+
+def fichiers_periode(client, date_deb, date_fin, frequence=None, ref=False,
+                     site=None, nn_nombre=None, filepath_catalogue=None):
+    '''Fichiers recouvrant la période, du plus ancien au plus récent.'''
+    df = _requete_couvertures(
+        client, None, date_deb, date_fin, frequence=frequence, ref=ref,
+        site=site, nn_nombre=nn_nombre, filepath_catalogue=filepath_catalogue)
+    df = df.groupby('chemin').agg(
+        date_modification=('date_modification', 'first'),
+        date_deb=('date_deb', 'min'), date_fin=('date_fin', 'max'))
+
+    return df.sort_values('date_modification')
+
+def stations_disponibles(client, date_deb, date_fin, frequence=None,
+                         filepath_catalogue=None):
+    '''Stations ayant de la donnée sur la période.'''
+    df = _requete_couvertures(
+        client, None, date_deb, date_fin, frequence=frequence,
+        filepath_catalogue=filepath_catalogue)
+
+    return pd.Index(df['id_station'].unique(),
+                    name=client.id_station_donnee_label).sort_values()
+
+def heures_disponibles(client, id_stations, date_deb, date_fin, frequence=None,
+                       filepath_catalogue=None):
+    '''Pas de temps déjà disponibles localement (temps × stations, booléens).'''
+    temps = pd.date_range(pd.Timestamp(_vers_iso(date_deb)),
+                          pd.Timestamp(_vers_iso(date_fin)),
+                          freq=FREQ_FREQUENCE[frequence or FREQUENCE_DEFAUT])
+    disponibles = pd.DataFrame(False, index=temps, columns=list(id_stations))
+    df_couvertures = _requete_couvertures(
+        client, id_stations, date_deb, date_fin, frequence=frequence,
+        filepath_catalogue=filepath_catalogue)
+    for id_station, deb, fin in df_couvertures[
+        ['id_station', 'date_deb', 'date_fin']].itertuples(index=False):
+        i_deb = temps.searchsorted(deb)
+        i_fin = temps.searchsorted(fin, side='right')
+        disponibles.iloc[i_deb:i_fin, disponibles.columns.get_loc(id_station)] = True
+
+    return disponibles
+
+def intervalles_manquants(client, id_stations, date_deb, date_fin,
+                          frequence=None, filepath_catalogue=None):
+    '''Intervalles à télécharger par station (colonnes id_station, date_deb, date_fin).'''
+    disponibles = heures_disponibles(
+        client, id_stations, date_deb, date_fin, frequence=frequence,
+        filepath_catalogue=filepath_catalogue)
+    freq = FREQ_FREQUENCE[frequence or FREQUENCE_DEFAUT]
+    lignes = [(id_station, deb, fin)
+              for id_station, s in disponibles.items()
+              for deb, fin in intervalles_continus(s.index[~s.values], freq)]
+
+    return pd.DataFrame(lignes, columns=['id_station', 'date_deb', 'date_fin'])
+
+def lire_donnee(client, id_stations, date_deb, date_fin, frequence=None,
+                ref=False, site=None, nn_nombre=None, filepath_catalogue=None):
+    '''Lecture de la donnée sur la période à partir des fichiers du catalogue.
+
+    Les fichiers recouvrant la période sont lus et fusionnés sans
+    duplicatas (le plus récent l'emporte). Avec ref=True, la donnée
+    interpolée du site (indice date seul) est lue.
+    '''
+    df_couvertures = _requete_couvertures(
+        client, id_stations, date_deb, date_fin, frequence=frequence, ref=ref,
+        site=site, nn_nombre=nn_nombre, filepath_catalogue=filepath_catalogue)
+    df_couvertures = df_couvertures.sort_values('date_modification')
+    index_col = ([client.time_label] if ref else
+                 [client.id_station_donnee_label, client.time_label])
+    l_df = []
+    for chemin in df_couvertures['chemin'].unique():
+        df_fichier = pd.read_csv(chemin, parse_dates=[client.time_label],
+                                 index_col=index_col)
+        l_df.append(df_fichier)
+    df = meteofrance.concatener(l_df)
+    if len(df) == 0:
+        return df
+
+    # Sélection des stations et de la période, sans duplicatas
+    temps = df.index.get_level_values(client.time_label)
+    if temps.tz is None:
+        temps = temps.tz_localize(meteofrance.TZ)
+    selection = ((temps >= pd.Timestamp(_vers_iso(date_deb))) &
+                 (temps <= pd.Timestamp(_vers_iso(date_fin))))
+    if (id_stations is not None) and not ref:
+        selection &= df.index.get_level_values(
+            client.id_station_donnee_label).isin(id_stations)
+    df = df[selection]
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+
+    return df
+
+def completer_donnee(client, ref_station_name, df_liste_stations, date_deb,
+                     date_fin, frequence=None, variables=None,
+                     read_csv_kwargs={}, filepath_catalogue=None):
+    '''Téléchargement des seuls intervalles manquants puis lecture de la période.
+
+    Les stations ayant les mêmes intervalles manquants sont demandées
+    ensemble. Chaque téléchargement est sauvegardé, dans un fichier
+    propre au groupe de stations (empreinte de leurs identifiants), et
+    enregistré dans le catalogue (intervalle demandé) avant la lecture
+    de toute la période depuis le disque.
+    '''
+    df_manquants = intervalles_manquants(
+        client, df_liste_stations.index, date_deb, date_fin,
+        frequence=frequence, filepath_catalogue=filepath_catalogue)
+    for (deb, fin), df_groupe in df_manquants.groupby(['date_deb', 'date_fin']):
+        df_liste_stations_groupe = df_liste_stations.loc[df_groupe['id_station']]
+        str_deb = deb.isoformat().replace("+00:00", "Z")
+        str_fin = fin.isoformat().replace("+00:00", "Z")
+        df = meteofrance.compiler_telechargement_des_stations_periode(
+            client, df_liste_stations_groupe, str_deb, str_fin,
+            frequence=frequence, variables=variables,
+            read_csv_kwargs=read_csv_kwargs)
+        if variables is not None:
+            df = df[variables]
+        filepath = meteofrance.get_filepath_donnee_periode(
+            client, ref_station_name, df_liste_stations_groupe, str_deb, str_fin,
+            frequence=frequence, empreinte=True)
+        stockage.ecrire_csv(df, filepath)
+        enregistrer_fichier(
+            client, filepath, df, ref_station_name=ref_station_name,
+            frequence=frequence, nn_nombre=len(df_liste_stations_groupe),
+            intervalle=(deb, fin), id_stations=df_groupe['id_station'],
+            filepath_catalogue=filepath_catalogue)
+
+    return lire_donnee(client, df_liste_stations.index, date_deb, date_fin,
+                       frequence=frequence, filepath_catalogue=filepath_catalogue)
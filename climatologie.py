@@ -0,0 +1,121 @@
+'''Climatologie horaire de la station de référence calculée par morceaux.
+
+La période est parcourue morceau par morceau (par mois par défaut). La
+donnée des stations du morceau est lue de la source (cube projeté en
+mémoire ou catalogue), interpolée à la station de référence et
+normalisée. L'ETP est calculée par etp.CalculateurEtp, qui garde d'un
+morceau à l'autre la clareté de jour reportée la nuit. Seules les
+journées complètes sont agrégées, la journée à cheval sur deux
+morceaux étant complétée par le morceau suivant. La mémoire utilisée
+est ainsi bornée par celle d'un morceau et le résultat est celui du
+calcul sur toute la période, aux arrondis float32 près pour une
+donnée lue du cube.
+'''
+import numpy as np
+import pandas as pd
+
+import agregation
+import catalogue
+import etp
+import geo
+import meteofrance
+
+# Fréquence horaire des données des stations
+FREQUENCE = 'horaire'
+
+# Début des morceaux de la période (début de chaque mois)
+FREQ_MORCEAUX = 'MS'
+
+class SourceCatalogue(object):
+    '''Donnée interpolée des morceaux lue à partir des fichiers du catalogue.
+
+    Même interface que cube.CubeStations.interpoler. Seuls les fichiers
+    recouvrant le morceau sont lus.
+    '''
+    def __init__(self, client, frequence=FREQUENCE, filepath_catalogue=None):
+        self.client = client
+        self.frequence = frequence
+        self.filepath_catalogue = filepath_catalogue
+
+    def interpoler(self, s_dist_km, date_deb=None, date_fin=None,
+                   variables=None):
+        df = catalogue.lire_donnee(
+            self.client, s_dist_km.index, date_deb, date_fin,
+            frequence=self.frequence,
+            filepath_catalogue=self.filepath_catalogue)
+        df = df.select_dtypes('number')
+        if variables is not None:
+            df = df[list(variables)]
+
+        return geo.interpolation_inverse_distance_carre(df, s_dist_km)
+
+def decouper_periode(date_deb, date_fin, freq=FREQ_MORCEAUX):
+    '''Bornes (début, fin incluse) des morceaux horaires de la période.'''
+    date_deb = pd.Timestamp(date_deb)
+    date_fin = pd.Timestamp(date_fin)
+    debuts = pd.date_range(date_deb, date_fin, freq=freq, normalize=True)
+    debuts = debuts[debuts > date_deb].insert(0, date_deb)
+    fins = debuts[1:] - pd.Timedelta(hours=1)
+
+    return list(zip(debuts, fins.append(pd.DatetimeIndex([date_fin]))))
+
+def _separer_jours_complets(df, limite, tz='UTC'):
+    '''Heures des journées complètes jusqu'à la limite et heures restantes.'''
+    debut_incomplet = (limite + pd.Timedelta(hours=1)).tz_convert(
+        tz).normalize()
+    complet = df.index < debut_incomplet
+
+    return df[complet], df[~complet]
+
+def agreger_par_morceaux(client, source, s_dist_km, date_deb, date_fin,
+                         latitude, longitude, altitude, freq=FREQ_MORCEAUX,
+                         variables=agregation.VARIABLES_POUR_CALCULS,
+                         tz='UTC'):
+    '''Donnée journalière de la station de référence avec l'ETP, par morceaux.
+
+    Pour chaque morceau, la donnée des stations de s_dist_km est
+    interpolée par source.interpoler, normalisée, complétée de l'ETP
+    puis ses journées complètes sont agrégées selon agregation.agreger_jours.
+    Les heures attendant encore leur ETP (avant la première clareté de
+    jour) ou dont la journée n'est pas terminée sont gardées pour le
+    morceau suivant. Le résultat est celui du calcul sur toute la
+    période à partir de la même source ; une source cube (float32) ne
+    l'égale qu'aux arrondis float32 près au calcul sur la donnée float64.
+    '''
+    calculateur = etp.CalculateurEtp(latitude, longitude, altitude)
+    l_jours = []
+    df_restant = None
+    limite = None
+    for deb, fin in decouper_periode(date_deb, date_fin, freq=freq):
+        df_si = meteofrance.normaliser(
+            client, source.interpoler(s_dist_km, deb, fin), FREQUENCE)
+        if len(df_si) == 0:
+            continue
+        df_si = df_si.assign(etp=np.nan)
+        df_restant = (df_si if df_restant is None else
+                      pd.concat([df_restant, df_si], axis='index'))
+
+        # ETP des heures du morceau et des heures en attente
+        s_etp = calculateur.ajouter(df_si)
+        if len(s_etp) == 0:
+            continue
+        df_restant.loc[s_etp.index, 'etp'] = s_etp.to_numpy()
+        limite = s_etp.index[-1]
+
+        df_complet, df_restant = _separer_jours_complets(
+            df_restant, limite, tz=tz)
+        if len(df_complet) > 0:
+            l_jours.append(agregation.agreger_jours(
+                df_complet, variables, tz=tz))
+
+    # Dernières heures (et heures sans clareté de jour)
+    if df_restant is not None and len(df_restant) > 0:
+        s_etp = calculateur.vider()
+        if len(s_etp) > 0:
+            df_restant.loc[s_etp.index, 'etp'] = s_etp.to_numpy()
+        l_jours.append(agregation.agreger_jours(df_restant, variables, tz=tz))
+
+    if not l_jours:
+        return pd.DataFrame(dtype=float)
+
+    return pd.concat(l_jours, axis='index')
@@ -0,0 +1,264 @@
+'''Compilation de fichiers de données de différentes périodes en un seul fichier.
+
+Les fichiers sont d'abord découpés en séquences triées par indice
+(station, date) ou (date) pour la référence, puis fusionnés par une
+fusion à k voies par blocs. Les séquences sont relues par blocs depuis
+le disque et, au-delà de FUSION_MAX séquences, fusionnées en plusieurs
+passes par groupes de séquences consécutives : la mémoire utilisée est
+bornée par la taille des blocs et non par la longueur de l'historique.
+'''
+import os
+from pathlib import Path
+import tempfile
+import pandas as pd
+
+# Nombre de lignes lues à la fois (réparties entre les séquences fusionnées)
+TAILLE_BLOC = 100000
+
+# Nombre maximal de séquences fusionnées à la fois
+FUSION_MAX = 16
+
+# Politiques de résolution des conflits pour un même indice :
+# - 'premier' : ligne du premier fichier de la liste,
+# - 'dernier' : ligne du dernier fichier de la liste,
+# - 'combiner' : dernière valeur non manquante de chaque variable.
+POLITIQUES = ['premier', 'dernier', 'combiner']
+
+# Colonne temporaire du rang de la séquence (ordre des fichiers)
+_RANG = '_rang'
+
+def get_index_col(client, ref=False):
+    return ([client.time_label] if ref else
+            [client.id_station_donnee_label, client.time_label])
+
+def _lire_blocs(filepath, client, ref, taille_bloc, read_csv_kwargs={}):
+    '''Lecture d'un fichier par blocs indexés.'''
+    return pd.read_csv(filepath, parse_dates=[client.time_label],
+                       index_col=get_index_col(client, ref),
+                       chunksize=taille_bloc, **read_csv_kwargs)
+
+def est_trie(filepath, client, ref=False, taille_bloc=TAILLE_BLOC,
+             read_csv_kwargs={}):
+    '''Vérification par blocs que l'indice d'un fichier est trié.'''
+    index_col = get_index_col(client, ref)
+    dernier = None
+    for df in _lire_blocs(filepath, client, ref, taille_bloc,
+                          dict(read_csv_kwargs, usecols=index_col)):
+        if len(df) == 0:
+            continue
+        if ((not df.index.is_monotonic_increasing) or
+            ((dernier is not None) and (df.index[0] < dernier))):
+            return False
+        dernier = df.index[-1]
+
+    return True
+
+def creer_sequences(client, filepaths, dirpath, ref=False,
+                    taille_bloc=TAILLE_BLOC, read_csv_kwargs={}):
+    '''Séquences triées des fichiers, dans l'ordre des fichiers.
+
+    Un fichier déjà trié constitue une séquence à lui seul. Sinon,
+    chacun de ses blocs est trié et écrit en CSV dans dirpath comme une
+    séquence distincte. Renvoie les couples (fichier, options de
+    lecture) des séquences.
+    '''
+    sequences = []
+    for i_fichier, filepath in enumerate(filepaths):
+        if est_trie(filepath, client, ref, taille_bloc, read_csv_kwargs):
+            sequences.append((filepath, read_csv_kwargs))
+            continue
+        for i_bloc, df in enumerate(_lire_blocs(
+                filepath, client, ref, taille_bloc, read_csv_kwargs)):
+            filepath_bloc = dirpath / f"sequence_{i_fichier:d}_{i_bloc:d}.csv"
+            df.sort_index(kind='stable').to_csv(filepath_bloc)
+            sequences.append((filepath_bloc, {}))
+
+    return sequences
+
+def _position_apres(index, cle):
+    '''Position suivant la dernière occurrence de la clé dans un indice trié.'''
+    return index.slice_locs(end=cle)[1]
+
+class _Sequence(object):
+    '''Lecture par blocs d'une séquence triée avec un tampon.
+
+    Le bloc suivant est lu à l'avance pour que le dernier indice du
+    tampon n'apparaisse pas dans le bloc suivant (duplicatas à cheval
+    sur deux blocs).
+    '''
+    def __init__(self, source, rang, client, ref, taille_bloc,
+                 read_csv_kwargs={}):
+        self.rang = rang
+        self._blocs = iter(_lire_blocs(
+            source, client, ref, taille_bloc, read_csv_kwargs))
+        self._suivant = self._lire()
+        self.tampon = None
+        self.remplir()
+
+    @property
+    def epuisee(self):
+        return self.tampon is None
+
+    def _lire(self):
+        '''Bloc non vide suivant ou None.'''
+        for df in self._blocs:
+            if len(df) > 0:
+                return df
+
+        return None
+
+    def remplir(self):
+        '''Lecture du bloc suivant si le tampon est vide.'''
+        if (self.tampon is not None) and (len(self.tampon) > 0):
+            return
+        self.tampon = self._suivant
+        self._suivant = self._lire()
+        if self.tampon is None:
+            return
+
+        # Ajout des lignes de même indice que la dernière du tampon
+        while ((self._suivant is not None) and
+               (self._suivant.index[0] == self.tampon.index[-1])):
+            n = _position_apres(self._suivant.index, self.tampon.index[-1])
+            self.tampon = pd.concat([self.tampon, self._suivant.iloc[:n]])
+            self._suivant = self._suivant.iloc[n:]
+            if len(self._suivant) == 0:
+                self._suivant = self._lire()
+
+    def extraire(self, limite):
+        '''Extraction des lignes d'indice inférieur ou égal à la limite.'''
+        n = _position_apres(self.tampon.index, limite)
+        df = self.tampon.iloc[:n]
+        self.tampon = self.tampon.iloc[n:]
+        self.remplir()
+
+        return df.assign(**{_RANG: self.rang})
+
+def resoudre_conflits(df, index_col, politique='dernier'):
+    '''Tri et suppression des duplicatas d'indice selon la politique.'''
+    if politique not in POLITIQUES:
+        raise ValueError(f"Politique {politique} inconnue, choisir parmi "
+                         f"{POLITIQUES}.")
+    df = df.reset_index().sort_values(index_col + [_RANG], kind='stable')
+    if politique == 'premier':
+        df = df.drop_duplicates(subset=index_col, keep='first')
+    elif politique == 'dernier':
+        df = df.drop_duplicates(subset=index_col, keep='last')
+    else:
+        df = df.groupby(index_col, sort=False).last().reset_index()
+
+    return df.drop(columns=_RANG).set_index(index_col)
+
+def fusionner(sequences, client, ref=False, politique='dernier',
+              taille_bloc=TAILLE_BLOC):
+    '''Fusion à k voies des séquences triées, produite par blocs triés sans duplicatas.
+
+    À chaque étape, la limite est le plus petit des derniers indices
+    des tampons : toutes les lignes d'indice inférieur ou égal sont
+    alors connues et peuvent être fusionnées et produites. Chaque
+    séquence est lue par blocs de taille_bloc / k lignes.
+    '''
+    index_col = get_index_col(client, ref)
+    taille_sequence = max(1, taille_bloc // max(1, len(sequences)))
+    actives = [_Sequence(source, rang, client, ref, taille_sequence,
+                         read_csv_kwargs)
+               for rang, (source, read_csv_kwargs) in enumerate(sequences)]
+    actives = [_ for _ in actives if not _.epuisee]
+    while actives:
+        limite = min(_.tampon.index[-1] for _ in actives)
+        df = pd.concat([_.extraire(limite) for _ in actives])
+        actives = [_ for _ in actives if not _.epuisee]
+
+        yield resoudre_conflits(df, index_col, politique)
+
+def get_colonnes(client, sequences, ref=False):
+    '''Colonnes de toutes les séquences dans leur ordre d'apparition.'''
+    colonnes = []
+    for filepath, read_csv_kwargs in sequences:
+        df_entete = pd.read_csv(filepath, index_col=get_index_col(client, ref),
+                                nrows=0, **read_csv_kwargs)
+        colonnes.extend(_ for _ in df_entete.columns if _ not in colonnes)
+
+    return colonnes
+
+def ecrire_blocs(client, blocs, filepath, colonnes, ref=False):
+    '''Écriture de blocs aux colonnes données dans un fichier CSV.
+
+    Renvoie le nombre de lignes.
+    '''
+    nombre = 0
+    for i, df in enumerate(blocs):
+        df.reindex(columns=colonnes).to_csv(
+            filepath, mode='w' if i == 0 else 'a', header=(i == 0))
+        nombre += len(df)
+    if nombre == 0:
+        pd.DataFrame(columns=get_index_col(client, ref) + colonnes).to_csv(
+            filepath, index=False)
+
+    return nombre
+
+def reduire_sequences(client, sequences, dirpath, ref=False,
+                      politique='dernier', taille_bloc=TAILLE_BLOC,
+                      fusion_max=FUSION_MAX):
+    '''Fusions intermédiaires jusqu'à au plus fusion_max séquences.
+
+    À chaque passe, les séquences consécutives sont fusionnées par
+    groupes de fusion_max en séquences écrites dans dirpath. Les
+    groupes suivant l'ordre des fichiers, résoudre les conflits dans
+    chaque groupe puis entre les groupes donne le même résultat que
+    selon chaque politique en une seule fusion. Les séquences
+    intermédiaires fusionnées sont supprimées.
+    '''
+    fusion_max = max(2, fusion_max)
+    i_passe = 0
+    while len(sequences) > fusion_max:
+        suivantes = []
+        for i_groupe in range(0, len(sequences), fusion_max):
+            groupe = sequences[i_groupe:i_groupe + fusion_max]
+            if len(groupe) == 1:
+                suivantes.extend(groupe)
+                continue
+            filepath = dirpath / f"fusion_{i_passe:d}_{i_groupe:d}.csv"
+            ecrire_blocs(client, fusionner(
+                groupe, client, ref=ref, politique=politique,
+                taille_bloc=taille_bloc), filepath,
+                get_colonnes(client, groupe, ref), ref=ref)
+            for source, _ in groupe:
+                if Path(source).parent == dirpath:
+                    os.remove(source)
+            suivantes.append((filepath, {}))
+        sequences = suivantes
+        i_passe += 1
+
+    return sequences
+
+def compiler_fichiers(client, filepaths, filepath_dst, ref=False,
+                      politique='dernier', taille_bloc=TAILLE_BLOC,
+                      fusion_max=FUSION_MAX, read_csv_kwargs={}):
+    '''Compilation de fichiers de périodes en un fichier trié sans duplicatas.
+
+    Les conflits d'indice sont résolus selon la politique dans l'ordre
+    des fichiers. Le fichier de destination est écrit par blocs dans
+    un fichier temporaire puis remplace l'ancien, de sorte qu'il peut
+    aussi faire partie des fichiers sources. Renvoie le nombre de lignes.
+    '''
+    filepaths = list(filepaths)
+    filepath_dst = Path(filepath_dst)
+    colonnes = get_colonnes(
+        client, [(_, read_csv_kwargs) for _ in filepaths], ref)
+
+    with tempfile.TemporaryDirectory(dir=filepath_dst.parent) as dirpath:
+        dirpath = Path(dirpath)
+        sequences = creer_sequences(client, filepaths, dirpath, ref=ref,
+                                    taille_bloc=taille_bloc,
+                                    read_csv_kwargs=read_csv_kwargs)
+        sequences = reduire_sequences(
+            client, sequences, dirpath, ref=ref, politique=politique,
+            taille_bloc=taille_bloc, fusion_max=fusion_max)
+        filepath_tmp = dirpath / filepath_dst.name
+        nombre = ecrire_blocs(client, fusionner(
+            sequences, client, ref=ref, politique=politique,
+            taille_bloc=taille_bloc), filepath_tmp, colonnes, ref=ref)
+        os.replace(filepath_tmp, filepath_dst)
+
+    return nombre
@@ -0,0 +1,239 @@
+import json
+import numpy as np
+import pandas as pd
+
+import geo
+import meteofrance
+
+# Noms des fichiers du cube
+NOM_FICHIER_DONNEE = 'donnee.npy'
+NOM_FICHIER_METADONNEE = 'metadonnee.json'
+
+# Fréquence de l'axe du temps
+FREQ = 'h'
+
+# Type des valeurs du cube (float32 : les interpolations à partir du cube
+# égalent celles de la donnée float64 aux arrondis float32 près)
+DTYPE = np.float32
+
+def get_dirpath_cube(client, ref_station_name, df_liste_stations,
+                     date_deb_periode, date_fin_periode, frequence=None):
+    '''Dossier du cube de la donnée des stations les plus proches.
+
+    Le nom du dossier dépend de la période et des identifiants des
+    stations, de sorte qu'une autre période ou d'autres stations (même
+    en même nombre) ont leur propre cube.
+    '''
+    filepath = meteofrance.get_filepath_donnee_periode(
+        client, ref_station_name, df_liste_stations, date_deb_periode,
+        date_fin_periode, frequence=frequence)
+    empreinte_stations = meteofrance.get_empreinte_stations(
+        df_liste_stations.index)
+    dirpath = filepath.with_name(f"{filepath.stem}_{empreinte_stations}_cube")
+
+    return dirpath
+
+def _vers_tranche(positions):
+    '''Conversion de positions en tranche si elles sont contiguës.'''
+    positions = np.asarray(positions)
+    if (len(positions) > 0) and np.all(np.diff(positions) == 1):
+        return slice(positions[0], positions[-1] + 1)
+
+    return positions
+
+class CubeStations(object):
+    '''Cube station × heure × variable stocké sur disque et projeté en mémoire.
+
+    Les valeurs sont stockées dans un fichier .npy lu par projection
+    mémoire (np.memmap) et les axes dans un fichier JSON. Les sélections
+    par dates et par stations ou variables contiguës sont des vues sans
+    copie, de sorte que seules les pages utilisées sont lues du disque.
+    '''
+    def __init__(self, dirpath, mode='r'):
+        self.dirpath = dirpath
+        with open(dirpath / NOM_FICHIER_METADONNEE) as f:
+            metadonnee = json.load(f)
+        self.id_station_label = metadonnee['id_station_label']
+        self.time_label = metadonnee['time_label']
+        self.stations = pd.Index(metadonnee['stations'],
+                                 name=self.id_station_label)
+        self.temps = pd.date_range(
+            metadonnee['date_deb'], metadonnee['date_fin'],
+            freq=metadonnee['freq'], name=self.time_label)
+        if self.temps.tz is not None:
+            self.temps = self.temps.tz_convert(meteofrance.TZ)
+        self.variables = pd.Index(metadonnee['variables'])
+        self.donnee = np.load(dirpath / NOM_FICHIER_DONNEE, mmap_mode=mode)
+
+    @classmethod
+    def creer(cls, dirpath, stations, date_deb, date_fin, variables,
+              id_station_label, time_label, dtype=DTYPE, freq=FREQ):
+        '''Création d'un cube vide (valeurs manquantes).'''
+        dirpath.mkdir(parents=True, exist_ok=True)
+        temps = pd.date_range(pd.Timestamp(date_deb), pd.Timestamp(date_fin),
+                              freq=freq)
+        shape = (len(stations), len(temps), len(variables))
+        donnee = np.lib.format.open_memmap(
+            dirpath / NOM_FICHIER_DONNEE, mode='w+', dtype=dtype, shape=shape)
+        donnee[:] = np.nan
+        donnee.flush()
+        del donnee
+
+        metadonnee = {
+            'id_station_label': id_station_label,
+            'time_label': time_label,
+            'stations': [int(_) for _ in stations],
+            'date_deb': temps[0].isoformat(),
+            'date_fin': temps[-1].isoformat(),
+            'freq': freq,
+            'variables': list(variables)
+        }
+        with open(dirpath / NOM_FICHIER_METADONNEE, 'w') as f:
+            json.dump(metadonnee, f, indent=1)
+
+        return cls(dirpath, mode='r+')
+
+    def _vers_date(self, date):
+        '''Date dans le fuseau horaire du cube.'''
+        date = pd.Timestamp(date)
+        if (date.tzinfo is None) and (self.temps.tz is not None):
+            date = date.tz_localize(self.temps.tz)
+
+        return date
+
+    def couvre(self, stations, date_deb, date_fin):
+        '''Vrai si les stations et la période sont dans les axes du cube.'''
+        stations = pd.Index([int(_) for _ in stations])
+        return (bool(stations.isin(self.stations).all()) and
+                (self.temps[0] <= self._vers_date(date_deb)) and
+                (self._vers_date(date_fin) <= self.temps[-1]))
+
+    def positions(self, stations=None, date_deb=None, date_fin=None,
+                  variables=None):
+        '''Positions (tranches si possible) des stations, heures et variables.'''
+        pos_stations = slice(None)
+        if stations is not None:
+            indexer = self.stations.get_indexer(stations)
+            if np.any(indexer < 0):
+                raise KeyError(f"Stations absentes du cube: "
+                               f"{list(pd.Index(stations)[indexer < 0])}")
+            pos_stations = _vers_tranche(indexer)
+
+        deb = 0 if date_deb is None else self.temps.searchsorted(
+            self._vers_date(date_deb))
+        fin = len(self.temps) if date_fin is None else self.temps.searchsorted(
+            self._vers_date(date_fin), side='right')
+        pos_temps = slice(deb, fin)
+
+        pos_variables = slice(None)
+        if variables is not None:
+            indexer = self.variables.get_indexer(variables)
+            if np.any(indexer < 0):
+                raise KeyError(f"Variables absentes du cube: "
+                               f"{list(pd.Index(variables)[indexer < 0])}")
+            pos_variables = _vers_tranche(indexer)
+
+        return pos_stations, pos_temps, pos_variables
+
+    def tranche(self, stations=None, date_deb=None, date_fin=None,
+                variables=None):
+        '''Sélection d'une partie du cube.
+
+        La sélection est une vue sans copie sauf si les stations ou
+        les variables demandées ne sont pas contiguës dans le cube.
+        '''
+        pos_stations, pos_temps, pos_variables = self.positions(
+            stations, date_deb, date_fin, variables)
+        donnee = self.donnee[pos_stations, pos_temps][:, :, pos_variables]
+
+        return donnee
+
+    def ecrire(self, df):
+        '''Écriture d'une donnée indexée par station et par date dans le cube.'''
+        variables = self.variables.intersection(df.columns, sort=False)
+        id_stations = df.index.get_level_values(self.id_station_label)
+        temps = df.index.get_level_values(self.time_label)
+        pos_stations = self.stations.get_indexer(id_stations)
+        pos_temps = self.temps.get_indexer(temps)
+        if np.any(pos_stations < 0) or np.any(pos_temps < 0):
+            raise ValueError(
+                "Stations ou dates de la donnée hors du cube.")
+        pos_variables = self.variables.get_indexer(variables)
+
+        valeurs = df[variables].to_numpy(dtype=self.donnee.dtype)
+        self.donnee[pos_stations[:, None], pos_temps[:, None],
+                    pos_variables[None, :]] = valeurs
+        self.donnee.flush()
+
+    def vers_frame(self, stations=None, date_deb=None, date_fin=None,
+                   variables=None):
+        '''DataFrame indexée par station et par date (format des compilateurs).'''
+        pos_stations, pos_temps, pos_variables = self.positions(
+            stations, date_deb, date_fin, variables)
+        donnee = self.tranche(stations, date_deb, date_fin, variables)
+        index = pd.MultiIndex.from_product(
+            [self.stations[pos_stations], self.temps[pos_temps]],
+            names=[self.id_station_label, self.time_label])
+        df = pd.DataFrame(donnee.reshape(-1, donnee.shape[-1]), index=index,
+                          columns=self.variables[pos_variables])
+
+        return df
+
+    def vers_frame_station(self, id_station, date_deb=None, date_fin=None,
+                           variables=None):
+        '''DataFrame d'une station indexée par date, vue sans copie du cube.'''
+        pos_stations, pos_temps, pos_variables = self.positions(
+            [id_station], date_deb, date_fin, variables)
+        donnee = self.tranche([id_station], date_deb, date_fin, variables)[0]
+        df = pd.DataFrame(donnee, index=self.temps[pos_temps],
+                          columns=self.variables[pos_variables], copy=False)
+
+        return df
+
+    def interpoler(self, s_dist_km, date_deb=None, date_fin=None,
+                   variables=None):
+        '''Interpolation pondérée par l'inverse de la distance au carré.
+
+        Équivalent, aux arrondis float32 près, à
+        geo.interpolation_inverse_distance_carre appliquée directement à
+        la tranche du cube des stations de s_dist_km (mêmes distances
+        bornées à geo.DISTANCE_MIN_KM).
+        '''
+        pos_stations, pos_temps, pos_variables = self.positions(
+            s_dist_km.index, date_deb, date_fin, variables)
+        donnee = self.tranche(s_dist_km.index, date_deb, date_fin, variables)
+        valeurs = geo.interpolation_inverse_distance_carre_tableau(
+            donnee, s_dist_km.to_numpy())
+        df_ref = pd.DataFrame(valeurs, index=self.temps[pos_temps],
+                              columns=self.variables[pos_variables])
+
+        return df_ref
+
+def ecrire_donnee(client, df, dirpath, date_deb, date_fin, stations=None,
+                  variables=None, dtype=DTYPE):
+    '''Écriture de la donnée des stations dans le cube, créé au besoin.
+
+    Le cube couvre toutes les stations (celles de df par défaut) et
+    toute la période [date_deb, date_fin], de sorte que la donnée peut
+    y être écrite par morceaux (par exemple par année) au fil du
+    téléchargement. Un cube existant dont les axes ne couvrent pas les
+    stations ou la période est recréé.
+    '''
+    if stations is None:
+        stations = df.index.unique(level=client.id_station_donnee_label)
+    cube = None
+    if (dirpath / NOM_FICHIER_METADONNEE).exists():
+        cube = CubeStations(dirpath, mode='r+')
+        if not cube.couvre(stations, date_deb, date_fin):
+            cube = None
+    if cube is None:
+        if variables is None:
+            variables = [_ for _ in df.columns
+                         if pd.api.types.is_float_dtype(df[_])]
+        cube = CubeStations.creer(
+            dirpath, stations, date_deb, date_fin, variables,
+            client.id_station_donnee_label, client.time_label, dtype=dtype)
+
+    cube.ecrire(df)
+
+    return cube
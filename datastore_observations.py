@@ -4,10 +4,13 @@ import panel as pn
 import traceback
 import warnings
 
-import bilan
+import agregation
+import catalogue
 import etp
 import geo
 import meteofrance
+import prechargement
+import stockage
 
 # Météo-France API
 METEOFRANCE_API = 'DPPaquetObs'
@@ -15,13 +18,6 @@ METEOFRANCE_API = 'DPPaquetObs'
 # Fréquence des données climatiques
 METEOFRANCE_FREQUENCE = 'horaire'
 
-# Variables utilisées pour le calcul de l'ETP et du bilan hydrique 
-VARIABLES_POUR_CALCULS = dict(
-    **etp.VARIABLES_CALCUL_ETP,
-    **bilan.VARIABLES_CALCUL_BILAN)
-VARIABLES_POUR_CALCULS_SANS_ETP = VARIABLES_POUR_CALCULS.copy()
-del VARIABLES_POUR_CALCULS_SANS_ETP['etp']
-
 LARGEUR_BOUTONS = 450
 PARAMS_TABULATOR = dict(
     disabled=True,
@@ -223,6 +219,10 @@ class DataStoreObservations(pn.viewable.Viewer):
         sortie = guide
         if application_id:
             self._client.application_id = application_id
+
+            # Préchargement horaire des départements configurés
+            prechargement.demarrer_prechargement(application_id)
+
             sortie = pn.pane.Alert(
                 "Client initialisé pour l'API Météo-France. Poursuivre...",
                 alert_type="success")
@@ -276,13 +276,18 @@ class DataStoreObservations(pn.viewable.Viewer):
                     msg = pn.pane.Alert("Liste des stations lue.",
                                         alert_type="success")
                 else:
-                    # Demande de la liste des stations
-                    section = meteofrance.SECTION_LISTE_STATIONS
-                    response = meteofrance.demande(self._client, section)
-                    self.tab_liste_stations.value = meteofrance.response_text_to_frame(
-                        self._client, response, index_col=self._client.id_station_label)
-                    # Sauvegarde de la liste des stations
-                    self.tab_liste_stations.value.to_csv(filepath)
+                    # Demande et sauvegarde de la liste des stations
+                    # (partagée avec les processus la demandant en même temps)
+                    def demander_liste_stations():
+                        section = meteofrance.SECTION_LISTE_STATIONS
+                        response = meteofrance.demande(self._client, section)
+                        return meteofrance.response_text_to_frame(
+                            self._client, response, index_col=self._client.id_station_label)
+                    self.tab_liste_stations.value = stockage.obtenir_ou_calculer(
+                        filepath, demander_liste_stations,
+                        lambda f: pd.read_csv(f, index_col=self._client.id_station_label),
+                        lambda df, f: df.to_csv(f), recalculer=True)
+
                     msg = pn.pane.Alert("Liste des stations téléchargée.", 
                                         alert_type="success")
 
@@ -467,16 +472,24 @@ class DataStoreObservations(pn.viewable.Viewer):
                     self._date_deb_widget.value, self._date_fin_widget.value)
                 if self._lire_donnee_liste_stations_widget.value:
                     # Lecture de la donnée météo pour la liste des stations
-                    self.tab_meteo.value = pd.read_csv(
-                        filepath, parse_dates=[self._client.time_label],
-                        index_col=[self._client.id_station_donnee_label,
-                                   self._client.time_label])
+                    if filepath.exists():
+                        self.tab_meteo.value = pd.read_csv(
+                            filepath, parse_dates=[self._client.time_label],
+                            index_col=[self._client.id_station_donnee_label,
+                                       self._client.time_label])
+                    else:
+                        # Fusion des fichiers recouvrant la période
+                        catalogue.indexer_dossier(self._client)
+                        self.tab_meteo.value = catalogue.lire_donnee(
+                            self._client, self.tab_liste_stations_nn.value.index,
+                            self._date_deb_widget.value, self._date_fin_widget.value,
+                            frequence=METEOFRANCE_FREQUENCE)
                     msg = pn.pane.Alert("Donnée météo pour la liste des stations lue.",
                                         alert_type="success")
                 else:
                     # Demande de la donnée météo pour la liste des stations pour les dernières 24 h
                     variables = [self._client.variables_labels[METEOFRANCE_FREQUENCE][k]
-                         for k in VARIABLES_POUR_CALCULS_SANS_ETP]
+                         for k in agregation.VARIABLES_POUR_CALCULS_SANS_ETP]
 
                     msg = pn.pane.Alert("Donnée météo pour la liste des stations téléchargée.",
                                         alert_type="success")
@@ -484,7 +497,8 @@ class DataStoreObservations(pn.viewable.Viewer):
                         warnings.simplefilter("always")
                         self.tab_meteo.value = meteofrance.compiler_donnee_des_departements(
                             self._client, self.tab_liste_stations_nn.value,
-                            frequence=METEOFRANCE_FREQUENCE)[variables]
+                            frequence=METEOFRANCE_FREQUENCE, variables=variables,
+                            cache=True)[variables]
                         if w:
                             for warning in w:
                                 msg = pn.pane.Alert(
@@ -492,7 +506,12 @@ class DataStoreObservations(pn.viewable.Viewer):
                                     f"téléchargée, mais {warning.message}", alert_type="warning")
     
                     # Sauvegarde de la donnée météo pour la liste des stations
-                    self.tab_meteo.value.to_csv(filepath)
+                    stockage.ecrire_csv(self.tab_meteo.value, filepath)
+                    catalogue.enregistrer_fichier(
+                        self._client, filepath, self.tab_meteo.value,
+                        ref_station_name=self.ref_station_name,
+                        frequence=METEOFRANCE_FREQUENCE,
+                        nn_nombre=len(self.tab_liste_stations_nn.value))
 
                 assert len(self.tab_meteo.value) != 0, (
                     "La table de la donnée météo pour la liste des stations est vide!")
@@ -546,10 +565,9 @@ class DataStoreObservations(pn.viewable.Viewer):
                     self._client, self.ref_station_name, self.tab_liste_stations_nn.value,
                     self._date_deb_widget.value, self._date_fin_widget.value, ref=True)
                 if self._lire_donnee_ref_widget.value:
-                    # Lecture de la donnée météo pour la station de référence
-                    df_meteo_ref_heure = pd.read_csv(
-                        filepath, parse_dates=[self._client.time_label],
-                        index_col=self._client.time_label)
+                    # Lecture de la donnée météo normalisée pour la station de référence
+                    df_meteo_ref_heure_si = meteofrance.lire_donnee_normalisee(
+                        self._client, filepath, METEOFRANCE_FREQUENCE, ref=True)
                     msg = pn.pane.Alert("Donnée météo pour la station de référence lue.",
                                         alert_type="success")
                 else:
@@ -558,16 +576,18 @@ class DataStoreObservations(pn.viewable.Viewer):
                         self.tab_meteo.value, self.tab_liste_stations_nn.value['distance'])
     
                     # Sauvegarde de la donnée météo pour la station de référence
-                    df_meteo_ref_heure.to_csv(filepath)
+                    stockage.ecrire_csv(df_meteo_ref_heure, filepath)
+                    catalogue.enregistrer_fichier(
+                        self._client, filepath, df_meteo_ref_heure,
+                        ref_station_name=self.ref_station_name,
+                        frequence=METEOFRANCE_FREQUENCE, ref=True,
+                        nn_nombre=len(self.tab_liste_stations_nn.value))
                     msg = pn.pane.Alert("Donnée météo pour la station de référence interpolée.",
                                            alert_type="success")
 
-                df_meteo_ref_heure_renom = meteofrance.renommer_variables(
-                    self._client, df_meteo_ref_heure, METEOFRANCE_FREQUENCE)
-
-
-                df_meteo_ref_heure_si = meteofrance.convertir_unites(
-                    self._client, df_meteo_ref_heure_renom)
+                    # Sélection, renommage et conversion des unités en une passe
+                    df_meteo_ref_heure_si = meteofrance.normaliser(
+                        self._client, df_meteo_ref_heure, METEOFRANCE_FREQUENCE)
 
                 # Exception si variable manquante
                 for variable in etp.VARIABLES_CALCUL_ETP:
@@ -583,11 +603,9 @@ class DataStoreObservations(pn.viewable.Viewer):
                     self._ref_station_altitude_widget.value)
 
                 # Calcul des valeurs journalières des variables météo
-                df_meteo_ref_si = pd.DataFrame()
-                for variable, series in df_meteo_ref_heure_si.items():
-                    df_meteo_ref_si[variable] = [
-                        getattr(df_meteo_ref_heure_si[variable],
-                                VARIABLES_POUR_CALCULS[variable])(0)]
+                # (fenêtre glissante de 24 h se terminant à la dernière heure)
+                df_meteo_ref_si = agregation.agreger_glissant(
+                    df_meteo_ref_heure_si).iloc[[-1]]
                 df_meteo_ref_si.index = [(
                     f"{df_meteo_ref_heure_si.index.min()} - "
                     f"{df_meteo_ref_heure_si.index.max()}")]
@@ -0,0 +1,168 @@
+'''Ensemble de Monte-Carlo du bilan hydrique pour l'incertitude des entrées.
+
+Les entrées de bilan.calcul_bilan sont incertaines : précipitation
+interpolée à partir de peu de stations, fraction de la RU remplie,
+part de la RU facilement utilisable et pierrosité. Des milliers de
+membres sont tirés :
+- la précipitation par bootstrap bayésien des poids de l'interpolation
+  par l'inverse de la distance au carré (poids multipliés par des
+  tirages exponentiels), ce qui reproduit la dispersion entre stations,
+- les paramètres du sol selon des lois bêta sur [0, 1] de moyenne leur
+  valeur nominale, de sorte que la moyenne de l'ensemble reste centrée
+  sur le bilan déterministe.
+Tous les membres sont évalués en une seule passe sur des tableaux
+(membres x jours), avec les formules de bilan.calcul_bilan. Le
+résultat est résumé par les quantiles du besoin en irrigation et la
+probabilité de dépasser le seuil d'irrigation.
+'''
+import numpy as np
+import pandas as pd
+
+import bilan
+import geo
+
+# Nombre de membres par défaut
+NOMBRE_MEMBRES = 2000
+
+# Quantiles du besoin en irrigation
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Écarts-types par défaut des paramètres du sol (lois bêta)
+ECARTS_TYPES = {
+    'fraction_cailloux': 0.05,
+    'fraction_ru_remplie': 0.1,
+    'ru_vers_rfu': 0.05
+}
+
+def tirer_precipitations(df_precipitation, s_dist_km,
+                         nombre_membres=NOMBRE_MEMBRES, rng=None):
+    '''Précipitations des membres au site (membres x dates) par bootstrap des poids.
+
+    df_precipitation est indexée par station et par date (format des
+    compilateurs), s_dist_km donne la distance des stations au site.
+    Les valeurs manquantes d'une station sont ignorées comme dans
+    geo.interpolation_inverse_distance_carre_tableau. Quand une station
+    domine les poids, la moyenne des membres s'écarte de l'interpolation
+    vers celle des autres stations.
+    '''
+    rng = np.random.default_rng(rng)
+    df_piv = df_precipitation.unstack()
+    valeurs = df_piv.loc[s_dist_km.index].to_numpy(dtype=float)
+    valide = ~np.isnan(valeurs)
+
+    # Poids de l'interpolation perturbés (tirages de loi exponentielle),
+    # distances bornées comme dans geo
+    poids = 1. / np.maximum(s_dist_km.to_numpy(dtype=float),
+                            geo.DISTANCE_MIN_KM)**2
+    poids_membres = poids * rng.exponential(size=(nombre_membres, len(poids)))
+
+    numerateur = poids_membres @ np.where(valide, valeurs, 0.)
+    denominateur = poids_membres @ valide
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precipitation = numerateur / denominateur
+
+    return pd.DataFrame(precipitation, columns=df_piv.columns)
+
+def tirer_parametre(valeur, ecart_type, nombre_membres, rng):
+    '''Paramètre des membres selon une loi bêta de moyenne valeur sur [0, 1].
+
+    Près des bornes, l'écart-type est réduit pour que la loi reste
+    définie (au plus celui de la loi de paramètres valeur et
+    1 - valeur). Une valeur sur une borne ou un écart-type nul fixe le
+    paramètre.
+    '''
+    if not 0. <= valeur <= 1.:
+        raise ValueError(f"Valeur {valeur} hors de [0, 1].")
+    if ecart_type < 0.:
+        raise ValueError(f"Écart-type {ecart_type} négatif.")
+    variance_max = valeur * (1. - valeur) / 2.
+    if (ecart_type == 0.) or (variance_max == 0.):
+        return np.full(nombre_membres, float(valeur))
+
+    # Paramètres de la loi bêta de moyenne et de variance données
+    concentration = valeur * (1. - valeur) / min(
+        ecart_type**2, variance_max) - 1.
+
+    return rng.beta(valeur * concentration, (1. - valeur) * concentration,
+                    size=nombre_membres)
+
+def calcul_bilan_membres(
+    df_meteo,
+    texture, fraction_cailloux,
+    culture, stade,
+    fraction_ru_remplie, ru_vers_rfu,
+    seuil_irrigation, hauteur_vers_duree_irrigation,
+    rfu_cible=None, precipitation_membres=None, ecarts_types=None,
+    nombre_membres=NOMBRE_MEMBRES, rng=None
+):
+    '''Besoin, déclenchement et durée d'irrigation des membres (membres x jours).
+
+    df_meteo est celle de bilan.calcul_bilan (un jour en Series ou
+    plusieurs jours en DataFrame). Sans precipitation_membres (membres
+    x jours, par exemple de tirer_precipitations), la précipitation
+    de df_meteo est gardée. ecarts_types complète ECARTS_TYPES (un
+    écart-type nul fixe le paramètre).
+    '''
+    rng = np.random.default_rng(rng)
+    if isinstance(df_meteo, pd.Series):
+        df_meteo = df_meteo.to_frame().transpose()
+    ecarts_types = {**ECARTS_TYPES, **(ecarts_types or {})}
+    parametres = {
+        nom: tirer_parametre(valeur, ecarts_types[nom], nombre_membres,
+                             rng)[:, np.newaxis]
+        for nom, valeur in [('fraction_cailloux', fraction_cailloux),
+                            ('fraction_ru_remplie', fraction_ru_remplie),
+                            ('ru_vers_rfu', ru_vers_rfu)]}
+
+    etp_jour = df_meteo['etp'].to_numpy(dtype=float)[np.newaxis]
+    if precipitation_membres is None:
+        precipitation = df_meteo['precipitation'].to_numpy(
+            dtype=float)[np.newaxis]
+    else:
+        precipitation = np.asarray(precipitation_membres, dtype=float)
+
+    # Formules de bilan.calcul_bilan appliquées aux tableaux des membres
+    _, _, ru, ru_remplie = bilan.calcul_reserve_utile(
+        texture, parametres['fraction_cailloux'], culture,
+        parametres['fraction_ru_remplie'])
+    rfu = bilan.calcul_reserve_facilement_utilisable(
+        ru, parametres['ru_vers_rfu'])
+    rfu_deficit = bilan.calcul_reserve_facilement_utilisable(
+        ru_remplie, parametres['ru_vers_rfu']) - rfu
+    etm_culture = -(bilan.lire_kc()[culture][stade] * etp_jour)
+    if rfu_cible is None:
+        rfu_cible = rfu
+    besoin = rfu_cible - (rfu + rfu_deficit + precipitation + etm_culture)
+    irrigation = besoin > seuil_irrigation
+    duree = hauteur_vers_duree_irrigation * np.where(irrigation, besoin, 0)
+
+    return {'besoin_irrigation': besoin, 'irrigation': irrigation,
+            'duree_irrigation': duree}
+
+def calcul_bilan_ensemble(
+    df_meteo,
+    texture, fraction_cailloux,
+    culture, stade,
+    fraction_ru_remplie, ru_vers_rfu,
+    seuil_irrigation, hauteur_vers_duree_irrigation,
+    rfu_cible=None, precipitation_membres=None, ecarts_types=None,
+    nombre_membres=NOMBRE_MEMBRES, quantiles=QUANTILES, rng=None
+):
+    '''Quantiles du besoin en irrigation (mm) et probabilité d'irriguer par jour.'''
+    membres = calcul_bilan_membres(
+        df_meteo, texture, fraction_cailloux, culture, stade,
+        fraction_ru_remplie, ru_vers_rfu, seuil_irrigation,
+        hauteur_vers_duree_irrigation, rfu_cible=rfu_cible,
+        precipitation_membres=precipitation_membres,
+        ecarts_types=ecarts_types, nombre_membres=nombre_membres, rng=rng)
+    index = (pd.Index([df_meteo.name]) if isinstance(df_meteo, pd.Series)
+             else df_meteo.index)
+
+    df = pd.DataFrame(
+        np.quantile(membres['besoin_irrigation'], quantiles, axis=0).T,
+        index=index, columns=[f'besoin_irrigation_q{100 * q:02.0f}'
+                              for q in quantiles])
+    df['probabilite_irrigation'] = membres['irrigation'].mean(axis=0)
+    df['duree_irrigation_moyenne'] = membres['duree_irrigation'].mean(axis=0)
+
+    return df
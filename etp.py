@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from pvlib import irradiance, location
 import pytz
 
 # Variables météorologiques utilisées pour le calcul de l'ETP
@@ -36,51 +35,105 @@ def calcul_rayonnement_net_ondes_courtes(df):
 
     return r_ns
 
-def calcul_rayonnement_net_ondes_longues(df, ee, site):
-    # Rayonnement solaire incident en MJ m-2 h-1
-    r_s = df['rayonnement_global'] * 1.e-6
+def creer_site(latitude, longitude, altitude):
+    '''Site dans le fuseau horaire de la France pour la géométrie solaire.'''
+    # Import à la première utilisation (démarrage de l'application)
+    from pvlib import location
+
+    tz = pytz.country_timezones('FR')[0]
+
+    return location.Location(latitude, longitude, altitude=altitude, tz=tz)
+
+def calcul_geometrie_solaire(site, time):
+    '''Zénith solaire et rayonnement extraterrestre horizontal (MJ m-2 h-1) aux dates.'''
+    # Import à la première utilisation (démarrage de l'application)
+    from pvlib import irradiance
 
     # Localisation du temps
-    time = pd.DatetimeIndex(df.index)
-    local_time = time.tz_convert(site.tz)
+    local_time = pd.DatetimeIndex(time).tz_convert(site.tz)
 
-    # Calcul du rayonnement extraterrestre normal
+    # Calcul du rayonnement extraterrestre normal
     r_a_dni = irradiance.get_extra_radiation(local_time) * 3600 * 1.e-6
 
     # Calcul du zenith solaire
     zenith = site.get_solarposition(times=local_time)['zenith']
 
-    # Calcul du rayonnement extraterrestre horizontal
+    # Calcul du rayonnement extraterrestre horizontal
     r_a = np.maximum(0., r_a_dni * np.cos(np.deg2rad(zenith)))
 
-    # Calcul du rayonnement solaire incident pour un ciel clair
-    r_so = (0.75 + 2.e-5 * site.altitude) * r_a
-
     # Conversion du temps vers UTC
-    r_so.index = r_so.index.tz_convert('UTC')
+    zenith.index = zenith.index.tz_convert('UTC')
+    r_a.index = r_a.index.tz_convert('UTC')
+
+    return zenith, r_a
+
+def calcul_clarete_brute(df, site, r_a):
+    '''Clareté (rapport au rayonnement par ciel clair) heure par heure.'''
+    # Rayonnement solaire incident en MJ m-2 h-1
+    r_s = df['rayonnement_global'] * 1.e-6
+
+    # Calcul du rayonnement solaire incident pour un ciel clair
+    # dans le type de la donnée
+    r_so = ((0.75 + 2.e-5 * site.altitude) * r_a).astype(r_s.dtype)
 
-    # Calcul de la clareté
+    # Calcul de la clareté
     clarete = np.minimum(1., r_s / r_so)
 
-    # Durant la nuit la clareté est suppossée égale à celle 2h avant le couché
-    # Si des heures de journée avant la nuit ne sont pas disponibles on utilise
-    # les heures après le levé
-    is_day = zenith.values < 90.
-    is_day_short = np.roll(is_day, 1) & np.roll(is_day, -1)
-    clarete = clarete.where(is_day_short).ffill(
+    return clarete
+
+def calcul_clarete(df, site):
+    '''Zénith solaire et clareté de toute la série, remplie durant la nuit.
+
+    La géométrie solaire de l'heure précédant et de l'heure suivant la
+    série est aussi calculée pour identifier les heures de jour aux bords.
+    '''
+    time = pd.DatetimeIndex(df.index)
+    if len(time) == 0:
+        vide = pd.Series(index=time, dtype=float)
+        return vide, vide.copy()
+    heure = pd.Timedelta(hours=1)
+    time_ext = time.insert(0, time[0] - heure).append(
+        pd.DatetimeIndex([time[-1] + heure]))
+    zenith_ext, r_a_ext = calcul_geometrie_solaire(site, time_ext)
+    zenith, r_a = zenith_ext.iloc[1:-1], r_a_ext.iloc[1:-1]
+
+    clarete = calcul_clarete_brute(df, site, r_a)
+
+    # Durant la nuit la clareté est suppossée égale à celle 2h avant le couché
+    # Si des heures de journée avant la nuit ne sont pas disponibles on utilise
+    # les heures après le levé
+    is_day_ext = zenith_ext.values < 90.
+    is_day_prec = is_day_ext[:-2]
+    is_day_suiv = is_day_ext[2:]
+    clarete = clarete.where(is_day_prec & is_day_suiv).ffill(
         axis='index').bfill(axis='index')
 
-    # Calcul du rayonnement net aux ondes longues
+    return zenith, clarete
+
+def calcul_rayonnement_net_ondes_longues_clarete(df, ee, clarete):
+    '''Rayonnement net aux ondes longues connaissant la clareté.'''
     r_nl = SIGMA * df['temperature_2m']**4 * (0.34 - 0.14 * np.sqrt(ee)) * (
         1.35 * clarete - 0.35)
 
+    return r_nl
+
+def calcul_rayonnement_net_ondes_longues(df, ee, site):
+    zenith, clarete = calcul_clarete(df, site)
+
+    # Calcul du rayonnement net aux ondes longues
+    r_nl = calcul_rayonnement_net_ondes_longues_clarete(df, ee, clarete)
+
     return r_nl, zenith
 
 def calcul_etp(df, latitude, longitude, altitude):
     '''Calcul de l'évapotranspiration potentielle pour une station.'''
-    tz = pytz.country_timezones('FR')[0]
-    site = location.Location(
-        latitude, longitude, altitude=altitude, tz=tz)
+    site = creer_site(latitude, longitude, altitude)
+    zenith, clarete = calcul_clarete(df, site)
+
+    return calcul_etp_clarete(df, site, zenith, clarete)
+
+def calcul_etp_clarete(df, site, zenith, clarete):
+    '''Calcul de l'ETP connaissant le zénith solaire et la clareté (heure par heure).'''
     
     # Calcul de la pression de vapeur saturante (kPa)
     es = 0.6108 * np.exp(17.27 * (
@@ -100,7 +153,7 @@ def calcul_etp(df, latitude, longitude, altitude):
 
     # Calcul du rayonnement net
     r_ns = calcul_rayonnement_net_ondes_courtes(df)
-    r_nl, zenith = calcul_rayonnement_net_ondes_longues(df, ee, site)
+    r_nl = calcul_rayonnement_net_ondes_longues_clarete(df, ee, clarete)
     r_n = r_ns - r_nl
 
     # Calcul du flux du sol
@@ -116,4 +169,79 @@ def calcul_etp(df, latitude, longitude, altitude):
         es - ee) / denominateur)
     etp = etp1 + etp2
 
-    return etp
\ No newline at end of file
+    return etp
+
+class CalculateurEtp(object):
+    '''Calcul incrémental de l'ETP horaire pour des observations reçues au fil de l'eau.
+
+    Les heures (une seule ou un petit lot, consécutives d'un appel à
+    l'autre) sont ajoutées avec ajouter, qui renvoie aussitôt leur ETP.
+    Seul un état minimal est gardé : la dernière clareté de jour (report
+    de la clareté durant la nuit) et le caractère diurne de la dernière
+    heure. La géométrie solaire de l'heure suivante est calculée à
+    l'avance, de sorte que le travail par heure est constant et que le
+    résultat est celui de calcul_etp sur toute la série.
+
+    Les heures précédant la première clareté de jour disponible sont
+    gardées en attente et émises dès qu'elle est connue, comme le
+    remplissage vers l'arrière du calcul sur toute la série.
+    '''
+    def __init__(self, latitude, longitude, altitude):
+        self.site = creer_site(latitude, longitude, altitude)
+        self._clarete = np.nan
+        self._is_day_prec = None
+        self._attente = []
+
+    def ajouter(self, df):
+        '''ETP des heures de df (indice UTC) et des heures en attente.'''
+        time = pd.DatetimeIndex(df.index)
+        if len(time) == 0:
+            return pd.Series(dtype=float)
+        heure = pd.Timedelta(hours=1)
+        time_ext = time.append(pd.DatetimeIndex([time[-1] + heure]))
+        if self._is_day_prec is None:
+            time_ext = time_ext.insert(0, time[0] - heure)
+        zenith_ext, r_a_ext = calcul_geometrie_solaire(self.site, time_ext)
+        is_day_ext = zenith_ext.values < 90.
+        if self._is_day_prec is None:
+            self._is_day_prec = is_day_ext[0]
+            zenith_ext, r_a_ext = zenith_ext.iloc[1:], r_a_ext.iloc[1:]
+            is_day_ext = is_day_ext[1:]
+        zenith, r_a = zenith_ext.iloc[:-1], r_a_ext.iloc[:-1]
+
+        # Report de la dernière clareté de jour durant la nuit
+        is_day_prec = np.concatenate([[self._is_day_prec], is_day_ext[:-2]])
+        is_day_suiv = is_day_ext[1:]
+        clarete = calcul_clarete_brute(df, self.site, r_a).where(
+            is_day_prec & is_day_suiv).ffill(axis='index').fillna(self._clarete)
+        self._is_day_prec = is_day_ext[-2]
+
+        # Heures en attente de la première clareté de jour
+        valide = clarete.notna().to_numpy()
+        n_attente = len(df) if not valide.any() else int(np.argmax(valide))
+        if n_attente > 0:
+            self._attente.append((df.iloc[:n_attente], zenith.iloc[:n_attente]))
+            if n_attente == len(df):
+                return pd.Series(dtype=float)
+        l_etp = []
+        if self._attente:
+            l_etp.extend(self._emettre_attente(clarete.iloc[n_attente]))
+        self._clarete = clarete.iloc[-1]
+        l_etp.append(calcul_etp_clarete(
+            df.iloc[n_attente:], self.site, zenith.iloc[n_attente:],
+            clarete.iloc[n_attente:]))
+
+        return pd.concat(l_etp)
+
+    def _emettre_attente(self, clarete):
+        '''ETP des heures en attente avec la clareté donnée.'''
+        l_etp = [calcul_etp_clarete(
+            df, self.site, zenith, pd.Series(clarete, index=df.index))
+                 for df, zenith in self._attente]
+        self._attente = []
+
+        return l_etp
+
+    def vider(self):
+        '''ETP des heures restées en attente faute de clareté de jour (manquante).'''
+        return pd.concat(self._emettre_attente(np.nan) or [pd.Series(dtype=float)])
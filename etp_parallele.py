@@ -0,0 +1,181 @@
+'''Calcul de l'ETP horaire par blocs (site, année) dans un groupe de processus.
+
+Les entrées (sites x heures x variables de etp.VARIABLES_CALCUL_ETP,
+en unités SI) sont copiées une seule fois dans une mémoire partagée
+que chaque processus ouvre à son démarrage : aucune DataFrame n'est
+sérialisée. Chaque processus écrit l'ETP de ses blocs dans une seconde
+mémoire partagée.
+
+Le résultat est celui de etp.calcul_etp sur toute la série de chaque
+site. La géométrie solaire des heures voisines de chaque bloc est
+calculée pour identifier les heures de jour aux bords. Les premières
+heures d'un bloc, avant sa première clareté de jour, dépendent de la
+clareté reportée depuis les blocs précédents : elles sont calculées
+dans un second temps, une fois les clarétés de bord de tous les blocs
+connues.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import etp
+
+# Début des blocs de la période (début de chaque année)
+FREQ_BLOCS = 'YS'
+
+# Variables d'entrée, dans l'ordre du tableau partagé
+VARIABLES = list(etp.VARIABLES_CALCUL_ETP)
+
+def decouper_blocs(temps, freq=FREQ_BLOCS):
+    '''Positions (début, fin exclue) des blocs de la série temporelle.'''
+    temps = pd.DatetimeIndex(temps)
+    if len(temps) == 0:
+        return []
+    debuts = pd.date_range(temps[0], temps[-1], freq=freq, normalize=True)
+    positions = np.unique(np.concatenate([
+        [0], temps.searchsorted(debuts), [len(temps)]]))
+
+    return list(zip(positions[:-1], positions[1:]))
+
+def _ouvrir_tableau(nom, forme):
+    memoire = shared_memory.SharedMemory(name=nom)
+
+    return memoire, np.ndarray(forme, dtype=float, buffer=memoire.buf)
+
+def _initialiser_processus(nom_entree, nom_sortie, forme, temps, sites):
+    '''Ouverture des mémoires partagées d'entrée et de sortie.'''
+    global _ENTREE, _SORTIE, _TEMPS, _SITES, _MEMOIRES
+    memoire_entree, _ENTREE = _ouvrir_tableau(nom_entree, forme)
+    memoire_sortie, _SORTIE = _ouvrir_tableau(nom_sortie, forme[:-1])
+    # Références gardées pour que les mémoires restent ouvertes
+    _MEMOIRES = (memoire_entree, memoire_sortie)
+    _TEMPS = pd.DatetimeIndex(temps, tz='UTC')
+    _SITES = [etp.creer_site(*_) for _ in sites]
+
+def _frame_bloc(i_site, i_deb, i_fin):
+    return pd.DataFrame(_ENTREE[i_site, i_deb:i_fin],
+                        index=_TEMPS[i_deb:i_fin], columns=VARIABLES)
+
+def _calcul_bloc(bloc):
+    '''ETP d'un bloc à partir de sa première clareté de jour.
+
+    Renvoie le nombre d'heures du début du bloc restant à calculer, la
+    première et la dernière clareté (reportée) du bloc.
+    '''
+    i_site, i_deb, i_fin = bloc
+    site = _SITES[i_site]
+    df = _frame_bloc(i_site, i_deb, i_fin)
+
+    # Heures voisines du bloc dans la série (ou hors de la série aux bords)
+    heure = pd.Timedelta(hours=1)
+    avant = _TEMPS[i_deb - 1] if i_deb > 0 else df.index[0] - heure
+    apres = _TEMPS[i_fin] if i_fin < len(_TEMPS) else df.index[-1] + heure
+    time_ext = pd.DatetimeIndex([avant]).append(df.index).append(
+        pd.DatetimeIndex([apres]))
+    zenith_ext, r_a_ext = etp.calcul_geometrie_solaire(site, time_ext)
+    zenith, r_a = zenith_ext.iloc[1:-1], r_a_ext.iloc[1:-1]
+
+    # Report de la clareté de jour durant la nuit, comme etp.calcul_clarete
+    is_day_ext = zenith_ext.values < 90.
+    clarete = etp.calcul_clarete_brute(df, site, r_a).where(
+        is_day_ext[:-2] & is_day_ext[2:]).ffill(axis='index')
+
+    valide = clarete.notna().to_numpy()
+    if not valide.any():
+        return len(df), np.nan, np.nan
+    n_attente = int(np.argmax(valide))
+    _SORTIE[i_site, i_deb + n_attente:i_fin] = etp.calcul_etp_clarete(
+        df.iloc[n_attente:], site, zenith.iloc[n_attente:],
+        clarete.iloc[n_attente:]).to_numpy()
+
+    return n_attente, clarete.iloc[n_attente], clarete.iloc[-1]
+
+def _calcul_heures(tache):
+    '''ETP des heures d'un site connaissant leur clareté (reportée).'''
+    i_site, i_deb, i_fin, clarete = tache
+    site = _SITES[i_site]
+    df = _frame_bloc(i_site, i_deb, i_fin)
+    zenith = etp.calcul_geometrie_solaire(site, df.index)[0]
+    _SORTIE[i_site, i_deb:i_fin] = etp.calcul_etp_clarete(
+        df, site, zenith, pd.Series(clarete, index=df.index)).to_numpy()
+
+def _taches_report(blocs, resultats):
+    '''Heures de début de bloc et clareté reportée depuis les blocs voisins.
+
+    La clareté est la dernière des blocs précédents du site ou, à défaut,
+    la première des blocs suivants (remplissage vers l'arrière).
+    '''
+    taches = []
+    report = {}
+    attente = {}
+    for (i_site, i_deb, i_fin), (n_attente, premiere, derniere) in zip(
+            blocs, resultats):
+        if n_attente > 0:
+            if i_site in report:
+                taches.append((i_site, i_deb, i_deb + n_attente,
+                               report[i_site]))
+            else:
+                attente.setdefault(i_site, []).append(
+                    (i_site, i_deb, i_deb + n_attente))
+        if not np.isnan(derniere):
+            taches.extend(_ + (premiere,) for _ in attente.pop(i_site, []))
+            report[i_site] = derniere
+
+    # Les heures sans aucune clareté de jour du site restent manquantes
+    return taches
+
+def calcul_etp_sites(temps, donnee, sites, max_workers=None, freq=FREQ_BLOCS):
+    '''ETP horaire (sites x heures) de plusieurs sites dans un groupe de processus.
+
+    temps : dates UTC de la série, communes aux sites,
+    donnee : tableau (sites x heures x VARIABLES) en unités SI,
+    sites : (latitude, longitude, altitude) de chaque site.
+    '''
+    temps = pd.DatetimeIndex(temps).tz_convert('UTC')
+    donnee = np.asarray(donnee, dtype=float)
+    sites = [tuple(float(_) for _ in site) for site in sites]
+    forme = donnee.shape
+    blocs = [(i_site, i_deb, i_fin) for i_site in range(len(sites))
+             for i_deb, i_fin in decouper_blocs(temps, freq=freq)]
+    if not blocs:
+        return np.full(forme[:-1], np.nan)
+
+    memoire_entree = shared_memory.SharedMemory(
+        create=True, size=max(1, donnee.nbytes))
+    memoire_sortie = shared_memory.SharedMemory(
+        create=True, size=max(1, donnee[..., 0].nbytes))
+    try:
+        np.ndarray(forme, dtype=float, buffer=memoire_entree.buf)[:] = donnee
+        sortie = np.ndarray(forme[:-1], dtype=float, buffer=memoire_sortie.buf)
+        sortie[:] = np.nan
+        # Instants en nanosecondes depuis l'époque (unité de _initialiser_processus)
+        with ProcessPoolExecutor(
+                max_workers=max_workers, initializer=_initialiser_processus,
+                initargs=(memoire_entree.name, memoire_sortie.name, forme,
+                          temps.as_unit('ns').asi8, sites)) as executeur:
+            resultats = list(executeur.map(_calcul_bloc, blocs))
+            list(executeur.map(_calcul_heures,
+                               _taches_report(blocs, resultats)))
+        etp_sites = sortie.copy()
+        del sortie
+    finally:
+        for memoire in [memoire_entree, memoire_sortie]:
+            memoire.close()
+            memoire.unlink()
+
+    return etp_sites
+
+def calcul_etp(df, latitude, longitude, altitude, max_workers=None,
+               freq=FREQ_BLOCS):
+    '''Calcul de l'évapotranspiration potentielle pour une station, année par année en parallèle.
+
+    Même résultat que etp.calcul_etp.
+    '''
+    etp_site = calcul_etp_sites(
+        df.index, df[VARIABLES].to_numpy(dtype=float)[np.newaxis],
+        [(latitude, longitude, altitude)], max_workers=max_workers,
+        freq=freq)[0]
+
+    return pd.Series(etp_site, index=df.index)
@@ -1,11 +1,28 @@
+import json
 import numpy as np
 import pandas as pd
-from sklearn.neighbors import BallTree
+from pathlib import Path
 
+import stockage
 
-# Rayon de la terre (km)
+
+# Rayon de la terre (km)
 RAYON_TERRE_KM = 6371.
 
+# Distance minimale (km) pour éviter un poids infini d'une station sur un site
+DISTANCE_MIN_KM = 0.1
+
+# Index des emprises (latitude et longitude min/max) des départements,
+# calculées à partir des contours des communes et livré avec le code
+FILEPATH_INDEX_DEPARTEMENTS = Path(__file__).with_name(
+    "emprises_departements.json")
+
+# Identifiants Météo-France des départements de code INSEE non numérique
+ID_DEPARTEMENTS_CODES = {'2A': 20, '2B': 20}
+
+# Précision (degrés) des emprises, arrondies vers l'extérieur
+PRECISION_EMPRISE = 1.e-3
+
 def conversion_latlon_rad(df_liste_stations, latlon_labels):
     '''Conversion de degrés en radians pour toutes les stations.'''
     df_latlon_rad = pd.DataFrame(index=df_liste_stations.index, dtype=float)
@@ -16,6 +33,9 @@ def conversion_latlon_rad(df_liste_stations, latlon_labels):
 
 def calcul_arbre(df_liste_stations, latlon_labels):
     '''Calcul de l'arbre des stations les plus proches.'''
+    # Import à la première utilisation (démarrage de l'application)
+    from sklearn.neighbors import BallTree
+
     df_latlon_rad = conversion_latlon_rad(df_liste_stations, latlon_labels)
 
     arbre = BallTree(df_latlon_rad, metric='haversine')
@@ -53,9 +73,17 @@ def selection_stations_plus_proches(
     return df_liste_stations_nn
 
 def interpolation_inverse_distance_carre(df, s_dist_km):
-    '''Interpolation des stations les plus proches pondérée par l'inverse de la distance au carré.'''
-    # Calcul des poids à partir des distances
-    poids = 1. / s_dist_km**2
+    '''Interpolation des stations les plus proches pondérée par l'inverse de la distance au carré.
+
+    Seules les colonnes numériques sont interpolées.
+    '''
+    df = df.select_dtypes('number')
+
+    # Calcul des poids à partir des distances bornées, dans le type
+    # flottant de la donnée (float32 pour une donnée compacte, float64
+    # pour des entiers)
+    poids = (1. / np.maximum(s_dist_km, DISTANCE_MIN_KM)**2).astype(
+        np.result_type(np.float32, *df.dtypes))
 
     # Adaptation des dimensions des poids aux données météo
     df_piv = df.unstack()
@@ -64,4 +92,190 @@ def interpolation_inverse_distance_carre(df, s_dist_km):
     # Interpolation
     df_ref = ((df_piv * poids_piv).sum(0) / poids_piv.sum(0)).unstack().transpose()
     
-    return df_ref
\ No newline at end of file
+    return df_ref
+
+def interpolation_inverse_distance_carre_tableau(valeurs, dist_km):
+    '''Interpolation pondérée par l'inverse de la distance au carré d'un tableau
+    dont le premier axe est celui des stations (valeurs manquantes ignorées).'''
+    poids = (1. / np.maximum(np.asarray(dist_km, dtype=float),
+                             DISTANCE_MIN_KM)**2).astype(valeurs.dtype)
+    poids = poids.reshape((-1,) + (1,) * (valeurs.ndim - 1))
+    valide = ~np.isnan(valeurs)
+
+    # Sommes pondérées sur les stations disponibles
+    numerateur = (np.where(valide, valeurs, 0) * poids).sum(0)
+    denominateur = (valide * poids).sum(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valeurs_ref = numerateur / denominateur
+
+    return valeurs_ref
+
+def interpolation_inverse_distance_carre_nombres(df, s_dist_km, nombres=None):
+    '''Interpolations pour chaque nombre K de stations les plus proches en une passe.
+
+    Les stations de s_dist_km (K_max stations) sont triées par distance
+    et les sommes pondérées sont cumulées sur les stations : l'estimation
+    avec les K plus proches est le rapport des sommes cumulées jusqu'à la
+    K-ième station. Le résultat est indexé par nombre de stations
+    (nn_nombre) et par date, pour tous les K ≤ K_max par défaut.
+    '''
+    s_dist_km = s_dist_km.sort_values(kind='stable')
+    if nombres is None:
+        nombres = range(1, len(s_dist_km) + 1)
+    nombres = np.asarray(nombres, dtype=int)
+    if np.any(nombres < 1) or np.any(nombres > len(s_dist_km)):
+        raise ValueError(f"Les nombres de stations doivent être compris "
+                         f"entre 1 et {len(s_dist_km)}.")
+
+    # Donnée (station × date × variable) dans l'ordre des distances, les
+    # stations sans donnée étant manquantes
+    temps = df.index.unique(level=-1).sort_values()
+    valeurs = df.reindex(pd.MultiIndex.from_product(
+        [s_dist_km.index, temps])).to_numpy().reshape(
+            len(s_dist_km), len(temps), df.shape[1])
+    poids = (1. / np.maximum(s_dist_km.to_numpy(dtype=float), DISTANCE_MIN_KM)**2
+             ).astype(valeurs.dtype)[:, None, None]
+    valide = ~np.isnan(valeurs)
+
+    # Sommes pondérées cumulées sur les stations disponibles
+    numerateur = np.cumsum(np.where(valide, valeurs, 0) * poids, axis=0)
+    denominateur = np.cumsum(valide * poids, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valeurs_ref = numerateur[nombres - 1] / denominateur[nombres - 1]
+
+    index = pd.MultiIndex.from_product([nombres, temps],
+                                       names=['nn_nombre', temps.name])
+    df_ref = pd.DataFrame(valeurs_ref.reshape(-1, valeurs.shape[-1]),
+                          index=index, columns=df.columns)
+
+    return df_ref
+
+def calcul_matrice_poids_inverse_distance_carre(
+    df_liste_stations, df_sites, latlon_labels, nombre=None, rayon_km=None):
+    '''Matrice creuse (sites × stations) des poids en inverse de la distance au carré.
+
+    Les stations les plus proches de chaque site (un nombre donné ou dans
+    un rayon) sont identifiées en une seule requête de l'arbre. Les sites
+    sont donnés par une DataFrame avec les mêmes étiquettes de latitude
+    et de longitude que la liste des stations.
+    '''
+    arbre = calcul_arbre(df_liste_stations, latlon_labels)
+    sites_latlon_rad = conversion_latlon_rad(df_sites, latlon_labels)
+
+    if nombre is not None:
+        dist_rad_arr, ind_arr = arbre.query(sites_latlon_rad, k=nombre)
+    elif rayon_km is not None:
+        rayon_rad = rayon_km / RAYON_TERRE_KM
+        ind_arr, dist_rad_arr = arbre.query_radius(
+            sites_latlon_rad, rayon_rad,
+            count_only=False, return_distance=True, sort_results=True)
+
+    # Coordonnées creuses des couples (site, station)
+    nombres_voisins = [len(_) for _ in ind_arr]
+    lignes = np.repeat(np.arange(len(df_sites)), nombres_voisins)
+    colonnes = np.concatenate(list(ind_arr)).astype(int)
+    dist_km = np.concatenate(list(dist_rad_arr)) * RAYON_TERRE_KM
+    poids = 1. / np.maximum(dist_km, DISTANCE_MIN_KM)**2
+
+    from scipy import sparse
+
+    matrice = sparse.csr_matrix(
+        (poids, (lignes, colonnes)),
+        shape=(len(df_sites), len(df_liste_stations)))
+    df_poids = pd.DataFrame.sparse.from_spmatrix(
+        matrice, index=df_sites.index, columns=df_liste_stations.index)
+
+    return df_poids
+
+def interpolation_sites_inverse_distance_carre(df, df_poids):
+    '''Interpolation de tous les sites en une passe par produit matriciel creux.
+
+    La donnée des stations (indexée par station et par date) est
+    multipliée par la matrice des poids. Les poids sont renormalisés à
+    chaque heure et pour chaque variable sur les stations disponibles.
+    Le résultat est indexé par site et par date.
+    '''
+    matrice = df_poids.sparse.to_coo().tocsr()
+
+    # Donnée des stations (stations × (variable, date)) alignée sur la matrice
+    df_piv = df.unstack().reindex(df_poids.columns)
+    valeurs = df_piv.to_numpy()
+    valide = ~np.isnan(valeurs)
+    matrice = matrice.astype(valeurs.dtype)
+
+    # Sommes pondérées sur les stations disponibles
+    numerateur = matrice @ np.where(valide, valeurs, 0)
+    denominateur = matrice @ valide.astype(valeurs.dtype)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valeurs_sites = numerateur / denominateur
+
+    df_sites = pd.DataFrame(valeurs_sites, index=df_poids.index,
+                            columns=df_piv.columns).stack(
+        level=-1, future_stack=True)
+
+    return df_sites
+
+def calcul_index_departements(df_emprises_communes):
+    '''Emprises des départements à partir des emprises de leurs communes.
+
+    df_emprises_communes donne pour chaque commune le code INSEE de son
+    département (departement) et son rectangle en latitude et en
+    longitude (lat_min, lat_max, lon_min, lon_max). L'emprise d'un
+    département contient ainsi toutes ses stations, quel que soit le
+    réseau. Les deux départements de Corse sont réunis sous
+    l'identifiant 20 des stations Météo-France.
+    '''
+    id_departements = df_emprises_communes['departement'].map(
+        lambda code: ID_DEPARTEMENTS_CODES.get(code, code)).astype(int)
+    df_groupe = df_emprises_communes.groupby(
+        id_departements.rename('id_departement'))
+
+    # Arrondi vers l'extérieur de l'emprise
+    df_index = pd.DataFrame({
+        'lat_min': np.floor(df_groupe['lat_min'].min() / PRECISION_EMPRISE),
+        'lat_max': np.ceil(df_groupe['lat_max'].max() / PRECISION_EMPRISE),
+        'lon_min': np.floor(df_groupe['lon_min'].min() / PRECISION_EMPRISE),
+        'lon_max': np.ceil(df_groupe['lon_max'].max() / PRECISION_EMPRISE)
+    }) * PRECISION_EMPRISE
+
+    return df_index.round(3)
+
+def sauvegarder_index_departements(df_index,
+                                   filepath=FILEPATH_INDEX_DEPARTEMENTS):
+    '''Sauvegarde compacte de l'index des emprises des départements.'''
+    index = {str(id_dep): list(emprise)
+             for id_dep, emprise in zip(df_index.index, df_index.values)}
+    def ecrire(filepath_tmp):
+        with open(filepath_tmp, 'w') as f:
+            json.dump({'colonnes': list(df_index.columns), 'emprises': index}, f)
+
+    stockage.ecrire_atomique(filepath, ecrire)
+
+def lire_index_departements(filepath=FILEPATH_INDEX_DEPARTEMENTS):
+    '''Lecture de l'index des emprises des départements.'''
+    with open(filepath) as f:
+        index = json.load(f)
+    df_index = pd.DataFrame.from_dict(
+        index['emprises'], orient='index', columns=index['colonnes'])
+    df_index.index = df_index.index.astype(int).rename('id_departement')
+
+    return df_index
+
+def selection_departements(ref_station_latlon, rayon_km, df_index=None):
+    '''Départements dont l'emprise intersecte le cercle de rayon donné autour de la référence.'''
+    if df_index is None:
+        df_index = lire_index_departements()
+    lat, lon = np.deg2rad(ref_station_latlon)
+
+    # Point de chaque emprise le plus proche de la référence
+    lat_proche = np.deg2rad(np.clip(
+        ref_station_latlon[0], df_index['lat_min'], df_index['lat_max']))
+    lon_proche = np.deg2rad(np.clip(
+        ref_station_latlon[1], df_index['lon_min'], df_index['lon_max']))
+
+    # Distance de haversine de la référence à l'emprise
+    a = (np.sin((lat_proche - lat) / 2)**2 + np.cos(lat) * np.cos(lat_proche) *
+         np.sin((lon_proche - lon) / 2)**2)
+    dist_km = 2 * RAYON_TERRE_KM * np.arcsin(np.sqrt(a))
+
+    return list(df_index.index[dist_km <= rayon_km])
@@ -1,12 +1,17 @@
+from collections import defaultdict
+import hashlib
 from io import StringIO
 import json
 import numpy as np
 import pandas as pd
 from pathlib import Path
 import requests
+import threading
 import time
 import warnings
 
+import stockage
+
 # Host
 HOST = 'https://public-api.meteofrance.fr'
 DOMAIN = 'public'
@@ -48,7 +53,14 @@ ID_STATION_DONNEE_LABEL = {
     'DPClim': 'POSTE'
 }
 
-# Étiquette du drapeau d'ouverture des stations
+# Étiquette de l'altitude des stations
+ALTITUDE_LABEL = {
+    'DPObs': 'Altitude',
+    'DPPaquetObs': 'Altitude',
+    'DPClim': 'alt'
+}
+
+# Étiquette du drapeau d'ouverture des stations
 OUVERT_STATION_LABEL = {
     'DPObs': None,
     'DPPaquetObs': None,
@@ -76,24 +88,24 @@ TIME_LABEL = {
     'DPClim': 'DATE'
 }
 
-# Conversion de unités des variables
-identite = lambda x: x
+# Conversion affine des unités des variables vers celles de UNITES :
+# valeur * facteur + décalage
 VARIABLES_CONVERSION_UNITES = {
     'DPObs': {
-        'rayonnement_global': identite,
-        'temperature_2m': identite,
-        'humidite_relative': lambda x: x / 100,
-        'vitesse_vent_10m': identite,
-        'precipitation': identite,
-        'etp': identite
+        'rayonnement_global': (1., 0.),
+        'temperature_2m': (1., 0.),
+        'humidite_relative': (1.e-2, 0.),
+        'vitesse_vent_10m': (1., 0.),
+        'precipitation': (1., 0.),
+        'etp': (1., 0.)
     },
     'DPClim': {
-        'rayonnement_global': lambda x: x * 1.e4,
-        'temperature_2m': lambda x: x + 273.15,
-        'humidite_relative': lambda x: x / 100,
-        'vitesse_vent_10m': identite,
-        'precipitation': identite,
-        'etp': identite
+        'rayonnement_global': (1.e4, 0.),
+        'temperature_2m': (1., 273.15),
+        'humidite_relative': (1.e-2, 0.),
+        'vitesse_vent_10m': (1., 0.),
+        'precipitation': (1., 0.),
+        'etp': (1., 0.)
     }
 }
 VARIABLES_CONVERSION_UNITES['DPPaquetObs'] = VARIABLES_CONVERSION_UNITES['DPObs']
@@ -145,6 +157,21 @@ TZ = 'UTC'
 # Dossier des données
 DATA_DIR = Path('data')
 
+# Longueur de l'empreinte des identifiants des stations dans les noms de fichiers
+LONGUEUR_EMPREINTE_STATIONS = 12
+
+# Types de la représentation compacte des mesures et des identifiants des stations
+DTYPE_COMPACT = np.float32
+DTYPE_ID_STATION_COMPACT = np.int32
+
+# Délai de publication des paquets horaires après l'heure d'observation
+DELAI_PUBLICATION_PAQUET = pd.Timedelta(minutes=15)
+
+# Cache en mémoire des derniers paquets par département et verrous associés
+_CACHE_PAQUETS = {}
+_VERROUS_PAQUETS = defaultdict(threading.Lock)
+_VERROU_CACHE_PAQUETS = threading.Lock()
+
 class Client(object):
     def __init__(self, api, application_id=None):
         self.session = requests.Session()
@@ -154,6 +181,7 @@ class Client(object):
                              f"Les choix possibles sont: {AVAILABLE_APIS}")
         self.api = api
         self.latlon_labels = LATLON_LABELS[self.api]
+        self.altitude_label = ALTITUDE_LABEL[self.api]
         self.station_name_label = STATION_NAME_LABEL[self.api]
         self.id_station_label = ID_STATION_LABEL[self.api]
         self.ouvert_station_label = OUVERT_STATION_LABEL[self.api]
@@ -200,8 +228,9 @@ class Client(object):
     def token_has_expired(self, response):
         status = response.status_code
         content_type = response.headers['Content-Type']
-        repJson = response.text
 
+        # Le contenu n'est lu qu'en cas d'erreur pour ne pas consommer
+        # le flux des réponses demandées avec stream=True
         if status == 401 and 'application/json' in content_type:
             repJson = response.text
             
@@ -233,7 +262,52 @@ def response_text_to_frame(client, response, **kwargs):
     
     return df
 
-def demande(client, section, params=None, frequence=None, verify=False):
+def get_dtypes_variables(client, frequence, variables=None, dtype=float):
+    '''Types explicites des colonnes des variables connues.
+
+    Sans variables, celles de la fréquence sont utilisées, ou aucune
+    (None) si la fréquence n'a pas de variables connues.
+    '''
+    if variables is None:
+        if frequence not in client.variables_labels:
+            return None
+        variables = client.variables_labels[frequence].values()
+
+    return {variable: dtype for variable in variables}
+
+def response_stream_to_frame(
+    client, response, frequence, variables=None, dtype=float, **kwargs):
+    '''Lecture en flux d'une réponse CSV sans copie intermédiaire du texte.
+
+    Le CSV est lu directement depuis le flux d'octets de la réponse
+    (demandée avec stream=True) par le moteur C de pandas. Seules les
+    colonnes d'identifiant, de temps et des variables sont gardées et
+    les variables sont lues avec un type explicite. Pour une fréquence
+    sans variables connues, toutes les colonnes sont gardées avec les
+    types déduits par pandas.
+    '''
+    dtypes = get_dtypes_variables(
+        client, frequence, variables=variables, dtype=dtype)
+    if dtypes is None:
+        usecols = None
+    else:
+        colonnes = {client.id_station_donnee_label, client.time_label,
+                    *dtypes}
+        usecols = lambda c: c in colonnes
+
+    # Décompression éventuelle (gzip) à la volée
+    response.raw.decode_content = True
+    kwargs.setdefault('encoding', response.encoding or 'utf-8')
+
+    # Connexion rendue au pool une fois le flux lu
+    with response:
+        df = pd.read_csv(response.raw, sep=';', engine='c', usecols=usecols,
+                         dtype=dtypes, **kwargs)
+
+    return df
+
+def demande(client, section, params=None, frequence=None, verify=False,
+            stream=False):
     '''Demande de la liste des stations.'''
     url = f"{HOST}/{DOMAIN}/{client.api}/{VERSION}/{section}"
 
@@ -241,7 +315,7 @@ def demande(client, section, params=None, frequence=None, verify=False):
         url += f'/{frequence}'
     
     response = client.request(
-        'GET', url, params=params, verify=verify)
+        'GET', url, params=params, verify=verify, stream=stream)
 
     return response
 
@@ -274,10 +348,23 @@ def get_filepath_liste_stations_nn(
 
     return filepath_nn
 
+def get_empreinte_stations(id_stations):
+    '''Empreinte courte des identifiants des stations (indépendante de leur ordre).'''
+    str_stations = ','.join(str(_) for _ in sorted(int(_) for _ in id_stations))
+
+    return hashlib.sha256(str_stations.encode()).hexdigest()[
+        :LONGUEUR_EMPREINTE_STATIONS]
+
 def get_filepath_donnee_periode(
     client, ref_station_name, df_liste_stations=None,
     date_deb_periode=None, date_fin_periode=None,
-    frequence=None, ref=False, nn_nombre=None):
+    frequence=None, ref=False, nn_nombre=None, empreinte=False):
+    '''Fichier de la donnée des stations (ou de la référence) sur une période.
+
+    Si empreinte, le nom contient l'empreinte des identifiants des
+    stations de df_liste_stations : d'autres stations en même nombre
+    ont leur propre fichier.
+    '''
     filename = f"donnees_{client.api}"
     if frequence is not None:
         filename += f"_{frequence}"
@@ -295,34 +382,55 @@ def get_filepath_donnee_periode(
     if date_fin_periode is not None:
         str_date_fin_periode = '_' + get_str_date(date_fin_periode)
 
+    str_empreinte = ''
+    if empreinte:
+        str_empreinte = '_' + get_empreinte_stations(df_liste_stations.index)
+
     str_station = "ref" if ref else "stations"
     
     filename += (f"_{str_ref_station_name}_{str_nn}"
                  f"{str_date_deb_periode}{str_date_fin_periode}"
-                 f"_{str_station}.csv")
+                 f"{str_empreinte}_{str_station}.csv")
     parent = DATA_DIR / client.api
     parent.mkdir(parents=True, exist_ok=True)
     filepath = parent / filename
     
     return filepath
 
-def compiler_donnee_des_stations_date(
-    client, df_liste_stations, date, frequence=None):
-    df = pd.DataFrame(dtype=float)
+def concatener(frames, dtype=float):
+    '''Concaténation en une seule passe des DataFrames produits.'''
+    frames = list(frames)
+    if len(frames) == 0:
+        return pd.DataFrame(dtype=dtype)
+
+    return pd.concat(frames)
+
+def generer_donnee_des_stations_date(
+    client, df_liste_stations, date, frequence=None, variables=None,
+    dtype=float):
+    '''Production des DataFrames de chaque station pour une date.'''
     for id_station in df_liste_stations.index:
         # Paramètres définissant la station, la date et le format des données
         params = {'id_station': id_station, 'date': date, 'format': FMT}
         
         # Requête pour la station
         section = 'station'
-        response = demande(client, section, params=params, frequence=frequence)
+        response = demande(client, section, params=params, frequence=frequence,
+                           stream=True)
+
+        # DataFrame de la station
+        df_brute = response_stream_to_frame(
+            client, response, frequence, variables=variables, dtype=dtype)
+        df_station = df_brute.iloc[[0]].set_axis([id_station])
 
-        # DataFrame de la station
-        s_station = response_text_to_frame(response).iloc[0]
-        df_station = s_station.to_frame(id_station).transpose()
+        yield df_station
 
-        # Compilation
-        df = pd.concat([df, df_station])
+def compiler_donnee_des_stations_date(
+    client, df_liste_stations, date, frequence=None, variables=None,
+    dtype=float):
+    df = concatener(generer_donnee_des_stations_date(
+        client, df_liste_stations, date, frequence=frequence,
+        variables=variables, dtype=dtype), dtype=dtype)
         
     return df
 
@@ -342,21 +450,21 @@ def compiler_commandes_des_stations_periode(
         section = 'commande-station'
         response = demande(client, section, params=params, frequence=frequence)
 
-        # Récupération de l'identifiant de la commande pour la station
+        # Récupération de l'identifiant de la commande pour la station
         id_commandes[id_station] = (
             response.json()['elaboreProduitAvecDemandeResponse']['return'])
 
     return id_commandes
 
-def compiler_telechargement_des_stations_periode(
+def generer_telechargement_des_stations_periode(
     client, df_liste_stations, date_deb_periode, date_fin_periode,
-    frequence=None, read_csv_kwargs={},
+    frequence=None, variables=None, dtype=float, read_csv_kwargs={},
     desired_status_code=201, timeout=300, retry_interval=5):
+    '''Production des DataFrames de chaque station pour une période.'''
     id_commandes = compiler_commandes_des_stations_periode(
         client, df_liste_stations, date_deb_periode, date_fin_periode,
         frequence=frequence)
     
-    df = pd.DataFrame(dtype=float)
     for id_station, id_cmde in id_commandes.items():    
                 
         # Requête pour la station
@@ -365,13 +473,15 @@ def compiler_telechargement_des_stations_periode(
 
         start_time = time.time()
         while True:
-            response = demande(client, section, params=params, frequence='fichier')
+            response = demande(client, section, params=params, frequence='fichier',
+                               stream=True)
             
             # Check if the status code matches
             if response.status_code == desired_status_code:
                 break
             else:
                 print(f"Received status code {response.status_code}. Retrying...")
+                response.close()
         
             # Check if the timeout has been reached
             if time.time() - start_time > timeout:
@@ -382,14 +492,25 @@ def compiler_telechargement_des_stations_periode(
             # Wait before the next attempt
             time.sleep(retry_interval)
 
-        # DataFrame de la station
-        df_station = response_text_to_frame(
-            client, response, parse_dates=[client.time_label],
+        # DataFrame de la station
+        df_station = response_stream_to_frame(
+            client, response, frequence, variables=variables, dtype=dtype,
+            parse_dates=[client.time_label],
             index_col=[client.id_station_donnee_label, client.time_label],
             decimal=',', **read_csv_kwargs)
         
-        # Compilation
-        df = pd.concat([df, df_station])
+        yield df_station
+
+def compiler_telechargement_des_stations_periode(
+    client, df_liste_stations, date_deb_periode, date_fin_periode,
+    frequence=None, variables=None, dtype=float, read_csv_kwargs={},
+    desired_status_code=201, timeout=300, retry_interval=5):
+    df = concatener(generer_telechargement_des_stations_periode(
+        client, df_liste_stations, date_deb_periode, date_fin_periode,
+        frequence=frequence, variables=variables, dtype=dtype,
+        read_csv_kwargs=read_csv_kwargs,
+        desired_status_code=desired_status_code, timeout=timeout,
+        retry_interval=retry_interval), dtype=dtype)
 
     localisation_temps(df)
 
@@ -397,38 +518,140 @@ def compiler_telechargement_des_stations_periode(
         
     return df      
 
-def compiler_donnee_des_departements(
-    client, df_liste_stations, frequence=None):
+def telecharger_paquet_departement(
+    client, id_departement, frequence=None, variables=None, dtype=float):
+    '''Téléchargement du paquet d'un département indexé par station et par date.'''
+    params = {'format': FMT, 'id-departement': id_departement}
+    section = 'paquet'
+    response = demande(client, section, params=params, frequence=frequence,
+                       stream=True)
+
+    df_departement = response_stream_to_frame(
+        client, response, frequence, variables=variables, dtype=dtype,
+        parse_dates=[client.time_label],
+        index_col=[client.id_station_donnee_label, client.time_label])
+
+    return df_departement
+
+def get_heure_publication(date=None, delai_publication=DELAI_PUBLICATION_PAQUET):
+    '''Heure UTC du dernier paquet publié par Météo-France à une date.'''
+    date = pd.Timestamp.now(tz=TZ) if date is None else pd.Timestamp(date)
+
+    return (date - delai_publication).floor('h')
+
+def get_filepath_paquet(client, id_departement, heure, frequence=None):
+    filename = f"paquet_{client.api}"
+    if frequence is not None:
+        filename += f"_{frequence}"
+    filename += f"_{id_departement:d}_{get_str_date(heure)}.pkl"
+    parent = DATA_DIR / client.api / 'paquets'
+    parent.mkdir(parents=True, exist_ok=True)
+    filepath = parent / filename
+
+    return filepath
+
+def get_filepath_verrou_paquets(client, id_departement, frequence=None):
+    '''Fichier dont le verrou est partagé par les paquets d'un département.'''
+    filename = f"paquet_{client.api}"
+    if frequence is not None:
+        filename += f"_{frequence}"
+    filename += f"_{id_departement:d}"
+
+    return DATA_DIR / client.api / 'paquets' / filename
+
+def lire_paquet_departement(
+    client, id_departement, frequence=None, variables=None, dtype=float,
+    cache=True, heure=None):
+    '''Paquet d'un département servi par le cache s'il est à jour.
+
+    Le cache garde le dernier paquet publié de chaque département en
+    mémoire et sur disque (data/<api>/paquets/). Un paquet absent du
+    cache ou plus ancien que la dernière publication est téléchargé
+    puis mis en cache pour les demandes suivantes. Un même verrou,
+    jamais supprimé, sert à toutes les heures d'un département.
+    '''
+    if not cache:
+        return telecharger_paquet_departement(
+            client, id_departement, frequence=frequence, variables=variables,
+            dtype=dtype)
+
+    if heure is None:
+        heure = get_heure_publication()
+    cle = (client.api, frequence, id_departement)
+    with _VERROU_CACHE_PAQUETS:
+        verrou = _VERROUS_PAQUETS[cle]
+    with verrou:
+        heure_cache, df_departement = _CACHE_PAQUETS.get(cle, (None, None))
+        if heure_cache != heure:
+            filepath = get_filepath_paquet(
+                client, id_departement, heure, frequence=frequence)
+            filepath_verrou = get_filepath_verrou_paquets(
+                client, id_departement, frequence=frequence)
+            # Un seul processus télécharge le paquet, les autres le lisent
+            # (toutes les variables sont gardées pour servir toute demande)
+            df_departement = stockage.obtenir_ou_calculer(
+                filepath,
+                lambda: telecharger_paquet_departement(
+                    client, id_departement, frequence=frequence),
+                pd.read_pickle, lambda df, f: df.to_pickle(f),
+                cle_verrou=filepath_verrou)
+
+            # Suppression des paquets plus anciens du département (pas du verrou)
+            motif = filepath.name.replace(get_str_date(heure), '*')
+            with stockage.verrou(filepath_verrou):
+                for filepath_ancien in filepath.parent.glob(motif):
+                    if filepath_ancien != filepath:
+                        filepath_ancien.unlink(missing_ok=True)
+            _CACHE_PAQUETS[cle] = (heure, df_departement)
+
+    if variables is not None:
+        # Variables absentes du paquet gardées comme valeurs manquantes
+        df_departement = df_departement.reindex(columns=list(variables))
+
+    dtypes = get_dtypes_variables(
+        client, frequence, variables=variables, dtype=dtype)
+    if dtypes is None:
+        return df_departement
+
+    return df_departement.astype(
+        {variable: type_variable for variable, type_variable in dtypes.items()
+         if variable in df_departement.columns}, copy=False)
+
+def generer_donnee_des_departements(
+    client, df_liste_stations, frequence=None, variables=None, dtype=float,
+    cache=False):
+    '''Production des DataFrames des stations de la liste par département.'''
     id_departements = liste_id_stations_vers_liste_id_departements(
         df_liste_stations)
-    df_toutes = pd.DataFrame(dtype=float)
-    params = {'format': FMT}
     for id_dep in id_departements:
-        # Requête pour la station
-        section = 'paquet'
-        params['id-departement'] = id_dep 
-        response = demande(client, section, params=params, frequence=frequence)
-
-        # DataFrame pour le département indexé par identifiant station et par date
-        df_departement = response_text_to_frame(
-            client, response, parse_dates=[client.time_label]).set_index(
-            [client.id_station_donnee_label, client.time_label])
+        # DataFrame pour le département indexé par identifiant station et par date
+        df_departement = lire_paquet_departement(
+            client, id_dep, frequence=frequence, variables=variables,
+            dtype=dtype, cache=cache)
+
+        # Sélection des stations de la liste dès la lecture du département
+        id_stations = df_departement.index.get_level_values(
+            client.id_station_donnee_label)
         
-        # Compilation
-        df_toutes = pd.concat([df_toutes, df_departement])
+        yield df_departement[id_stations.isin(df_liste_stations.index)]
 
-    # Sélection des stations de la liste
-    try:
-        df = df_toutes.loc[df_liste_stations.index]
-    except KeyError:
-        df_idx0 = df_toutes.index.levels[0]
-        indices_commun = df_liste_stations.index.intersection(df_idx0)
-        df = df_toutes.loc[indices_commun]
-        indices_manquants = df_liste_stations.index.difference(df_idx0)
+def compiler_donnee_des_departements(
+    client, df_liste_stations, frequence=None, variables=None, dtype=float,
+    cache=False):
+    df_toutes = concatener(generer_donnee_des_departements(
+        client, df_liste_stations, frequence=frequence, variables=variables,
+        dtype=dtype, cache=cache), dtype=dtype)
+
+    # Sélection des stations de la liste dans l'ordre de la liste
+    df_idx0 = df_toutes.index.unique(level=0)
+    indices_commun = df_liste_stations.index.intersection(df_idx0, sort=False)
+    df = df_toutes.loc[indices_commun]
+    indices_manquants = df_liste_stations.index.difference(df_idx0)
+    if len(indices_manquants) > 0:
         warnings.warn(
             f"les stations {", ".join(indices_manquants.astype(str))} manquent.")
 
-    # Suppression des duplicatas
+    # Suppression des duplicatas
     df = df[~df.index.duplicated(keep=False)]
 
     inserer_noms_stations(client, df, df_liste_stations)
@@ -451,12 +674,14 @@ def renommer_variables(client, df, frequence):
 
     return df
 
-def inserer_noms_stations(client, df, df_liste_stations):
-    ''' Insertion des noms des stations.'''
-    id_stations_df = df.index.to_frame()[client.id_station_donnee_label]
-    liste_noms_stations = [df_liste_stations.loc[_, client.station_name_label]
-                           for _ in id_stations_df]
-    df.insert(0, client.station_name_label, liste_noms_stations)
+def inserer_noms_stations(client, df, df_liste_stations, categorie=False):
+    ''' Insertion des noms des stations (catégoriels si categorie).'''
+    id_stations_df = df.index.get_level_values(client.id_station_donnee_label)
+    noms_stations = df_liste_stations[client.station_name_label].reindex(
+        id_stations_df).to_numpy()
+    if categorie:
+        noms_stations = pd.Categorical(noms_stations)
+    df.insert(0, client.station_name_label, noms_stations)
 
 def get_str_date(date):
     try:
@@ -474,9 +699,99 @@ def localisation_temps(df, tz=TZ):
     df.index = df.index.set_levels(index)
 
 def convertir_unites(client, df):
+    '''Conversion des unités des variables déjà renommées.
+
+    Les colonnes qui ne sont pas des variables connues sont gardées
+    telles quelles.
+    '''
+    conversions = {}
     for variable, s in df.items():
-        df.loc[:, variable] = client.variables_conversion_unites[variable](s)
-    
-    return df
+        if variable in client.variables_conversion_unites:
+            facteur, decalage = client.variables_conversion_unites[variable]
+            conversions[variable] = s * facteur + decalage
+
+    return df.assign(**conversions)
+
+def get_schema(client, frequence, variables=None):
+    '''Schéma de normalisation des variables d'une fréquence.
+
+    À chaque variable correspondent son étiquette dans les données
+    brutes et la conversion affine (facteur, décalage) de ses unités.
+    '''
+    labels = client.variables_labels[frequence]
+    if variables is None:
+        variables = labels
+
+    return {variable: (labels[variable],
+                       *client.variables_conversion_unites[variable])
+            for variable in variables if variable in labels}
+
+def normaliser(client, df, frequence, variables=None, dtype=float,
+               en_place=False):
+    '''Sélection, renommage, typage et conversion des unités en une passe.
+
+    Seules les colonnes du schéma présentes dans la donnée brute sont
+    gardées, les autres sont ignorées. Les colonnes déjà du type voulu
+    et sans conversion ne sont pas copiées. Avec en_place, les
+    conversions sont aussi faites sur place et modifient la donnée brute.
+    '''
+    colonnes = {}
+    for variable, (label, facteur, decalage) in get_schema(
+            client, frequence, variables=variables).items():
+        if label not in df.columns:
+            continue
+        valeurs = df[label].to_numpy(dtype=dtype)
+        if (facteur, decalage) != (1., 0.):
+            if en_place:
+                valeurs *= facteur
+                valeurs += decalage
+            else:
+                valeurs = valeurs * facteur + decalage
+        colonnes[variable] = valeurs
+
+    return pd.DataFrame(colonnes, index=df.index, copy=False)
+
+def lire_donnee_normalisee(client, filepath_or_buffer, frequence, ref=False,
+                           variables=None, dtype=float, **kwargs):
+    '''Lecture d'un fichier de donnée directement normalisée.
+
+    Seules les colonnes d'indice et des variables du schéma sont lues,
+    dans leur type, puis renommées et converties sur place sans copie
+    supplémentaire.
+    '''
+    labels = [label for label, _, _ in get_schema(
+        client, frequence, variables=variables).values()]
+    index_col = ([client.time_label] if ref else
+                 [client.id_station_donnee_label, client.time_label])
+    usecols = set(index_col + labels)
+    df = pd.read_csv(filepath_or_buffer, usecols=lambda c: c in usecols,
+                     index_col=index_col, parse_dates=[client.time_label],
+                     dtype={label: dtype for label in labels}, **kwargs)
+
+    return normaliser(client, df, frequence, variables=variables,
+                      dtype=dtype, en_place=True)
+
+def compacter(client, df):
+    '''Représentation compacte optionnelle d'une donnée météo.
+
+    Les mesures sont converties en float32, les noms des stations en
+    catégories et les identifiants des stations de l'indice en entiers
+    32 bits, ce qui divise environ par deux la mémoire occupée.
+    '''
+    df = df.copy()
+    for variable, s in df.items():
+        if pd.api.types.is_float_dtype(s):
+            df[variable] = s.astype(DTYPE_COMPACT)
+        elif variable == client.station_name_label:
+            df[variable] = s.astype('category')
+
+    if client.id_station_donnee_label in (df.index.names or []):
+        niveau = df.index.names.index(client.id_station_donnee_label)
+        if isinstance(df.index, pd.MultiIndex):
+            df.index = df.index.set_levels(
+                df.index.levels[niveau].astype(DTYPE_ID_STATION_COMPACT),
+                level=niveau)
+        else:
+            df.index = df.index.astype(DTYPE_ID_STATION_COMPACT)
 
-    
\ No newline at end of file
+    return df
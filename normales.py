@@ -0,0 +1,186 @@
+'''Index des normales climatologiques journalières de l'ETP et de la précipitation.
+
+À partir de la série journalière de référence d'un site sur plusieurs
+années (sortie de la chaîne de climatologie), la moyenne et les
+quantiles de chaque variable sont calculés pour chaque jour de l'année,
+sur une fenêtre de quelques jours autour de ce jour. La table
+(jours x variables x statistiques) est enregistrée en .npy, avec ses
+métadonnées en .json, et relue par projection en mémoire : la normale
+et l'anomalie d'une date sont lues en temps constant, sans relire
+l'historique.
+'''
+import json
+from pathlib import Path
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import meteofrance
+import stockage
+
+# Variables des normales
+VARIABLES = ['etp', 'precipitation']
+
+# Quantiles des normales
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# Demi-largeur (jours) de la fenêtre autour de chaque jour de l'année
+DEMI_FENETRE_JOURS = 7
+
+# Nombre de jours de la table (année bissextile : le 29 février a sa ligne)
+NOMBRE_JOURS = 366
+
+# Type des valeurs de la table
+DTYPE = np.float32
+
+# Fréquence de la chaîne de climatologie dont l'index est lu par l'application
+FREQUENCE_APPLICATION = 'quotidienne'
+
+def get_statistiques(quantiles=QUANTILES):
+    '''Noms des statistiques de la table : moyenne puis quantiles.'''
+    return ['moyenne'] + [f'q{100 * q:02.0f}' for q in quantiles]
+
+def get_filepath_normales(ref_station_name, frequence=FREQUENCE_APPLICATION):
+    '''Fichier de l'index d'un site construit par la chaîne d'une fréquence.
+
+    Le fichier ne dépend pas de l'API : l'index est construit par la
+    chaîne de climatologie (DPClim) et lu par l'application
+    (DPPaquetObs), pour la fréquence FREQUENCE_APPLICATION.
+    '''
+    str_ref_station_name = ref_station_name.lower().replace(' ', '')
+
+    return (meteofrance.DATA_DIR / 'normales' /
+            f"normales_{str_ref_station_name}_{frequence}.npy")
+
+def jour_annee(date):
+    '''Ligne de la table d'une date (jour de l'année d'une année bissextile).'''
+    date = pd.Timestamp(date)
+
+    return date.dayofyear - 1 + int(
+        (not date.is_leap_year) and (date.month > 2))
+
+def jours_annee(dates):
+    '''Lignes de la table de plusieurs dates.'''
+    dates = pd.DatetimeIndex(dates)
+
+    return (dates.dayofyear.to_numpy() - 1 +
+            (~dates.is_leap_year & (dates.month > 2)))
+
+def calcul_normales(df_jour, variables=VARIABLES, quantiles=QUANTILES,
+                    demi_fenetre=DEMI_FENETRE_JOURS):
+    '''Table des normales (jours x variables x statistiques) d'une série journalière.
+
+    Les valeurs de chaque jour de l'année sont celles des jours de la
+    fenêtre de toutes les années. Les valeurs manquantes sont ignorées
+    et un jour sans valeur a une normale manquante.
+    '''
+    dates = pd.DatetimeIndex(df_jour.index)
+    codes_annees, annees = pd.factorize(dates.year)
+
+    # Valeurs par année et par jour de l'année (manquantes hors de la série)
+    table = np.full((len(annees), NOMBRE_JOURS, len(variables)), np.nan)
+    table[codes_annees, jours_annee(dates)] = df_jour[variables].to_numpy(
+        dtype=float)
+
+    # Échantillons de la fenêtre de chaque jour (la fin de l'année est
+    # voisine du début de la même année)
+    echantillons = np.concatenate([
+        np.roll(table, decalage, axis=1)
+        for decalage in range(-demi_fenetre, demi_fenetre + 1)])
+
+    with warnings.catch_warnings():
+        # Moyenne et quantiles manquants des jours sans valeur
+        warnings.simplefilter('ignore', RuntimeWarning)
+        moyenne = np.nanmean(echantillons, axis=0)
+        valeurs_quantiles = np.nanquantile(echantillons, quantiles, axis=0)
+
+    return np.concatenate([moyenne[..., np.newaxis],
+                           np.moveaxis(valeurs_quantiles, 0, -1)],
+                          axis=-1).astype(DTYPE)
+
+def ecrire_normales(normales, metadonnees, filepath):
+    '''Écriture atomique de la table (.npy) puis de ses métadonnées (.json).'''
+    filepath = Path(filepath)
+    stockage.ecrire_atomique(filepath, lambda f: np.save(f, normales))
+
+    def ecrire_json(f):
+        with open(f, 'w') as fichier:
+            json.dump(metadonnees, fichier, ensure_ascii=False, indent=1)
+
+    stockage.ecrire_atomique(filepath.with_suffix('.json'), ecrire_json)
+
+def construire_normales(ref_station_name, df_jour,
+                        frequence=FREQUENCE_APPLICATION,
+                        variables=VARIABLES, quantiles=QUANTILES,
+                        demi_fenetre=DEMI_FENETRE_JOURS):
+    '''Calcul et enregistrement de l'index des normales d'un site.'''
+    normales = calcul_normales(df_jour, variables=variables,
+                               quantiles=quantiles, demi_fenetre=demi_fenetre)
+    dates = pd.DatetimeIndex(df_jour.index)
+    metadonnees = {
+        'site': ref_station_name,
+        'frequence': frequence,
+        'variables': list(variables),
+        'statistiques': get_statistiques(quantiles),
+        'demi_fenetre_jours': demi_fenetre,
+        'date_deb': str(dates.min().date()),
+        'date_fin': str(dates.max().date()),
+        'nombre_annees': int(dates.year.nunique())
+    }
+    filepath = get_filepath_normales(ref_station_name, frequence=frequence)
+    ecrire_normales(normales, metadonnees, filepath)
+
+    return filepath
+
+def lire_normales(ref_station_name, frequence=FREQUENCE_APPLICATION):
+    '''Index des normales d'un site (FileNotFoundError s'il n'est pas construit).'''
+    return IndexNormales(get_filepath_normales(
+        ref_station_name, frequence=frequence))
+
+class IndexNormales(object):
+    '''Normales et anomalies d'un site lues dans la table projetée en mémoire.'''
+    def __init__(self, filepath):
+        self.filepath = Path(filepath)
+        with open(self.filepath.with_suffix('.json')) as f:
+            self.metadonnees = json.load(f)
+        self.table = np.load(self.filepath, mmap_mode='r')
+        self._variables = {
+            variable: _ for _, variable in enumerate(
+                self.metadonnees['variables'])}
+        self._statistiques = {
+            statistique: _ for _, statistique in enumerate(
+                self.metadonnees['statistiques'])}
+
+    @property
+    def variables(self):
+        return list(self._variables)
+
+    @property
+    def statistiques(self):
+        return list(self._statistiques)
+
+    def normale(self, date, variable='etp', statistique='moyenne'):
+        '''Normale d'une variable pour une date.'''
+        return float(self.table[jour_annee(date), self._variables[variable],
+                                self._statistiques[statistique]])
+
+    def normales(self, dates, variable='etp', statistique='moyenne'):
+        '''Normales d'une variable pour plusieurs dates.'''
+        return pd.Series(
+            self.table[jours_annee(dates), self._variables[variable],
+                       self._statistiques[statistique]].astype(float),
+            index=dates, name=variable)
+
+    def normales_jour(self, date):
+        '''Toutes les normales d'une date (variables x statistiques).'''
+        return pd.DataFrame(self.table[jour_annee(date)].astype(float),
+                            index=self.variables, columns=self.statistiques)
+
+    def anomalie(self, date, valeur, variable='etp', statistique='moyenne'):
+        '''Écart d'une valeur à la normale de sa date.'''
+        return valeur - self.normale(date, variable, statistique)
+
+    def anomalies(self, s, variable=None, statistique='moyenne'):
+        '''Écarts d'une série journalière aux normales de ses dates.'''
+        return s - self.normales(s.index, variable or s.name, statistique)
@@ -0,0 +1,258 @@
+'''Noyaux de calcul fusionnés de l'ETP (Penman-Monteith) et du bilan hydrique.
+
+Les formules de etp.calcul_etp_clarete et de bilan.calcul_bilan sont
+écrites en une seule boucle sur des tableaux contigus, sans tableau
+intermédiaire. La boucle est compilée par Numba s'il est installé
+(compilation à la première utilisation, mise en cache sur disque).
+Sinon le moteur NumPy calcule les mêmes formules dans quelques
+tableaux de travail réutilisés par des opérations en place.
+
+Le moteur est choisi par le paramètre moteur ('numba' ou 'numpy') et
+par défaut selon la disponibilité de Numba. Les résultats sont ceux
+de l'implémentation de référence (aux arrondis près pour Numba).
+'''
+from functools import cache
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+import bilan
+import etp
+
+# Moteurs de calcul
+MOTEURS = ['numba', 'numpy']
+
+# Moteur par défaut : Numba s'il est installé
+MOTEUR = 'numba' if importlib.util.find_spec('numba') is not None else 'numpy'
+
+# Constantes de etp (figées dans les noyaux compilés)
+LAMBDA = etp.LAMBDA
+FACTEUR_GAMMA = etp.FACTEUR_GAMMA
+SIGMA = etp.SIGMA
+ALPHA = etp.ALPHA
+
+# Logarithme du passage de la vitesse du vent à 10 m à celle à 2 m
+LOG_VENT = np.log(67.8 * 10 - 5.42)
+
+def calcul_gamma(altitude):
+    '''Constante psychrométrique (kPa K-1) à l'altitude du site.'''
+    pression = 101.3 * ((293. - 0.0065 * altitude) / 293.)**5.26
+
+    return FACTEUR_GAMMA * pression
+
+def _boucle_etp(temperature, humidite, vent, rayonnement, zenith, clarete,
+                gamma, sortie):
+    '''ETP (mm h-1) heure par heure, toutes les formules dans une seule boucle.'''
+    for i in range(sortie.shape[0]):
+        t = temperature[i]
+        es = 0.6108 * np.exp(17.27 * (t - 273.15) / (t - 35.85))
+        delta = 4098. * es / (t - 35.85)**2
+        ee = es * humidite[i]
+        r_ns = (1 - ALPHA) * (rayonnement[i] * 1.e-6)
+        r_nl = SIGMA * t**4 * (0.34 - 0.14 * np.sqrt(ee)) * (
+            1.35 * clarete[i] - 0.35)
+        r_n = r_ns - r_nl
+        g_sol = 0.1 * r_n if zenith[i] < 90. else 0.5 * r_n
+        u2 = vent[i] * 4.87 / LOG_VENT
+        denominateur = delta + gamma * (1. + 0.34 * u2)
+        # Les valeurs manquantes sont gardées (comme np.maximum)
+        etp1 = delta * (r_n - g_sol) / LAMBDA / denominateur
+        if etp1 < 0.:
+            etp1 = 0.
+        etp2 = gamma * 37. / t * u2 * (es - ee) / denominateur
+        if etp2 < 0.:
+            etp2 = 0.
+        sortie[i] = etp1 + etp2
+
+def _etp_numpy(temperature, humidite, vent, rayonnement, zenith, clarete,
+               gamma, sortie):
+    '''ETP (mm h-1) par opérations en place dans cinq tableaux de travail.
+
+    L'ordre des opérations est celui de etp.calcul_etp_clarete.
+    '''
+    es = np.subtract(temperature, 273.15)
+    t_35 = np.subtract(temperature, 35.85)
+    np.multiply(es, 17.27, out=es)
+    np.divide(es, t_35, out=es)
+    np.exp(es, out=es)
+    np.multiply(es, 0.6108, out=es)
+
+    # Pente de la courbe de pression de vapeur (dans t_35)
+    np.square(t_35, out=t_35)
+    ee = np.multiply(es, 4098.)
+    delta = np.divide(ee, t_35, out=t_35)
+
+    # Pression de vapeur effective et déficit de pression (dans es)
+    np.multiply(es, humidite, out=ee)
+    np.subtract(es, ee, out=es)
+
+    # Rayonnement net aux ondes longues (dans r_n) puis net (dans sortie)
+    r_n = np.sqrt(ee, out=ee)
+    np.multiply(r_n, 0.14, out=r_n)
+    np.subtract(0.34, r_n, out=r_n)
+    travail = np.power(temperature, 4)
+    np.multiply(travail, SIGMA, out=travail)
+    np.multiply(travail, r_n, out=r_n)
+    np.multiply(clarete, 1.35, out=travail)
+    np.subtract(travail, 0.35, out=travail)
+    np.multiply(r_n, travail, out=r_n)
+    np.multiply(rayonnement, 1.e-6, out=sortie)
+    np.multiply(sortie, 1 - ALPHA, out=sortie)
+    np.subtract(sortie, r_n, out=sortie)
+
+    # Rayonnement net moins le flux du sol (dans r_n)
+    np.multiply(sortie, np.where(zenith < 90., 0.1, 0.5), out=r_n)
+    np.subtract(sortie, r_n, out=r_n)
+
+    # Vitesse du vent à 2 m (dans sortie) et dénominateur (dans travail)
+    u2 = np.multiply(vent, 4.87, out=sortie)
+    np.divide(u2, LOG_VENT, out=u2)
+    np.multiply(u2, 0.34, out=travail)
+    np.add(travail, 1., out=travail)
+    np.multiply(travail, gamma, out=travail)
+    denominateur = np.add(delta, travail, out=travail)
+
+    # Terme radiatif (dans delta)
+    np.multiply(delta, r_n, out=delta)
+    np.divide(delta, LAMBDA, out=delta)
+    np.divide(delta, denominateur, out=delta)
+    np.maximum(0, delta, out=delta)
+
+    # Terme aérodynamique (dans r_n) et ETP
+    np.divide(gamma * 37., temperature, out=r_n)
+    np.multiply(r_n, u2, out=r_n)
+    np.multiply(r_n, es, out=r_n)
+    np.divide(r_n, denominateur, out=r_n)
+    np.maximum(0, r_n, out=r_n)
+    np.add(delta, r_n, out=sortie)
+
+def _boucle_bilan(etp_jour, precipitation, kc, rfu, rfu_deficit, rfu_cible,
+                  seuil_irrigation, hauteur_vers_duree_irrigation, besoin,
+                  irrigation, duree):
+    '''Besoin, déclenchement et durée d'irrigation jour par jour.'''
+    for i in range(besoin.shape[0]):
+        etm_culture = -(kc * etp_jour[i])
+        b = rfu_cible[i] - (rfu + rfu_deficit + precipitation[i] + etm_culture)
+        besoin[i] = b
+        irrigation[i] = b > seuil_irrigation
+        duree[i] = hauteur_vers_duree_irrigation * (
+            b if irrigation[i] else 0.)
+
+def _bilan_numpy(etp_jour, precipitation, kc, rfu, rfu_deficit, rfu_cible,
+                 seuil_irrigation, hauteur_vers_duree_irrigation, besoin,
+                 irrigation, duree):
+    '''Besoin, déclenchement et durée d'irrigation par opérations en place.'''
+    np.multiply(etp_jour, -kc, out=duree)
+    np.add(precipitation, rfu + rfu_deficit, out=besoin)
+    np.add(besoin, duree, out=besoin)
+    np.subtract(rfu_cible, besoin, out=besoin)
+    np.greater(besoin, seuil_irrigation, out=irrigation)
+    duree.fill(0.)
+    np.copyto(duree, besoin, where=irrigation)
+    np.multiply(duree, hauteur_vers_duree_irrigation, out=duree)
+
+@cache
+def _noyau(nom):
+    '''Boucle compilée par Numba à la première utilisation.'''
+    import numba
+
+    return numba.njit(cache=True, nogil=True)(globals()[nom])
+
+def _get_noyau(moteur, boucle, fonction_numpy):
+    moteur = MOTEUR if moteur is None else moteur
+    if moteur not in MOTEURS:
+        raise ValueError(f"Moteur {moteur} inconnu (parmi {MOTEURS}).")
+    if moteur == 'numba':
+        return _noyau(boucle.__name__)
+
+    return fonction_numpy
+
+def _tableau(valeurs):
+    return np.ascontiguousarray(valeurs, dtype=float)
+
+def calcul_etp_tableaux(temperature, humidite, vent, rayonnement, zenith,
+                        clarete, altitude, moteur=None):
+    '''ETP (mm h-1) à partir de tableaux en unités SI.'''
+    temperature = _tableau(temperature)
+    sortie = np.empty_like(temperature)
+    noyau = _get_noyau(moteur, _boucle_etp, _etp_numpy)
+    noyau(temperature, _tableau(humidite), _tableau(vent),
+          _tableau(rayonnement), _tableau(zenith), _tableau(clarete),
+          calcul_gamma(altitude), sortie)
+
+    return sortie
+
+def calcul_etp_clarete(df, site, zenith, clarete, moteur=None):
+    '''Même calcul que etp.calcul_etp_clarete par un noyau fusionné.'''
+    etp_heure = calcul_etp_tableaux(
+        df['temperature_2m'], df['humidite_relative'],
+        df['vitesse_vent_10m'], df['rayonnement_global'], zenith, clarete,
+        site.altitude, moteur=moteur)
+
+    return pd.Series(etp_heure, index=df.index)
+
+def calcul_etp(df, latitude, longitude, altitude, moteur=None):
+    '''Même calcul que etp.calcul_etp par un noyau fusionné.'''
+    site = etp.creer_site(latitude, longitude, altitude)
+    zenith, clarete = etp.calcul_clarete(df, site)
+
+    return calcul_etp_clarete(df, site, zenith, clarete, moteur=moteur)
+
+def calcul_bilan(
+    df_meteo,
+    texture, fraction_cailloux,
+    culture, stade,
+    fraction_ru_remplie, ru_vers_rfu,
+    seuil_irrigation, hauteur_vers_duree_irrigation,
+    rfu_cible=None, moteur=None
+):
+    '''Même calcul que bilan.calcul_bilan par un noyau fusionné.
+
+    Seules les colonnes variant d'un jour à l'autre sont calculées par
+    le noyau, les autres sont constantes.
+    '''
+    if isinstance(df_meteo, pd.Series):
+        # Un seul jour : pas de boucle à fusionner
+        return bilan.calcul_bilan(
+            df_meteo, texture, fraction_cailloux, culture, stade,
+            fraction_ru_remplie, ru_vers_rfu, seuil_irrigation,
+            hauteur_vers_duree_irrigation, rfu_cible=rfu_cible)
+
+    profondeur_enracinement, profondeur_terrefine, ru, ru_remplie = (
+        bilan.calcul_reserve_utile(texture, fraction_cailloux, culture,
+                                   fraction_ru_remplie))
+    rfu = bilan.calcul_reserve_facilement_utilisable(ru, ru_vers_rfu)
+    rfu_deficit = bilan.calcul_reserve_facilement_utilisable(
+        ru_remplie, ru_vers_rfu) - rfu
+    kc = bilan.lire_kc()[culture][stade]
+
+    etp_jour = _tableau(df_meteo['etp'])
+    precipitation = _tableau(df_meteo['precipitation'])
+    nombre = len(etp_jour)
+    if rfu_cible is None:
+        rfu_cible = rfu
+    rfu_cible_jour = _tableau(np.broadcast_to(rfu_cible, nombre))
+    besoin = np.empty(nombre)
+    irrigation = np.empty(nombre, dtype=bool)
+    duree = np.empty(nombre)
+    noyau = _get_noyau(moteur, _boucle_bilan, _bilan_numpy)
+    noyau(etp_jour, precipitation, float(kc), float(rfu), float(rfu_deficit),
+          rfu_cible_jour, float(seuil_irrigation),
+          float(hauteur_vers_duree_irrigation), besoin, irrigation, duree)
+
+    df = pd.DataFrame({
+        'etp': -etp_jour,
+        'profondeur_enracinement': float(profondeur_enracinement),
+        'profondeur_terrefine': float(profondeur_terrefine),
+        'ru': float(ru),
+        'rfu': float(rfu),
+        'rfu_deficit': float(rfu_deficit),
+        'precipitation': precipitation,
+        'etm_culture': -(kc * etp_jour),
+        'besoin_irrigation': besoin,
+        'rfu_cible': rfu_cible_jour,
+        'irrigation': irrigation,
+        'duree_irrigation': duree}, index=df_meteo.index)
+
+    return df
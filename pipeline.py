@@ -0,0 +1,569 @@
+'''Chaîne de calcul de la climatologie mémoïsée par empreintes.
+
+Chaque étape est une fonction de ses paramètres et des sorties
+d'autres étapes. Sa sortie est gardée dans le cache sous une clé
+calculée à partir de son code, du code des modules du dépôt qu'elle
+utilise, de ses paramètres et des empreintes du contenu des sorties
+dont elle dépend. Une nouvelle exécution ne
+recalcule ainsi que les étapes dont une entrée a changé. Les
+empreintes étant celles du contenu, une étape recalculée qui produit
+la même sortie n'invalide pas les étapes suivantes.
+'''
+import ast
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+from pathlib import Path
+import pickle
+import pandas as pd
+
+import meteofrance
+import stockage
+
+# Dossier des modules du dépôt
+DIRPATH_MODULES = Path(__file__).resolve().parent
+
+# Dossier du cache des sorties des étapes
+DIRPATH_CACHE = meteofrance.DATA_DIR / 'cache'
+
+# Scénario (suivi de la fréquence) des bilans de la chaîne enregistrés
+# dans la base des résultats
+SCENARIO_CLIMATOLOGIE = 'climatologie'
+
+# Durée ajoutée à la date de début d'une année pour obtenir sa date de fin
+DECALAGE_FIN_ANNEE = {
+    'horaire': pd.Timedelta(hours=23),
+    'quotidienne': pd.Timedelta(0)
+}
+
+def empreinte(objet):
+    '''Empreinte (sha256) du contenu d'un objet.'''
+    h = hashlib.sha256()
+    if isinstance(objet, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(objet, index=True).to_numpy().tobytes())
+        if isinstance(objet, pd.DataFrame):
+            h.update(repr(list(objet.columns)).encode())
+        h.update(repr(objet.dtypes).encode())
+    else:
+        h.update(pickle.dumps(objet))
+
+    return h.hexdigest()
+
+def empreinte_code(fonction):
+    '''Empreinte du code source d'une fonction.'''
+    try:
+        code = inspect.getsource(fonction).encode()
+    except (OSError, TypeError):
+        code = fonction.__code__.co_code
+
+    return hashlib.sha256(code).hexdigest()
+
+def get_filepath_module(nom):
+    '''Fichier source d'un module du dépôt ou None.'''
+    try:
+        spec = importlib.util.find_spec(nom)
+    except (ImportError, ValueError):
+        return None
+    if (spec is None) or (spec.origin is None):
+        return None
+    filepath = Path(spec.origin).resolve()
+    if (filepath.suffix != '.py') or (filepath.parent != DIRPATH_MODULES):
+        return None
+
+    return filepath
+
+@functools.lru_cache(maxsize=None)
+def _analyser_module(filepath, date_modification):
+    '''Empreinte du code source d'un module et noms des modules qu'il importe.'''
+    source = filepath.read_bytes()
+    noms = set()
+    for noeud in ast.walk(ast.parse(source)):
+        if isinstance(noeud, ast.Import):
+            noms.update(_.name.split('.')[0] for _ in noeud.names)
+        elif isinstance(noeud, ast.ImportFrom) and (noeud.level == 0):
+            noms.add(noeud.module.split('.')[0])
+
+    return hashlib.sha256(source).hexdigest(), frozenset(noms)
+
+def empreintes_modules(fonction):
+    '''Empreintes du code des modules du dépôt utilisés par une fonction.
+
+    Les modules sont ceux dont la fonction utilise le nom (import au
+    niveau du module ou dans la fonction) et, récursivement, ceux
+    qu'ils importent. Le code des fonctions du même module appelées
+    par la fonction est aussi inclus.
+    '''
+    noms = set(fonction.__code__.co_names)
+    empreintes = {}
+    while noms:
+        nom = noms.pop()
+        if nom in empreintes:
+            continue
+        objet = fonction.__globals__.get(nom)
+        if inspect.isfunction(objet) and (
+                objet.__module__ == fonction.__module__):
+            empreintes[nom] = empreinte_code(objet)
+            noms.update(objet.__code__.co_names)
+            continue
+        filepath = get_filepath_module(nom)
+        if filepath is None:
+            continue
+        empreintes[nom], importes = _analyser_module(
+            filepath, filepath.stat().st_mtime_ns)
+        noms.update(importes)
+
+    return empreintes
+
+class Etape(object):
+    '''Étape de la chaîne.
+
+    dependances associe à chaque argument de la fonction le nom de
+    l'étape qui le fournit. parametres liste les paramètres de la
+    chaîne passés à la fonction. verifier(sortie), s'il est donné,
+    indique si une sortie en cache est encore valide (fichier écrit
+    par l'étape et remplacé depuis par exemple) : sinon elle est
+    recalculée. Le code des modules du dépôt utilisés
+    par la fonction fait partie de la clé. version permet d'invalider
+    le cache pour un autre changement (dépendance externe par exemple).
+    '''
+    def __init__(self, nom, fonction, dependances={}, parametres=[],
+                 version=1, verifier=None):
+        self.nom = nom
+        self.fonction = fonction
+        self.dependances = dict(dependances)
+        self.parametres = list(parametres)
+        self.version = version
+        self.verifier = verifier
+
+    def cle(self, contexte, parametres, empreintes):
+        '''Clé de la sortie pour ces paramètres et ces entrées.'''
+        description = dict(
+            nom=self.nom, version=self.version,
+            code=empreinte_code(self.fonction),
+            modules=empreintes_modules(self.fonction), contexte=contexte,
+            parametres=parametres, entrees=empreintes)
+        description = json.dumps(description, sort_keys=True, default=str)
+
+        return hashlib.sha256(description.encode()).hexdigest()
+
+class Chaine(object):
+    '''Chaîne d'étapes exécutée à la demande avec cache sur disque.
+
+    Les fonctions des étapes reçoivent le client et la fréquence, puis
+    les sorties de leurs dépendances et leurs paramètres par mot-clé.
+    '''
+    def __init__(self, client, frequence, etapes=[], dirpath_cache=None):
+        self.client = client
+        self.frequence = frequence
+        self.etapes = {}
+        self.dirpath_cache = (DIRPATH_CACHE if dirpath_cache is None
+                              else dirpath_cache)
+        # Étapes lues du cache ou calculées lors de la dernière exécution
+        self.journal = {}
+        # Étapes déjà recalculées à la demande
+        self._recalculees = set()
+        for etape in etapes:
+            self.ajouter(etape)
+
+    def ajouter(self, etape):
+        for dependance in etape.dependances.values():
+            if dependance not in self.etapes:
+                raise ValueError(f"Dépendance {dependance} de l'étape "
+                                 f"{etape.nom} inconnue.")
+        self.etapes[etape.nom] = etape
+
+    @property
+    def contexte(self):
+        return {'api': self.client.api, 'frequence': self.frequence}
+
+    def _get_filepath(self, nom, cle, suffixe='.pkl'):
+        dirpath = self.dirpath_cache / nom
+        dirpath.mkdir(parents=True, exist_ok=True)
+
+        return dirpath / f"{cle}{suffixe}"
+
+    def _resoudre(self, nom, parametres, resolues, recalculer):
+        '''Clé et empreinte de la sortie de l'étape, calculée au besoin.
+
+        Une sortie en cache n'est pas lue : seule son empreinte l'est.
+        '''
+        if nom in resolues:
+            return resolues[nom]
+        etape = self.etapes[nom]
+        empreintes = {argument: self._resoudre(
+            dependance, parametres, resolues, recalculer)[1]
+                      for argument, dependance in etape.dependances.items()}
+        parametres_etape = {_: parametres[_] for _ in etape.parametres
+                            if _ in parametres}
+        cle = etape.cle(self.contexte, parametres_etape, empreintes)
+        filepath_meta = self._get_filepath(nom, cle, '.json')
+
+        def lire_empreinte(filepath):
+            with open(filepath) as f:
+                return json.load(f)['empreinte']
+
+        def calculer():
+            # Calcul à partir des sorties des dépendances
+            entrees = {argument: self._charger(
+                dependance, parametres, resolues, recalculer)
+                       for argument, dependance in etape.dependances.items()}
+            sortie = etape.fonction(self.client, self.frequence,
+                                    **entrees, **parametres_etape)
+            # Sortie écrite avant ses métadonnées, qui attestent qu'elle existe
+            stockage.ecrire_pickle(sortie, self._get_filepath(nom, cle))
+            self.journal[nom] = 'calcul'
+
+            return empreinte(sortie)
+
+        def ecrire_empreinte(contenu, filepath):
+            with open(filepath, 'w') as f:
+                json.dump(dict(empreinte=contenu, parametres=parametres_etape,
+                               entrees=empreintes), f, default=str)
+
+        # Un seul processus calcule une même sortie, les autres la lisent
+        self.journal[nom] = 'cache'
+        contenu = stockage.obtenir_ou_calculer(
+            filepath_meta, calculer, lire_empreinte, ecrire_empreinte,
+            recalculer=(nom in recalculer))
+        if ((self.journal[nom] == 'cache') and (etape.verifier is not None)
+                and not etape.verifier(pd.read_pickle(
+                    self._get_filepath(nom, cle)))):
+            # Sortie en cache qui n'est plus valide
+            contenu = stockage.obtenir_ou_calculer(
+                filepath_meta, calculer, lire_empreinte, ecrire_empreinte,
+                recalculer=True)
+        if nom in recalculer:
+            self._recalculees.add(nom)
+        resolues[nom] = (cle, contenu)
+
+        return resolues[nom]
+
+    def _charger(self, nom, parametres, resolues, recalculer):
+        cle, _ = self._resoudre(nom, parametres, resolues, recalculer)
+
+        return pd.read_pickle(self._get_filepath(nom, cle))
+
+    def executer(self, nom, parametres, recalculer=[]):
+        '''Sortie de l'étape, en ne recalculant que ce qui a changé.
+
+        Les étapes de recalculer sont recalculées même si leur sortie est
+        en cache (par exemple pour un nouveau téléchargement), une seule
+        fois pour la chaîne.
+        '''
+        self.journal = {}
+        recalculer = set(recalculer) - self._recalculees
+
+        return self._charger(nom, parametres, {}, recalculer)
+
+def etape_departements(client, frequence, id_departements=None,
+                       ref_station_latlon=None, nn_rayon_km=None):
+    '''Départements donnés ou pouvant avoir des stations dans le rayon de recherche.
+
+    La liste des stations ne dépendant que des départements retenus,
+    elle n'est pas téléchargée de nouveau quand la référence ou le
+    rayon change sans changer les départements.
+    '''
+    import geo
+
+    if id_departements is None:
+        id_departements = geo.selection_departements(
+            ref_station_latlon, nn_rayon_km)
+
+    return sorted(int(_) for _ in id_departements)
+
+def etape_liste_stations(client, frequence, departements):
+    '''Liste des stations valides des départements.'''
+    l_listes = []
+    for id_dep in departements:
+        # Demande de la liste des stations pour le département
+        section = meteofrance.SECTION_LISTE_STATIONS
+        params = {'id-departement': id_dep}
+        response = meteofrance.demande(
+            client, section, params=params, frequence=frequence)
+        df_liste_stations_dep = meteofrance.response_text_to_frame(
+            client, response, index_col=client.id_station_label)
+
+        # Sauvegarde de la liste des stations par département
+        stockage.ecrire_csv(
+            df_liste_stations_dep, meteofrance.get_filepath_liste_stations(
+                client, frequence=frequence, id_departement=id_dep))
+        l_listes.append(df_liste_stations_dep)
+
+    return meteofrance.filtrer_stations_valides(
+        client, pd.concat(l_listes, axis='index'))
+
+def etape_stations_nn(client, frequence, liste_stations,
+                      ref_station_latlon=None, nn_nombre=None,
+                      nn_rayon_km=None):
+    '''Plus proches voisins de la station de référence.'''
+    import geo
+
+    return geo.selection_stations_plus_proches(
+        liste_stations, ref_station_latlon, client.latlon_labels,
+        nombre=nn_nombre, rayon_km=nn_rayon_km)
+
+def generer_donnee_stations_annees(client, frequence, stations_nn,
+                                   ref_station_name, date_deb_periode,
+                                   date_fin_periode):
+    '''Donnée des stations voisines complétée et lue année par année.
+
+    Seuls les intervalles absents du catalogue des données locales sont
+    téléchargés (catalogue.completer_donnee), sauvegardés et enregistrés
+    dans le catalogue, puis l'année est lue depuis les fichiers locaux.
+    En fréquence horaire, chaque année est aussi écrite dans le cube.
+    '''
+    import agregation
+    import bilan
+    import catalogue
+    import cube
+
+    if frequence == 'horaire':
+        variables_calculs = agregation.VARIABLES_POUR_CALCULS_SANS_ETP
+        read_csv_kwargs = {'date_format': "%Y%m%d%H"}
+        dirpath_cube = cube.get_dirpath_cube(
+            client, ref_station_name, stations_nn, date_deb_periode,
+            date_fin_periode, frequence=frequence)
+    else:
+        variables_calculs = bilan.VARIABLES_CALCUL_BILAN
+        read_csv_kwargs = {}
+    variables = [client.variables_labels[frequence][k]
+                 for k in variables_calculs]
+
+    # Dates délimitant des périodes d'une année subdivisant la période totale
+    idx_dates_deb = pd.date_range(
+        start=date_deb_periode, end=date_fin_periode, freq='YS-JAN')
+    idx_dates_fin = pd.date_range(
+        start=date_deb_periode, end=date_fin_periode,
+        freq='YE-DEC') + DECALAGE_FIN_ANNEE[frequence]
+
+    # Enregistrement des fichiers déjà présents absents du catalogue
+    catalogue.indexer_dossier(client)
+
+    for date_deb, date_fin in zip(idx_dates_deb, idx_dates_fin):
+        date_deb = date_deb.isoformat().replace("+00:00", "Z")
+        date_fin = date_fin.isoformat().replace("+00:00", "Z")
+        df_meteo_an = catalogue.completer_donnee(
+            client, ref_station_name, stations_nn, date_deb, date_fin,
+            frequence=frequence, variables=variables,
+            read_csv_kwargs=read_csv_kwargs).reindex(columns=variables)
+
+        if (frequence == 'horaire') and (len(df_meteo_an) > 0):
+            # Écriture de la période dans le cube
+            cube.ecrire_donnee(client, df_meteo_an, dirpath_cube,
+                               date_deb_periode, date_fin_periode,
+                               stations=stations_nn.index)
+
+        yield df_meteo_an
+
+def etape_donnee_stations(client, frequence, stations_nn, ref_station_name,
+                          date_deb_periode, date_fin_periode):
+    '''Donnée des stations voisines téléchargée par année.'''
+    return pd.concat(generer_donnee_stations_annees(
+        client, frequence, stations_nn, ref_station_name, date_deb_periode,
+        date_fin_periode), axis='index')
+
+def etape_cube_stations(client, frequence, stations_nn, ref_station_name,
+                        date_deb_periode, date_fin_periode):
+    '''Donnée des stations voisines écrite par année dans le cube.
+
+    Une seule année est en mémoire à la fois. La sortie est le dossier
+    du cube et les empreintes des années, qui changent avec la donnée.
+    '''
+    import cube
+
+    empreintes = [empreinte(df_meteo_an)
+                  for df_meteo_an in generer_donnee_stations_annees(
+                      client, frequence, stations_nn, ref_station_name,
+                      date_deb_periode, date_fin_periode)]
+    dirpath_cube = cube.get_dirpath_cube(
+        client, ref_station_name, stations_nn, date_deb_periode,
+        date_fin_periode, frequence=frequence)
+
+    return {'dirpath': str(dirpath_cube), 'empreintes': empreintes}
+
+def etape_interpolation(client, frequence, donnee_stations, stations_nn,
+                        ref_station_name, date_deb_periode, date_fin_periode):
+    '''Interpolation de la donnée des voisins à la station de référence.'''
+    import geo
+
+    df_meteo_ref = geo.interpolation_inverse_distance_carre(
+        donnee_stations, stations_nn['distance'])
+
+    # Sauvegarde de la donnée pour la station de référence
+    stockage.ecrire_csv(df_meteo_ref, meteofrance.get_filepath_donnee_periode(
+        client, ref_station_name, stations_nn, date_deb_periode,
+        date_fin_periode, frequence=frequence, ref=True))
+
+    return df_meteo_ref
+
+def etape_normalisation(client, frequence, interpolation):
+    '''Renommage et conversion des unités des variables.'''
+    return meteofrance.normaliser(client, interpolation, frequence)
+
+def etape_etp(client, frequence, normalisation, ref_station_latlon,
+              ref_station_altitude):
+    '''Ajout de l'ETP horaire à la donnée de la station de référence.'''
+    import etp
+
+    return normalisation.assign(etp=etp.calcul_etp(
+        normalisation, *ref_station_latlon, ref_station_altitude))
+
+def etape_agregation(client, frequence, donnee_heure):
+    '''Agrégation journalière (UTC) de la donnée horaire.'''
+    import agregation
+
+    return agregation.agreger_jours(donnee_heure, tz='UTC')
+
+def etape_agregation_morceaux(client, frequence, cube_stations, stations_nn,
+                              ref_station_latlon, ref_station_altitude,
+                              date_deb_periode, date_fin_periode,
+                              freq_morceaux=None):
+    '''Interpolation, ETP et agrégation journalière (UTC) par morceaux du cube.'''
+    import climatologie
+    import cube
+
+    cube_stations = cube.CubeStations(Path(cube_stations['dirpath']))
+
+    return climatologie.agreger_par_morceaux(
+        client, cube_stations, stations_nn['distance'], date_deb_periode,
+        date_fin_periode, *ref_station_latlon, ref_station_altitude,
+        freq=freq_morceaux or climatologie.FREQ_MORCEAUX)
+
+def etape_bilan(client, frequence, donnee_ref, ref_station_name, texture,
+                fraction_cailloux, culture, stade, fraction_ru_remplie,
+                ru_vers_rfu, seuil_irrigation, hauteur_vers_duree_irrigation,
+                rfu_cible=None):
+    '''Bilan hydrique journalier de la station de référence.
+
+    Le bilan est aussi enregistré dans la base des résultats (parcelle
+    du site, scénario de la climatologie de la fréquence).
+    '''
+    import bilan
+    import resultats
+
+    df_bilan = bilan.calcul_bilan(
+        donnee_ref, texture, fraction_cailloux, culture, stade,
+        fraction_ru_remplie, ru_vers_rfu,
+        seuil_irrigation=seuil_irrigation,
+        hauteur_vers_duree_irrigation=hauteur_vers_duree_irrigation,
+        rfu_cible=rfu_cible)
+    resultats.enregistrer_bilan(
+        ref_station_name, df_bilan,
+        scenario=f"{SCENARIO_CLIMATOLOGIE}_{frequence}")
+
+    return df_bilan
+
+def etape_normales(client, frequence, donnee_ref, ref_station_name):
+    '''Index des normales journalières de l'ETP et de la précipitation.
+
+    La sortie est le fichier de l'index et l'empreinte de la table, qui
+    change avec la donnée.
+    '''
+    import normales
+
+    filepath = normales.construire_normales(
+        ref_station_name, donnee_ref, frequence=frequence)
+
+    return {'filepath': str(filepath),
+            'empreinte': empreinte(normales.IndexNormales(filepath).table)}
+
+def verifier_normales(sortie):
+    '''Vrai si l'index n'a pas été remplacé (par une autre période par exemple).'''
+    import normales
+
+    try:
+        table = normales.IndexNormales(sortie['filepath']).table
+    except FileNotFoundError:
+        return False
+
+    return empreinte(table) == sortie['empreinte']
+
+def creer_chaine_climatologie(client, frequence, dirpath_cache=None,
+                              par_morceaux=False):
+    '''Chaîne de la climatologie de la liste des stations au bilan hydrique.
+
+    En fréquence horaire, l'ETP est calculée puis la donnée est agrégée
+    par jour. En fréquence quotidienne, l'ETP de la donnée est utilisée.
+    En fréquence horaire et par_morceaux, la donnée des stations n'est
+    gardée que dans le cube et la période est traitée par morceaux
+    (climatologie.agreger_par_morceaux) : les étapes donnee_stations,
+    interpolation, normalisation et etp sont remplacées par cube_stations.
+    '''
+    if (frequence == 'horaire') and par_morceaux:
+        return _creer_chaine_climatologie_morceaux(client, dirpath_cache)
+
+    etapes = _creer_etapes_stations() + [
+        Etape('donnee_stations', etape_donnee_stations,
+              dependances={'stations_nn': 'stations_nn'},
+              parametres=['ref_station_name', 'date_deb_periode',
+                          'date_fin_periode']),
+        Etape('interpolation', etape_interpolation,
+              dependances={'donnee_stations': 'donnee_stations',
+                           'stations_nn': 'stations_nn'},
+              parametres=['ref_station_name', 'date_deb_periode',
+                          'date_fin_periode']),
+        Etape('normalisation', etape_normalisation,
+              dependances={'interpolation': 'interpolation'})
+    ]
+    if frequence == 'horaire':
+        etapes += [
+            Etape('etp', etape_etp,
+                  dependances={'normalisation': 'normalisation'},
+                  parametres=['ref_station_latlon', 'ref_station_altitude']),
+            Etape('agregation', etape_agregation,
+                  dependances={'donnee_heure': 'etp'})
+        ]
+        donnee_ref = 'agregation'
+    else:
+        donnee_ref = 'normalisation'
+    etapes += [_creer_etape_bilan(donnee_ref),
+               _creer_etape_normales(donnee_ref)]
+
+    return Chaine(client, frequence, etapes, dirpath_cache=dirpath_cache)
+
+def _creer_etapes_stations():
+    return [
+        Etape('departements', etape_departements,
+              parametres=['id_departements', 'ref_station_latlon',
+                          'nn_rayon_km']),
+        Etape('liste_stations', etape_liste_stations,
+              dependances={'departements': 'departements'}),
+        Etape('stations_nn', etape_stations_nn,
+              dependances={'liste_stations': 'liste_stations'},
+              parametres=['ref_station_latlon', 'nn_nombre', 'nn_rayon_km'])
+    ]
+
+def _creer_etape_bilan(donnee_ref):
+    return Etape(
+        'bilan', etape_bilan, dependances={'donnee_ref': donnee_ref},
+        parametres=['ref_station_name', 'texture', 'fraction_cailloux',
+                    'culture', 'stade', 'fraction_ru_remplie', 'ru_vers_rfu',
+                    'seuil_irrigation', 'hauteur_vers_duree_irrigation',
+                    'rfu_cible'])
+
+def _creer_etape_normales(donnee_ref):
+    return Etape('normales', etape_normales,
+                 dependances={'donnee_ref': donnee_ref},
+                 parametres=['ref_station_name'], verifier=verifier_normales)
+
+def _creer_chaine_climatologie_morceaux(client, dirpath_cache=None):
+    '''Chaîne horaire dont la mémoire est bornée par une année (téléchargement)
+    et par un morceau (calculs).'''
+    etapes = _creer_etapes_stations() + [
+        Etape('cube_stations', etape_cube_stations,
+              dependances={'stations_nn': 'stations_nn'},
+              parametres=['ref_station_name', 'date_deb_periode',
+                          'date_fin_periode']),
+        Etape('agregation', etape_agregation_morceaux,
+              dependances={'cube_stations': 'cube_stations',
+                           'stations_nn': 'stations_nn'},
+              parametres=['ref_station_latlon', 'ref_station_altitude',
+                          'date_deb_periode', 'date_fin_periode',
+                          'freq_morceaux']),
+        _creer_etape_bilan('agregation'),
+        _creer_etape_normales('agregation')
+    ]
+
+    return Chaine(client, 'horaire', etapes, dirpath_cache=dirpath_cache)
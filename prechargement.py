@@ -0,0 +1,170 @@
+'''Préchargement horaire des paquets départementaux dans le cache local.
+
+Utilisation autonome (par exemple dans un service à côté de l'application) :
+
+    METEOFRANCE_APPLICATION_ID="AbC1..." python prechargement.py 13 84
+'''
+import os
+import sys
+import threading
+import traceback
+
+import pandas as pd
+import requests
+
+import meteofrance
+
+# Variable d'environnement listant les départements à précharger (ex. "13,84")
+ENV_DEPARTEMENTS = 'APP_BILAN_HYDRIQUE_DEPARTEMENTS'
+
+# Variable d'environnement de l'Application ID (à défaut d'une Application ID donnée)
+ENV_APPLICATION_ID = 'METEOFRANCE_APPLICATION_ID'
+
+# Nombre de préchargements consécutifs en échec à partir duquel une autre
+# Application ID remplace celle du préchargeur partagé
+ECHECS_AVANT_REMPLACEMENT = 1
+
+# API et fréquence des paquets préchargés
+METEOFRANCE_API = 'DPPaquetObs'
+METEOFRANCE_FREQUENCE = 'horaire'
+
+def get_departements_configures():
+    '''Départements à précharger définis par variable d'environnement.'''
+    valeur = os.environ.get(ENV_DEPARTEMENTS, '')
+
+    return [int(_) for _ in valeur.replace(';', ',').split(',') if _.strip()]
+
+def est_erreur_authentification(exc):
+    '''Vrai si l'exception vient d'une Application ID refusée.'''
+    if isinstance(exc, requests.HTTPError) and (exc.response is not None):
+        return exc.response.status_code in (401, 403)
+
+    # Réponse du jeton sans access_token (meteofrance.Client.obtain_token)
+    return isinstance(exc, KeyError) and (exc.args == ('access_token',))
+
+class Prechargeur(object):
+    '''Préchargement des paquets de départements juste après chaque publication.
+
+    Un fil d'exécution en arrière-plan télécharge le paquet de chaque
+    département configuré dès que Météo-France publie l'heure suivante
+    (meteofrance.DELAI_PUBLICATION_PAQUET après l'heure pleine) et le
+    place dans le cache de meteofrance.lire_paquet_departement. Les
+    demandes interactives sont alors servies depuis le cache.
+    echecs_consecutifs compte les préchargements où aucun département
+    n'a été chargé.
+    '''
+    def __init__(self, application_id, id_departements,
+                 frequence=METEOFRANCE_FREQUENCE):
+        self.id_departements = list(id_departements)
+        self.frequence = frequence
+        self.echecs_consecutifs = 0
+        self.changer_application_id(application_id)
+        self._arret = threading.Event()
+        self._fil = None
+
+    @property
+    def actif(self):
+        return (self._fil is not None) and self._fil.is_alive()
+
+    @property
+    def application_id(self):
+        return self._client.application_id
+
+    def changer_application_id(self, application_id):
+        '''Nouveau client (sans jeton) pour une autre Application ID.'''
+        # Client propre au préchargement (la session n'est pas partagée)
+        self._client = meteofrance.Client(
+            METEOFRANCE_API, application_id=application_id)
+        self.echecs_consecutifs = 0
+
+    def precharger(self):
+        '''Préchargement immédiat du dernier paquet publié des départements.'''
+        heure = meteofrance.get_heure_publication()
+        client = self._client
+        nombre_charges = 0
+        for id_dep in self.id_departements:
+            try:
+                meteofrance.lire_paquet_departement(
+                    client, id_dep, frequence=self.frequence, heure=heure)
+                nombre_charges += 1
+            except Exception as exc:
+                if est_erreur_authentification(exc):
+                    # Inutile d'essayer les autres départements
+                    print("Échec d'authentification du préchargement : "
+                          "Application ID refusée par Météo-France.",
+                          file=sys.stderr)
+                    break
+                print(f"Échec du préchargement du département {id_dep}:\n"
+                      f"{traceback.format_exc()}", file=sys.stderr)
+        if client is self._client:
+            self.echecs_consecutifs = (
+                0 if nombre_charges > 0 else self.echecs_consecutifs + 1)
+
+    def _secondes_avant_publication(self):
+        '''Durée jusqu'à la prochaine publication horaire.'''
+        maintenant = pd.Timestamp.now(tz=meteofrance.TZ)
+        prochaine = (meteofrance.get_heure_publication(maintenant) +
+                     pd.Timedelta(hours=1) +
+                     meteofrance.DELAI_PUBLICATION_PAQUET)
+
+        return max(0., (prochaine - maintenant).total_seconds())
+
+    def _boucle(self):
+        self.precharger()
+        while not self._arret.wait(self._secondes_avant_publication()):
+            self.precharger()
+
+    def demarrer(self):
+        '''Démarrage du préchargement en arrière-plan.'''
+        if not self.actif:
+            self._arret.clear()
+            self._fil = threading.Thread(
+                target=self._boucle, name='prechargement-paquets', daemon=True)
+            self._fil.start()
+
+    def arreter(self):
+        '''Arrêt du préchargement.'''
+        self._arret.set()
+        if self._fil is not None:
+            self._fil.join()
+
+# Préchargeur partagé par toutes les sessions de l'application
+_PRECHARGEUR = None
+_VERROU_PRECHARGEUR = threading.Lock()
+
+def demarrer_prechargement(application_id=None, id_departements=None):
+    '''Démarrage unique du préchargement partagé pour les départements configurés.
+
+    L'Application ID donnée est utilisée, à défaut celle de la variable
+    d'environnement. Si le préchargeur partagé échoue (Application ID
+    erronée ou révoquée), une autre Application ID le remplace et le
+    préchargement est relancé aussitôt.
+    '''
+    global _PRECHARGEUR
+    if id_departements is None:
+        id_departements = get_departements_configures()
+    application_id = application_id or os.environ.get(ENV_APPLICATION_ID)
+    if (len(id_departements) == 0) or not application_id:
+        return None
+
+    with _VERROU_PRECHARGEUR:
+        if _PRECHARGEUR is None:
+            _PRECHARGEUR = Prechargeur(application_id, id_departements)
+        elif ((application_id != _PRECHARGEUR.application_id) and
+              (_PRECHARGEUR.echecs_consecutifs >= ECHECS_AVANT_REMPLACEMENT)):
+            _PRECHARGEUR.changer_application_id(application_id)
+            threading.Thread(target=_PRECHARGEUR.precharger,
+                             name='prechargement-paquets-relance',
+                             daemon=True).start()
+        _PRECHARGEUR.demarrer()
+
+    return _PRECHARGEUR
+
+if __name__ == '__main__':
+    id_departements = ([int(_) for _ in sys.argv[1:]] or
+                       get_departements_configures())
+    prechargeur = Prechargeur(os.environ[ENV_APPLICATION_ID], id_departements)
+    try:
+        prechargeur._boucle()
+    except KeyboardInterrupt:
+        pass
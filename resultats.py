@@ -0,0 +1,161 @@
+'''Stockage persistant des résultats du bilan hydrique par parcelle.
+
+Les résultats de bilan.calcul_bilan (besoin, déclenchement et durée
+d'irrigation) sont enregistrés dans une base SQLite, par parcelle,
+date et scénario. Un enregistrement existant est mis à jour. Un index
+partiel sur les seuls jours irrigués répond à la liste des parcelles
+à irriguer d'un jour sans relire ni recalculer les bilans.
+'''
+from contextlib import closing
+import sqlite3
+import pandas as pd
+
+import agregation
+import meteofrance
+
+# Fichier SQLite des résultats
+NOM_FICHIER_RESULTATS = 'resultats_bilan.sqlite'
+
+# Scénario des bilans enregistrés sans scénario précisé
+SCENARIO_DEFAUT = 'reference'
+
+# Fuseau horaire du jour courant (journées locales)
+FUSEAU_JOUR = agregation.FUSEAUX['locale']
+
+# Colonnes de bilan.calcul_bilan enregistrées
+COLONNES = ['besoin_irrigation', 'irrigation', 'duree_irrigation']
+
+# Format des dates (triable comme une chaîne)
+FORMAT_DATE = '%Y-%m-%d'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bilans (
+    parcelle TEXT NOT NULL,
+    date TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    besoin_irrigation REAL,
+    irrigation INTEGER NOT NULL,
+    duree_irrigation REAL,
+    date_calcul TEXT NOT NULL,
+    PRIMARY KEY (parcelle, date, scenario)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_bilans_irrigation
+    ON bilans (scenario, date, parcelle, duree_irrigation, besoin_irrigation)
+    WHERE irrigation = 1;
+'''
+
+# Mise à jour des enregistrements existants
+REQUETE_ENREGISTREMENT = '''
+INSERT INTO bilans (parcelle, date, scenario, besoin_irrigation, irrigation,
+                    duree_irrigation, date_calcul)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (parcelle, date, scenario) DO UPDATE SET
+    besoin_irrigation = excluded.besoin_irrigation,
+    irrigation = excluded.irrigation,
+    duree_irrigation = excluded.duree_irrigation,
+    date_calcul = excluded.date_calcul
+'''
+
+def get_filepath_resultats():
+    meteofrance.DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+    return meteofrance.DATA_DIR / NOM_FICHIER_RESULTATS
+
+def connexion(filepath=None):
+    '''Connexion à la base des résultats, créée au besoin.'''
+    if filepath is None:
+        filepath = get_filepath_resultats()
+    con = sqlite3.connect(filepath, timeout=30.)
+    # Journal WAL : lectures concurrentes des écritures des autres processus
+    con.execute('PRAGMA journal_mode = WAL')
+    con.execute('PRAGMA synchronous = NORMAL')
+    con.executescript(SCHEMA)
+
+    return con
+
+def _vers_date(dates):
+    return pd.DatetimeIndex(dates).strftime(FORMAT_DATE)
+
+def enregistrer_bilans(df_bilans, scenario=SCENARIO_DEFAUT, filepath=None):
+    '''Enregistrement (ou mise à jour) des bilans journaliers de plusieurs parcelles.
+
+    df_bilans est indexée par parcelle et par date et contient les
+    colonnes de COLONNES (par exemple pd.concat de bilan.calcul_bilan
+    par parcelle).
+    '''
+    parcelles = df_bilans.index.get_level_values(0).astype(str)
+    dates = _vers_date(df_bilans.index.get_level_values(1))
+    date_calcul = pd.Timestamp.now(tz='UTC').isoformat()
+    # Les valeurs NaN sont enregistrées comme NULL par SQLite
+    lignes = zip(parcelles, dates, [scenario] * len(df_bilans),
+                 df_bilans['besoin_irrigation'].astype(float).tolist(),
+                 df_bilans['irrigation'].astype(bool).astype(int).tolist(),
+                 df_bilans['duree_irrigation'].astype(float).tolist(),
+                 [date_calcul] * len(df_bilans))
+
+    with closing(connexion(filepath)) as con, con:
+        con.executemany(REQUETE_ENREGISTREMENT, lignes)
+
+def enregistrer_bilan(parcelle, df_bilan, date=None,
+                      scenario=SCENARIO_DEFAUT, filepath=None):
+    '''Enregistrement du bilan journalier (bilan.calcul_bilan) d'une parcelle.
+
+    Le bilan d'un seul jour (Series, par exemple des dernières 24 h)
+    est enregistré au jour local de date (aujourd'hui par défaut).
+    '''
+    if isinstance(df_bilan, pd.Series):
+        date = pd.Timestamp.now(tz=FUSEAU_JOUR) if date is None else (
+            pd.Timestamp(date))
+        if date.tzinfo is not None:
+            date = date.tz_convert(FUSEAU_JOUR)
+        df_bilan = df_bilan[COLONNES].to_frame(date).transpose()
+    enregistrer_bilans(pd.concat({parcelle: df_bilan[COLONNES]}),
+                       scenario=scenario, filepath=filepath)
+
+def irrigations_du_jour(date=None, scenario=SCENARIO_DEFAUT, filepath=None):
+    '''Parcelles à irriguer à la date (aujourd'hui par défaut), par durée décroissante.'''
+    if date is None:
+        date = pd.Timestamp.now(tz=FUSEAU_JOUR)
+    requete = ('SELECT parcelle, besoin_irrigation, duree_irrigation '
+               'FROM bilans WHERE scenario = ? AND date = ? AND irrigation = 1 '
+               'ORDER BY duree_irrigation DESC')
+    with closing(connexion(filepath)) as con, con:
+        lignes = con.execute(
+            requete, (scenario, pd.Timestamp(date).strftime(FORMAT_DATE))
+        ).fetchall()
+
+    return pd.DataFrame(
+        lignes, columns=['parcelle', 'besoin_irrigation', 'duree_irrigation']
+    ).set_index('parcelle')
+
+def lire_bilans(parcelles=None, date_deb=None, date_fin=None,
+                scenario=SCENARIO_DEFAUT, filepath=None):
+    '''Bilans enregistrés indexés par parcelle et par date.'''
+    requete = ('SELECT parcelle, date, besoin_irrigation, irrigation, '
+               'duree_irrigation FROM bilans WHERE scenario = ?')
+    params = [scenario]
+    if parcelles is not None:
+        parcelles = [str(_) for _ in parcelles]
+        requete += f" AND parcelle IN ({', '.join('?' * len(parcelles))})"
+        params += parcelles
+    if date_deb is not None:
+        requete += ' AND date >= ?'
+        params.append(pd.Timestamp(date_deb).strftime(FORMAT_DATE))
+    if date_fin is not None:
+        requete += ' AND date <= ?'
+        params.append(pd.Timestamp(date_fin).strftime(FORMAT_DATE))
+    with closing(connexion(filepath)) as con, con:
+        df = pd.read_sql_query(requete + ' ORDER BY parcelle, date', con,
+                               params=params)
+    df['date'] = pd.to_datetime(df['date'])
+    df['irrigation'] = df['irrigation'].astype(bool)
+
+    return df.set_index(['parcelle', 'date'])
+
+def scenarios(filepath=None):
+    '''Scénarios enregistrés.'''
+    with closing(connexion(filepath)) as con, con:
+        lignes = con.execute(
+            'SELECT DISTINCT scenario FROM bilans ORDER BY scenario').fetchall()
+
+    return [_[0] for _ in lignes]
@@ -0,0 +1,435 @@
+'''Service HTTP local (JSON) des stations, de la météo interpolée, de l'ETP et du bilan.
+
+Le service ne lit que le stockage local de data/ : la liste des
+stations et les paquets départementaux horaires tenus à jour par
+prechargement.py. Il ne fait aucune demande à Météo-France et
+fonctionne hors ligne. Routes (paramètres en chaîne de requête) :
+- /stations : plus proches stations (lat, lon, nombre ou rayon_km),
+- /meteo : météo horaire interpolée au site et ETP (lat, lon,
+  altitude, nombre ou rayon_km, heure facultative) avec l'heure des
+  paquets lus,
+- /bilan : bilan hydrique des dernières 24 h au site (paramètres de
+  /meteo et de bilan.calcul_bilan),
+- /statistiques : latences p50/p99 par route et compteurs des caches.
+
+Les réponses sont gardées en cache jusqu'à la publication suivante,
+ou DUREE_CACHE_REPLI secondes si un paquet plus ancien a été lu en
+repli.
+Les demandes simultanées d'une même réponse, ou d'un même paquet
+(département et heure), sont regroupées en un seul calcul. Les calculs
+sont faits dans un groupe de fils d'exécution pour ne pas bloquer la
+boucle d'évènements.
+
+Utilisation : python service_api.py [port]
+'''
+import abc
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import tornado.web
+
+import agregation
+import bilan
+import etp
+import geo
+import meteofrance
+
+# Météo-France API et fréquence des paquets
+METEOFRANCE_API = 'DPPaquetObs'
+METEOFRANCE_FREQUENCE = 'horaire'
+
+# Port d'écoute par défaut (interface locale uniquement)
+PORT = 8765
+ADRESSE = '127.0.0.1'
+
+# Nombre de plus proches stations par défaut
+NOMBRE_VOISINS = 5
+
+# Nombre maximal et durée de vie (s) des réponses et des paquets en cache
+TAILLE_CACHE_REPONSES = 1024
+TAILLE_CACHE_PAQUETS = 128
+DUREE_CACHE = 3600.
+
+# Durée de vie (s) des résultats lus en repli sur un paquet plus ancien
+# (le paquet de l'heure demandée peut être écrit entre-temps)
+DUREE_CACHE_REPLI = 60.
+
+# Nombre de fils d'exécution des calculs
+MAX_WORKERS = 4
+
+# Nombre de dernières latences gardées par route pour les quantiles
+NOMBRE_LATENCES = 10000
+
+# Paramètres de bilan.calcul_bilan de la route /bilan
+PARAMETRES_BILAN = {
+    'texture': str,
+    'fraction_cailloux': float,
+    'culture': str,
+    'stade': str,
+    'fraction_ru_remplie': float,
+    'ru_vers_rfu': float,
+    'seuil_irrigation': float,
+    'hauteur_vers_duree_irrigation': float
+}
+
+class CacheReponses(object):
+    '''Cache LRU à durée de vie limitée regroupant les demandes simultanées.
+
+    Les demandes d'une clé arrivant pendant son calcul attendent son
+    résultat au lieu de le recalculer. Les erreurs ne sont pas gardées.
+    '''
+    def __init__(self, taille, duree=DUREE_CACHE):
+        self.taille = taille
+        self.duree = duree
+        self._valeurs = OrderedDict()
+        self._en_cours = {}
+        self.compteurs = {'trouvees': 0, 'regroupees': 0, 'calculees': 0}
+
+    async def obtenir(self, cle, calculer, get_duree=None):
+        '''Valeur de la clé en cache ou calculée par la coroutine calculer().
+
+        get_duree(valeur), si donnée, renvoie la durée de vie de la valeur
+        calculée (self.duree par défaut).
+        '''
+        if cle in self._valeurs:
+            expiration, valeur = self._valeurs[cle]
+            if expiration > time.monotonic():
+                self._valeurs.move_to_end(cle)
+                self.compteurs['trouvees'] += 1
+                return valeur
+            del self._valeurs[cle]
+        if cle in self._en_cours:
+            self.compteurs['regroupees'] += 1
+            return await asyncio.shield(self._en_cours[cle])
+
+        self.compteurs['calculees'] += 1
+        futur = asyncio.get_running_loop().create_future()
+        self._en_cours[cle] = futur
+        try:
+            valeur = await calculer()
+            futur.set_result(valeur)
+            duree = self.duree if get_duree is None else get_duree(valeur)
+            self._valeurs[cle] = (time.monotonic() + duree, valeur)
+            while len(self._valeurs) > self.taille:
+                self._valeurs.popitem(last=False)
+            return valeur
+        except Exception as exc:
+            # Erreur transmise aux demandes regroupées
+            futur.set_exception(exc)
+            futur.exception()
+            raise
+        finally:
+            if not futur.done():
+                futur.cancel()
+            del self._en_cours[cle]
+
+class Latences(object):
+    '''Latences des dernières demandes par route.'''
+    def __init__(self, nombre=NOMBRE_LATENCES):
+        self._durees = defaultdict(lambda: deque(maxlen=nombre))
+        self._nombres = defaultdict(int)
+
+    def enregistrer(self, route, duree):
+        self._durees[route].append(duree)
+        self._nombres[route] += 1
+
+    def statistiques(self):
+        '''Nombre de demandes et latences p50 et p99 (ms) par route.'''
+        statistiques = {}
+        for route, durees in self._durees.items():
+            p50, p99 = np.percentile(np.array(durees) * 1.e3, [50, 99])
+            statistiques[route] = {'nombre': self._nombres[route],
+                                   'p50_ms': round(p50, 3),
+                                   'p99_ms': round(p99, 3)}
+
+        return statistiques
+
+def lire_paquet_local(client, id_departement, heure, frequence=None,
+                      repli=False):
+    '''Paquet d'un département lu du stockage local, sans téléchargement.
+
+    Le paquet de l'heure demandée est lu s'il existe. Sinon, le plus
+    récent du département est lu si repli (heure par défaut) et une
+    FileNotFoundError est levée sinon. Renvoie l'heure du paquet lu et
+    le paquet.
+    '''
+    filepath = meteofrance.get_filepath_paquet(
+        client, id_departement, heure, frequence=frequence)
+    if filepath.exists():
+        return heure, pd.read_pickle(filepath)
+
+    str_heure = meteofrance.get_str_date(heure)
+    if not repli:
+        raise FileNotFoundError(
+            f"Aucun paquet local pour le département {id_departement} "
+            f"à {str_heure}.")
+    motif = filepath.name.replace(str_heure, '*')
+    filepaths = sorted(filepath.parent.glob(motif))
+    if not filepaths:
+        raise FileNotFoundError(
+            f"Aucun paquet local pour le département {id_departement}.")
+    filepath = filepaths[-1]
+    heure_paquet = pd.Timestamp(filepath.stem.rsplit('_', 1)[-1])
+
+    return heure_paquet, pd.read_pickle(filepath)
+
+def calcul_meteo_site(client, frequence, paquets, df_liste_stations_nn,
+                      latitude, longitude, altitude):
+    '''Météo horaire interpolée au site (unités SI) et ETP.'''
+    df_stations = pd.concat(paquets, axis='index')
+    id_stations = df_stations.index.get_level_values(
+        client.id_station_donnee_label)
+    df_stations = df_stations[id_stations.isin(df_liste_stations_nn.index)]
+    df_stations = df_stations[~df_stations.index.duplicated(keep=False)]
+    if len(df_stations) == 0:
+        raise FileNotFoundError(
+            "Aucune donnée locale pour les stations les plus proches.")
+    # Distances bornées : une station au site ne donne pas un poids infini
+    df_ref = geo.interpolation_inverse_distance_carre(
+        df_stations.select_dtypes('number'),
+        df_liste_stations_nn['distance'].clip(lower=geo.DISTANCE_MIN_KM))
+    df_si = meteofrance.normaliser(client, df_ref, frequence)
+    for variable in etp.VARIABLES_CALCUL_ETP:
+        if (variable not in df_si) or df_si[variable].isnull().all():
+            raise ValueError(f"Donnée manquante pour {variable} "
+                             f"nécessaire au calcul de l'ETP.")
+
+    return df_si.assign(etp=etp.calcul_etp(df_si, latitude, longitude,
+                                           altitude))
+
+def calcul_bilan_site(df_meteo_heure, parametres_bilan):
+    '''Bilan hydrique de la journée glissante se terminant à la dernière heure.'''
+    s_meteo = agregation.agreger_glissant(df_meteo_heure).iloc[-1]
+
+    return bilan.calcul_bilan(s_meteo, **parametres_bilan)
+
+class Service(object):
+    '''Calculs du service à partir du stockage local, avec caches.'''
+    def __init__(self, api=METEOFRANCE_API, frequence=METEOFRANCE_FREQUENCE,
+                 max_workers=MAX_WORKERS):
+        # Client sans Application ID : aucune demande n'est faite
+        self.client = meteofrance.Client(api)
+        self.frequence = frequence
+        self.executeur = ThreadPoolExecutor(max_workers=max_workers)
+        self.reponses = CacheReponses(TAILLE_CACHE_REPONSES)
+        self.paquets = CacheReponses(TAILLE_CACHE_PAQUETS)
+        self.meteos = CacheReponses(TAILLE_CACHE_PAQUETS)
+        self.latences = Latences()
+        self._liste_stations = (None, None)
+
+    async def executer(self, fonction, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executeur, fonction, *args)
+
+    def get_heure(self, heure=None):
+        '''Heure UTC du paquet demandé (dernière publication par défaut).'''
+        if heure is None:
+            return meteofrance.get_heure_publication()
+        heure = pd.Timestamp(heure)
+        if heure.tzinfo is None:
+            heure = heure.tz_localize(meteofrance.TZ)
+
+        return heure.tz_convert(meteofrance.TZ).floor('h')
+
+    def lire_liste_stations(self):
+        '''Liste locale des stations, relue si le fichier a changé.'''
+        filepath = meteofrance.get_filepath_liste_stations(self.client)
+        date_modification = filepath.stat().st_mtime_ns
+        if self._liste_stations[0] != date_modification:
+            self._liste_stations = (date_modification, pd.read_csv(
+                filepath, index_col=self.client.id_station_label))
+
+        return self._liste_stations[1]
+
+    def _selection_stations(self, latitude, longitude, nombre, rayon_km):
+        return geo.selection_stations_plus_proches(
+            self.lire_liste_stations(), [latitude, longitude],
+            self.client.latlon_labels, nombre=nombre, rayon_km=rayon_km)
+
+    async def stations(self, latitude, longitude, nombre=None, rayon_km=None):
+        '''Plus proches stations du site.'''
+        if (nombre is None) and (rayon_km is None):
+            nombre = NOMBRE_VOISINS
+
+        return await self.executer(self._selection_stations, latitude,
+                                   longitude, nombre, rayon_km)
+
+    def get_duree_cache(self, cache, heure, heure_paquet):
+        '''Durée de vie en cache d'un résultat, courte s'il a été lu en repli.'''
+        if (heure_paquet is not None) and (heure_paquet != heure):
+            return min(cache.duree, DUREE_CACHE_REPLI)
+
+        return cache.duree
+
+    async def paquet(self, id_departement, heure, repli=False):
+        '''Heure et paquet local d'un département, lu une fois par heure.'''
+        return await self.paquets.obtenir(
+            (id_departement, heure, repli), lambda: self.executer(
+                lire_paquet_local, self.client, id_departement, heure,
+                self.frequence, repli),
+            lambda valeur: self.get_duree_cache(self.paquets, heure, valeur[0]))
+
+    async def meteo(self, latitude, longitude, altitude, nombre=None,
+                    rayon_km=None, heure=None):
+        '''Heure des paquets lus et météo horaire interpolée au site et ETP.
+
+        Sans heure demandée, le dernier paquet local d'un département
+        est lu si celui de la dernière publication manque. L'heure
+        renvoyée est celle du plus ancien des paquets lus.
+        '''
+        repli = heure is None
+        heure = self.get_heure(heure)
+
+        async def calculer():
+            df_liste_stations_nn = await self.stations(
+                latitude, longitude, nombre=nombre, rayon_km=rayon_km)
+            id_departements = (
+                meteofrance.liste_id_stations_vers_liste_id_departements(
+                    df_liste_stations_nn))
+            heures, paquets = zip(*await asyncio.gather(*[
+                self.paquet(int(_), heure, repli) for _ in id_departements]))
+            df_meteo = await self.executer(
+                calcul_meteo_site, self.client, self.frequence, paquets,
+                df_liste_stations_nn, latitude, longitude, altitude)
+            return min(heures), df_meteo
+
+        return await self.meteos.obtenir(
+            (latitude, longitude, altitude, nombre, rayon_km, heure),
+            calculer,
+            lambda valeur: self.get_duree_cache(self.meteos, heure, valeur[0]))
+
+    async def bilan(self, latitude, longitude, altitude, parametres_bilan,
+                    nombre=None, rayon_km=None, heure=None):
+        '''Heure des paquets lus et bilan hydrique des dernières 24 h au site.'''
+        heure_paquet, df_meteo_heure = await self.meteo(
+            latitude, longitude, altitude, nombre=nombre, rayon_km=rayon_km,
+            heure=heure)
+
+        return heure_paquet, await self.executer(
+            calcul_bilan_site, df_meteo_heure, parametres_bilan)
+
+class GestionnaireJson(tornado.web.RequestHandler, metaclass=abc.ABCMeta):
+    '''Route JSON dont la réponse est gardée en cache jusqu'à la publication suivante.'''
+    route = None
+
+    # Heure des paquets lus par calculer (None si aucun paquet n'est lu)
+    heure_paquet = None
+
+    def initialize(self, service):
+        self.service = service
+
+    def get_float(self, nom, *defaut):
+        valeur = self.get_argument(nom, *defaut)
+
+        return None if valeur is None else float(valeur)
+
+    def get_voisins(self):
+        nombre = self.get_argument('nombre', None)
+
+        return {'nombre': None if nombre is None else int(nombre),
+                'rayon_km': self.get_float('rayon_km', None)}
+
+    @abc.abstractmethod
+    async def calculer(self):
+        '''Texte JSON de la réponse.'''
+
+    async def get(self):
+        arguments = tuple(sorted(
+            (nom, self.get_argument(nom)) for nom in self.request.arguments))
+        try:
+            cle = (self.route, self.service.get_heure(
+                self.get_argument('heure', None)), arguments)
+            texte = await self.service.reponses.obtenir(
+                cle, self.calculer, lambda texte: self.service.get_duree_cache(
+                    self.service.reponses, cle[1], self.heure_paquet))
+        except (ValueError, KeyError) as exc:
+            raise tornado.web.HTTPError(400, str(exc))
+        except FileNotFoundError as exc:
+            raise tornado.web.HTTPError(404, str(exc))
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(texte)
+
+    def write_error(self, status_code, **kwargs):
+        message = self._reason
+        if 'exc_info' in kwargs:
+            exc = kwargs['exc_info'][1]
+            if isinstance(exc, tornado.web.HTTPError) and exc.log_message:
+                message = exc.log_message
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.finish(json.dumps({'erreur': message}))
+
+    def on_finish(self):
+        self.service.latences.enregistrer(
+            self.route, self.request.request_time())
+
+class GestionnaireStations(GestionnaireJson):
+    route = 'stations'
+
+    async def calculer(self):
+        df = await self.service.stations(
+            self.get_float('lat'), self.get_float('lon'), **self.get_voisins())
+
+        return df.reset_index().to_json(orient='records', force_ascii=False)
+
+class GestionnaireMeteo(GestionnaireJson):
+    route = 'meteo'
+
+    async def calculer(self):
+        self.heure_paquet, df = await self.service.meteo(
+            self.get_float('lat'), self.get_float('lon'),
+            self.get_float('altitude'), heure=self.get_argument('heure', None),
+            **self.get_voisins())
+
+        return df.assign(heure_paquet=self.heure_paquet).rename_axis(
+            'date').reset_index().to_json(orient='records', date_format='iso')
+
+class GestionnaireBilan(GestionnaireJson):
+    route = 'bilan'
+
+    async def calculer(self):
+        parametres_bilan = {nom: type_parametre(self.get_argument(nom))
+                            for nom, type_parametre in PARAMETRES_BILAN.items()}
+        self.heure_paquet, s_bilan = await self.service.bilan(
+            self.get_float('lat'), self.get_float('lon'),
+            self.get_float('altitude'), parametres_bilan,
+            heure=self.get_argument('heure', None), **self.get_voisins())
+
+        return pd.concat([s_bilan.astype(object), pd.Series(
+            {'heure_paquet': self.heure_paquet.isoformat()})]).to_json(
+                force_ascii=False)
+
+class GestionnaireStatistiques(tornado.web.RequestHandler):
+    '''Latences par route et compteurs des caches (non mis en cache).'''
+    def initialize(self, service):
+        self.service = service
+
+    def get(self):
+        self.finish({
+            'latences': self.service.latences.statistiques(),
+            'caches': {nom: getattr(self.service, nom).compteurs
+                       for nom in ['reponses', 'meteos', 'paquets']}})
+
+def creer_application(service=None):
+    if service is None:
+        service = Service()
+    parametres = {'service': service}
+
+    return tornado.web.Application([
+        (r'/stations', GestionnaireStations, parametres),
+        (r'/meteo', GestionnaireMeteo, parametres),
+        (r'/bilan', GestionnaireBilan, parametres),
+        (r'/statistiques', GestionnaireStatistiques, parametres)])
+
+async def servir(port=PORT, adresse=ADRESSE):
+    creer_application().listen(port, address=adresse)
+    print(f"Service à l'écoute sur http://{adresse}:{port}")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    asyncio.run(servir(int(sys.argv[1]) if len(sys.argv) > 1 else PORT))
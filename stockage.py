@@ -0,0 +1,190 @@
+'''Stockage sur disque partagé entre processus.
+
+Les processus du serveur (panel serve --num-procs N) partagent le
+dossier data/. Les fichiers y sont écrits dans un fichier temporaire
+du même dossier puis mis en place par un remplacement atomique, de
+sorte qu'un lecteur ne voit jamais de fichier partiellement écrit. Un
+verrou de fichier par fichier produit fait qu'un seul processus le
+calcule : les autres attendent puis lisent son résultat.
+'''
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Plateformes sans fcntl (Windows) : verrou par création exclusive
+    fcntl = None
+
+# Suffixe des fichiers de verrou
+SUFFIXE_VERROU = '.lock'
+
+# Délai (s) entre deux tentatives de prise d'un verrou
+DELAI_ATTENTE_VERROU = 0.05
+
+# Âge (s) au-delà duquel un verrou par création exclusive sans processus
+# connu (identifiant illisible) est considéré comme abandonné
+AGE_MAX_VERROU = 3600.
+
+def get_filepath_verrou(filepath):
+    filepath = Path(filepath)
+
+    return filepath.with_name(filepath.name + SUFFIXE_VERROU)
+
+def _verrou_abandonne(filepath_verrou):
+    '''Vrai si le processus qui a créé le verrou semble arrêté.'''
+    try:
+        with open(filepath_verrou) as f:
+            pid = int(f.read())
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError):
+        # Identifiant pas encore écrit ou illisible : seul l'âge compte
+        try:
+            age = time.time() - os.path.getmtime(filepath_verrou)
+        except FileNotFoundError:
+            return False
+        return age > AGE_MAX_VERROU
+    if os.name == 'nt':
+        # os.kill arrêterait le processus. Le fichier d'un verrou tenu
+        # reste ouvert et sa suppression échoue (PermissionError).
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+
+    return False
+
+def _prendre_verrou_exclusif(filepath_verrou, attente):
+    '''Prise du verrou par création exclusive du fichier de verrou.
+
+    Le fichier contient l'identifiant du processus qui tient le verrou.
+    Il n'est supprimé par un autre processus que si ce processus est
+    arrêté.
+    '''
+    while True:
+        try:
+            fd = os.open(filepath_verrou,
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _verrou_abandonne(filepath_verrou):
+                try:
+                    Path(filepath_verrou).unlink(missing_ok=True)
+                    continue
+                except PermissionError:
+                    # Verrou encore ouvert par son processus
+                    pass
+            attente()
+            continue
+        os.write(fd, str(os.getpid()).encode())
+
+        return fd
+
+@contextmanager
+def verrou(filepath, timeout=None):
+    '''Verrou exclusif entre processus (et fils d'exécution) sur un fichier.
+
+    Une TimeoutError est levée si le verrou n'est pas obtenu en timeout
+    secondes (attente illimitée par défaut).
+    '''
+    filepath_verrou = get_filepath_verrou(filepath)
+    filepath_verrou.parent.mkdir(parents=True, exist_ok=True)
+    debut = time.monotonic()
+
+    def attente():
+        if (timeout is not None) and (time.monotonic() - debut > timeout):
+            raise TimeoutError(f"Verrou {filepath_verrou} non obtenu "
+                               f"en {timeout} s.")
+        time.sleep(DELAI_ATTENTE_VERROU)
+
+    if fcntl is None:
+        fd = _prendre_verrou_exclusif(filepath_verrou, attente)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            filepath_verrou.unlink(missing_ok=True)
+        return
+
+    with open(filepath_verrou, 'a') as f:
+        if timeout is None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    attente()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def ecrire_atomique(filepath, ecrire):
+    '''Écriture d'un fichier par ecrire(filepath_tmp) puis remplacement atomique.
+
+    Le fichier temporaire est dans le même dossier (même système de
+    fichiers) et garde l'extension du fichier, dont pandas déduit la
+    compression éventuelle.
+    '''
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, filepath_tmp = tempfile.mkstemp(
+        dir=filepath.parent, prefix=f".{filepath.name}.",
+        suffix=filepath.suffix)
+    os.close(fd)
+    try:
+        ecrire(filepath_tmp)
+        os.replace(filepath_tmp, filepath)
+    except BaseException:
+        Path(filepath_tmp).unlink(missing_ok=True)
+        raise
+
+def ecrire_csv(df, filepath, **kwargs):
+    '''Écriture atomique d'une DataFrame en CSV.'''
+    ecrire_atomique(filepath, lambda f: df.to_csv(f, **kwargs))
+
+def ecrire_pickle(objet, filepath):
+    '''Écriture atomique d'un objet par pickle (pandas).'''
+    import pandas as pd
+
+    ecrire_atomique(filepath, lambda f: pd.to_pickle(objet, f))
+
+def _date_modification(filepath):
+    try:
+        return os.stat(filepath).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def obtenir_ou_calculer(filepath, calculer, lire, ecrire, recalculer=False,
+                        cle_verrou=None):
+    '''Lecture d'un fichier ou calcul et écriture par un seul processus.
+
+    Si le fichier manque (ou si recalculer), un seul processus à la fois
+    calcule le résultat par calculer() et l'écrit par ecrire(resultat,
+    filepath_tmp). Un processus qui attendait le verrou lit le fichier
+    écrit entre-temps par un autre plutôt que de le recalculer. Le
+    verrou est celui de cle_verrou (par défaut filepath), qui peut être
+    partagé par plusieurs fichiers.
+    '''
+    filepath = Path(filepath)
+    date_avant = _date_modification(filepath)
+    if (date_avant is not None) and not recalculer:
+        return lire(filepath)
+
+    with verrou(filepath if cle_verrou is None else cle_verrou):
+        date = _date_modification(filepath)
+        if (date is not None) and ((not recalculer) or (date != date_avant)):
+            # Fichier écrit par un autre processus pendant l'attente
+            return lire(filepath)
+        resultat = calculer()
+        ecrire_atomique(filepath, lambda f: ecrire(resultat, f))
+
+    return resultat
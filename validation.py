@@ -0,0 +1,347 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+import catalogue
+import cube
+import etp
+import geo
+import meteofrance
+
+# Nombre de stations voisines par défaut pour la validation croisée
+NOMBRE_VOISINS = 5
+
+# Fréquences des entrées horaires et de l'ETP Météo-France (ETPGRILLE)
+FREQUENCE_HORAIRE = 'horaire'
+FREQUENCE_QUOTIDIENNE = 'quotidienne'
+
+# Nombre de stations lues à la fois pour remplir le cube de validation de l'ETP
+TAILLE_GROUPE_STATIONS = 50
+
+# Bornes des classes d'altitude (m) des statistiques d'erreur de l'ETP
+CLASSES_ALTITUDE = [-np.inf, 100., 300., 600., 1000., 1500., np.inf]
+
+# Sommes accumulées par station pour le calcul des métriques
+SOMMES = ['nombre', 'erreur', 'erreur_abs', 'erreur_carre',
+          'obs', 'pred', 'obs_carre', 'pred_carre', 'obs_pred']
+
+def calcul_voisins_validation_croisee(df_liste_stations, latlon_labels,
+                                      nombre=NOMBRE_VOISINS):
+    '''Voisins de chaque station, elle-même exclue, en une requête de l'arbre.
+
+    Renvoie les positions (stations × nombre) des voisins dans la liste
+    et leurs distances (km).
+    '''
+    arbre = geo.calcul_arbre(df_liste_stations, latlon_labels)
+    latlon_rad = geo.conversion_latlon_rad(df_liste_stations, latlon_labels)
+    dist_rad, ind = arbre.query(latlon_rad, k=nombre + 1)
+
+    # Exclusion de la station elle-même (ou du plus lointain voisin si la
+    # station n'apparaît pas, à cause de stations au même endroit)
+    soi = ind == np.arange(len(ind))[:, None]
+    soi[~soi.any(1), -1] = True
+    garder = ~soi
+    ind = ind[garder].reshape(len(ind), nombre)
+    dist_km = dist_rad[garder].reshape(len(ind), nombre) * geo.RAYON_TERRE_KM
+
+    return ind, dist_km
+
+def vers_tableau(df, stations, temps=None, variables=None):
+    '''Donnée indexée par station et par date en tableau (station × date × variable).'''
+    if temps is None:
+        temps = df.index.unique(level=-1).sort_values()
+    if variables is None:
+        variables = df.columns
+    pos_stations = pd.Index(stations).get_indexer(df.index.get_level_values(0))
+    pos_temps = temps.get_indexer(df.index.get_level_values(-1))
+    garder = (pos_stations >= 0) & (pos_temps >= 0)
+    valeurs = np.full((len(stations), len(temps), len(variables)), np.nan,
+                      dtype=np.result_type(*df[variables].dtypes))
+    valeurs[pos_stations[garder], pos_temps[garder]] = df[variables].to_numpy()[garder]
+
+    return valeurs, temps
+
+def predire_sans_station(valeurs, ind, dist_km):
+    '''Prédiction de chaque station par ses voisins (station × date).
+
+    Les poids en inverse de la distance au carré sont renormalisés à
+    chaque date sur les voisins disponibles. La somme est cumulée voisin
+    par voisin pour ne garder en mémoire que des tableaux station × date.
+    '''
+    poids = (1. / np.maximum(dist_km, geo.DISTANCE_MIN_KM)**2).astype(valeurs.dtype)
+    numerateur = np.zeros(valeurs.shape, dtype=valeurs.dtype)
+    denominateur = np.zeros(valeurs.shape, dtype=valeurs.dtype)
+    for j in range(ind.shape[1]):
+        valeurs_voisin = valeurs[ind[:, j]]
+        valide = ~np.isnan(valeurs_voisin)
+        numerateur += np.where(valide, valeurs_voisin, 0) * poids[:, j, None]
+        denominateur += valide * poids[:, j, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prediction = numerateur / denominateur
+
+    return prediction
+
+def calcul_sommes(obs, pred):
+    '''Sommes par station (lignes) des erreurs et des valeurs observées et prédites.'''
+    valide = ~(np.isnan(obs) | np.isnan(pred))
+    obs = np.where(valide, obs, 0).astype(float)
+    pred = np.where(valide, pred, 0).astype(float)
+    erreur = pred - obs
+    sommes = np.stack([
+        valide.sum(1), erreur.sum(1), np.abs(erreur).sum(1),
+        (erreur**2).sum(1), obs.sum(1), pred.sum(1), (obs**2).sum(1),
+        (pred**2).sum(1), (obs * pred).sum(1)], axis=1)
+
+    return sommes
+
+def calcul_metriques(df_sommes):
+    '''Métriques d'erreur (biais, EAM, REQM et corrélation) à partir des sommes.'''
+    n = df_sommes['nombre'].where(df_sommes['nombre'] > 0)
+    df_metriques = pd.DataFrame(index=df_sommes.index)
+    df_metriques['nombre'] = df_sommes['nombre'].astype(int)
+    df_metriques['biais'] = df_sommes['erreur'] / n
+    df_metriques['eam'] = df_sommes['erreur_abs'] / n
+    df_metriques['reqm'] = np.sqrt(df_sommes['erreur_carre'] / n)
+    covariance = n * df_sommes['obs_pred'] - df_sommes['obs'] * df_sommes['pred']
+    variance_obs = n * df_sommes['obs_carre'] - df_sommes['obs']**2
+    variance_pred = n * df_sommes['pred_carre'] - df_sommes['pred']**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df_metriques['correlation'] = covariance / np.sqrt(
+            variance_obs * variance_pred)
+
+    return df_metriques
+
+def validation_croisee(df, df_liste_stations, latlon_labels,
+                       nombre=NOMBRE_VOISINS, max_workers=None):
+    '''Validation croisée en laissant une station de côté de l'interpolation.
+
+    Chaque station de df_liste_stations est prédite par ses voisins (elle
+    exclue) et comparée à ses observations. Les calculs sont répartis
+    par variable et par année sur un groupe de fils d'exécution (NumPy
+    libère le GIL). Renvoie les métriques par variable et les métriques
+    par variable et par station.
+    '''
+    ind, dist_km = calcul_voisins_validation_croisee(
+        df_liste_stations, latlon_labels, nombre=nombre)
+    valeurs, temps = vers_tableau(df, df_liste_stations.index)
+    variables = list(df.columns)
+
+    # Positions des dates de chaque année
+    annees = temps.year
+    tranches = {annee: slice(*np.flatnonzero(annees == annee)[[0, -1]] + [0, 1])
+                for annee in np.unique(annees)}
+
+    def tache(i_variable, annee):
+        valeurs_tache = valeurs[:, tranches[annee], i_variable]
+        prediction = predire_sans_station(valeurs_tache, ind, dist_km)
+        return calcul_sommes(valeurs_tache, prediction)
+
+    taches = [(i_variable, annee) for i_variable in range(len(variables))
+              for annee in tranches]
+    with ThreadPoolExecutor(max_workers=max_workers) as executeur:
+        resultats = list(executeur.map(lambda _: tache(*_), taches))
+
+    # Sommes par variable et par station sur toutes les années
+    index = pd.MultiIndex.from_product(
+        [variables, df_liste_stations.index],
+        names=['variable', df_liste_stations.index.name])
+    sommes = np.zeros((len(variables), len(df_liste_stations), len(SOMMES)))
+    for (i_variable, _), sommes_tache in zip(taches, resultats):
+        sommes[i_variable] += sommes_tache
+    df_sommes = pd.DataFrame(sommes.reshape(-1, len(SOMMES)), index=index,
+                             columns=SOMMES)
+
+    df_metriques_stations = calcul_metriques(df_sommes)
+    df_metriques = calcul_metriques(df_sommes.groupby(level='variable', sort=False).sum())
+
+    return df_metriques, df_metriques_stations
+
+def get_dirpath_cube_validation_etp(client):
+    '''Dossier du cube des entrées horaires de la validation de l'ETP.'''
+    return meteofrance.DATA_DIR / client.api / 'validation_etp_cube'
+
+def stations_validation_etp(client, date_deb, date_fin, filepath_catalogue=None):
+    '''Stations ayant à la fois des données horaires et quotidiennes dans le catalogue.'''
+    id_stations_horaire = catalogue.stations_disponibles(
+        client, date_deb, date_fin, frequence=FREQUENCE_HORAIRE,
+        filepath_catalogue=filepath_catalogue)
+    id_stations_quotidienne = catalogue.stations_disponibles(
+        client, date_deb, date_fin, frequence=FREQUENCE_QUOTIDIENNE,
+        filepath_catalogue=filepath_catalogue)
+
+    return id_stations_horaire.intersection(id_stations_quotidienne)
+
+def preparer_cube_validation_etp(client, id_stations, date_deb, date_fin,
+                                 dirpath=None,
+                                 taille_groupe=TAILLE_GROUPE_STATIONS,
+                                 filepath_catalogue=None):
+    '''Écriture des entrées horaires de l'ETP des stations dans un cube.
+
+    Les données sont lues du catalogue par groupes de stations, de sorte
+    que la mémoire utilisée ne dépend pas de la taille du réseau.
+    '''
+    if dirpath is None:
+        dirpath = get_dirpath_cube_validation_etp(client)
+    variables = [client.variables_labels[FREQUENCE_HORAIRE][_]
+                 for _ in etp.VARIABLES_CALCUL_ETP]
+    cube_etp = cube.CubeStations.creer(
+        dirpath, id_stations, date_deb, date_fin, variables,
+        client.id_station_donnee_label, client.time_label)
+    for i in range(0, len(id_stations), taille_groupe):
+        df = catalogue.lire_donnee(
+            client, id_stations[i:i + taille_groupe], date_deb, date_fin,
+            frequence=FREQUENCE_HORAIRE, filepath_catalogue=filepath_catalogue)
+        if len(df) > 0:
+            cube_etp.ecrire(df.reindex(columns=variables))
+
+    return cube_etp
+
+# Cube et client de chaque processus de calcul de l'ETP
+_CUBE_ETP = None
+_CLIENT_ETP = None
+
+def _initialiser_processus_etp(dirpath, api):
+    '''Ouverture du cube en lecture seule (pages partagées entre processus).'''
+    global _CUBE_ETP, _CLIENT_ETP
+    _CUBE_ETP = cube.CubeStations(dirpath, mode='r')
+    _CLIENT_ETP = meteofrance.Client(api)
+
+def _calcul_etp_journaliere_station(station):
+    '''ETP journalière (mm) d'une station calculée à partir du cube.'''
+    id_station, latitude, longitude, altitude = station
+    df = _CUBE_ETP.vers_frame_station(id_station).astype(float)
+    df = meteofrance.normaliser(_CLIENT_ETP, df, FREQUENCE_HORAIRE)
+    if df[list(etp.VARIABLES_CALCUL_ETP)].isnull().all().any():
+        return None
+
+    etp_heure = etp.calcul_etp(df, latitude, longitude, altitude)
+
+    # Seuls les jours complets sont comparés
+    return etp_heure.resample('D').sum(min_count=24).dropna()
+
+def calcul_etp_journaliere_stations(client, df_liste_stations, dirpath=None,
+                                    max_workers=None):
+    '''ETP journalière de toutes les stations du cube dans un groupe de processus.
+
+    Chaque processus ouvre le cube par projection mémoire : les entrées
+    sont partagées par le cache de pages du système sans être copiées
+    ni sérialisées. Renvoie une série indexée par station et par date,
+    vide si aucune station n'a de données.
+    '''
+    if dirpath is None:
+        dirpath = get_dirpath_cube_validation_etp(client)
+    stations = list(zip(
+        df_liste_stations.index,
+        *[df_liste_stations[_].astype(float) for _ in client.latlon_labels],
+        df_liste_stations[client.altitude_label].astype(float)))
+    with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_initialiser_processus_etp,
+            initargs=(dirpath, client.api)) as executeur:
+        resultats = list(executeur.map(
+            _calcul_etp_journaliere_station, stations,
+            chunksize=max(1, len(stations) // 64)))
+
+    index_names = [client.id_station_donnee_label, client.time_label]
+    resultats = {station[0]: _ for station, _ in zip(stations, resultats)
+                 if _ is not None}
+    if len(resultats) == 0:
+        # Aucune station avec des données
+        return pd.Series(
+            dtype=float, name='etp', index=pd.MultiIndex.from_arrays(
+                [[], pd.DatetimeIndex([], tz=meteofrance.TZ)],
+                names=index_names))
+
+    s_etp = pd.concat(resultats, names=index_names)
+
+    return s_etp.rename('etp')
+
+def _sommes_lignes(obs, pred):
+    '''Sommes élémentaires (une ligne par valeur) pour le calcul des métriques.'''
+    erreur = pred - obs
+    return pd.DataFrame({
+        'nombre': 1., 'erreur': erreur, 'erreur_abs': np.abs(erreur),
+        'erreur_carre': erreur**2, 'obs': obs, 'pred': pred,
+        'obs_carre': obs**2, 'pred_carre': pred**2, 'obs_pred': obs * pred},
+        columns=SOMMES)
+
+def statistiques_erreurs_etp(client, df_comparaison, df_liste_stations):
+    '''Métriques d'erreur de l'ETP journalière par station, par mois et par altitude.'''
+    df_sommes = _sommes_lignes(df_comparaison['etp_grille'],
+                               df_comparaison['etp'])
+    id_stations = df_comparaison.index.get_level_values(0)
+    altitudes = df_liste_stations[client.altitude_label].astype(float).reindex(
+        id_stations).to_numpy()
+    cles = {
+        'station': id_stations,
+        'mois': df_comparaison.index.get_level_values(-1).month,
+        'altitude': pd.cut(altitudes, CLASSES_ALTITUDE)
+    }
+    statistiques = {
+        nom: calcul_metriques(df_sommes.groupby(
+            pd.Index(cle, name=nom), observed=True).sum())
+        for nom, cle in cles.items()}
+    statistiques['total'] = calcul_metriques(df_sommes.sum().to_frame('total').T)
+
+    return statistiques
+
+def validation_etp(client, df_liste_stations, date_deb, date_fin,
+                   max_workers=None, preparer_cube=True,
+                   filepath_catalogue=None):
+    '''Validation de l'ETP calculée contre l'ETPGRILLE Météo-France sur tout le réseau.
+
+    Les stations de df_liste_stations (liste DPClim) ayant à la fois des
+    données horaires et quotidiennes dans le catalogue sont retenues.
+    Leurs entrées horaires sont écrites dans un cube (sauf si
+    preparer_cube est faux et le cube déjà écrit), l'ETP est calculée
+    dans un groupe de processus et comparée jour par jour à l'ETPGRILLE.
+    Renvoie la comparaison journalière et les statistiques d'erreur.
+    '''
+    id_stations = stations_validation_etp(
+        client, date_deb, date_fin, filepath_catalogue=filepath_catalogue)
+    id_stations = id_stations.intersection(df_liste_stations.index)
+    df_liste_stations = df_liste_stations.loc[id_stations]
+
+    if preparer_cube:
+        preparer_cube_validation_etp(
+            client, id_stations, date_deb, date_fin,
+            filepath_catalogue=filepath_catalogue)
+    s_etp = calcul_etp_journaliere_stations(
+        client, df_liste_stations, max_workers=max_workers)
+
+    # ETP Météo-France journalière
+    label_etp = client.variables_labels[FREQUENCE_QUOTIDIENNE]['etp']
+    s_etp_grille = catalogue.lire_donnee(
+        client, id_stations, date_deb, date_fin,
+        frequence=FREQUENCE_QUOTIDIENNE,
+        filepath_catalogue=filepath_catalogue)[label_etp]
+    temps = s_etp_grille.index.get_level_values(-1)
+    if temps.tz is None:
+        s_etp_grille.index = s_etp_grille.index.set_levels(
+            s_etp_grille.index.levels[-1].tz_localize(meteofrance.TZ), level=-1)
+
+    df_comparaison = pd.concat(
+        [s_etp, s_etp_grille.rename('etp_grille')], axis='columns',
+        join='inner').dropna()
+    df_comparaison['erreur'] = df_comparaison['etp'] - df_comparaison['etp_grille']
+    statistiques = statistiques_erreurs_etp(
+        client, df_comparaison, df_liste_stations)
+
+    return df_comparaison, statistiques
+
+if __name__ == '__main__':
+    # Validation de l'ETP sur tout le réseau à partir des données locales :
+    # python validation.py 2023-01-01T00:00:00Z 2023-12-31T23:00:00Z
+    import sys
+
+    client = meteofrance.Client('DPClim')
+    filepaths = sorted((meteofrance.DATA_DIR / client.api).glob('liste_stations_*.csv'))
+    df_liste_stations = pd.concat(
+        [pd.read_csv(_, index_col=client.id_station_label) for _ in filepaths])
+    df_liste_stations = df_liste_stations[~df_liste_stations.index.duplicated()]
+    catalogue.indexer_dossier(client)
+    df_comparaison, statistiques = validation_etp(
+        client, df_liste_stations, sys.argv[1], sys.argv[2])
+    for nom, df_statistiques in statistiques.items():
+        df_statistiques.to_csv(meteofrance.DATA_DIR / client.api /
+                               f"validation_etp_{nom}.csv")
+        print(df_statistiques)
@@ -1,14 +1,13 @@
 import pandas as pd
 import panel as pn
 import param
-import plotly.graph_objects as go
-from plotly.colors import DEFAULT_PLOTLY_COLORS
-from plotly.subplots import make_subplots
 import numpy as np
 import traceback
 
 import bilan
 import meteofrance
+import normales
+import resultats
 from datastore_observations import DataStoreObservations
 
 # Choix de la texture
@@ -97,6 +96,11 @@ class ViewerMeteoObservations(View):
         panels_variables=DEFAULT_PANELS_VARIABLES,
         width=900, height=600
     ):
+        # Import de plotly au premier tracé (démarrage de l'application)
+        import plotly.graph_objects as go
+        from plotly.colors import DEFAULT_PLOTLY_COLORS
+        from plotly.subplots import make_subplots
+
         rows = len(panels_variables)
         cols = len(panels_variables[0])
         axes = 2
@@ -123,6 +127,30 @@ class ViewerMeteoObservations(View):
     
         return pn.pane.Plotly(fig)
 
+    def _creer_normales(self, date):
+        # Normales de la station de référence si leur index est construit
+        try:
+            index_normales = normales.lire_normales(
+                self.datastore.ref_station_name)
+        except FileNotFoundError:
+            return None
+
+        s = self.datastore.tab_meteo_ref_si.value.iloc[0]
+        df = index_normales.normales_jour(date)
+        lignes = ["| Variable | 24 h | Normale | Anomalie | Quantiles 10-90 % |",
+                  "|---|---|---|---|---|"]
+        for variable in index_normales.variables:
+            unite = meteofrance.UNITES[variable]
+            lignes.append(
+                f"| {variable} | {s[variable]:.1f} {unite} "
+                f"| {df.loc[variable, 'moyenne']:.1f} "
+                f"| {index_normales.anomalie(date, s[variable], variable):+.1f} "
+                f"| {df.loc[variable, 'q10']:.1f} - {df.loc[variable, 'q90']:.1f} |")
+
+        return pn.Column(
+            pn.pane.Markdown(f"### Normales du {date:%d/%m}"),
+            pn.pane.Markdown('\n'.join(lignes)))
+
     def _creer_plots(self, recuperation_donnee_ref_faite):
         guide = pn.pane.Alert(
             "Récupérérer la donnée météo de la station de référence "
@@ -135,6 +163,9 @@ class ViewerMeteoObservations(View):
                     "La table de la donnée météo pour la station de référence est vide!")
             
                 sortie = self._creer_plot_meteo(df)
+                sortie_normales = self._creer_normales(df.index.max())
+                if sortie_normales is not None:
+                    sortie = pn.Column(sortie, sortie_normales)
             except Exception as exc:
                 sortie = pn.pane.Str(traceback.format_exc())    
         return sortie
@@ -201,6 +232,8 @@ class ViewerBilanObservations(View):
         return list(bilan.KC[culture_choisie])
     
     def _creer_plot_sol(self, s, width=500, height=400):
+        import plotly.graph_objects as go
+
         idx_deb = 1
         idx_fin = 5
         x = s.index[idx_deb:]
@@ -220,6 +253,8 @@ class ViewerBilanObservations(View):
         return pn.pane.Plotly(fig)
 
     def _creer_plot_besoin(self, s, width=500, height=400):
+        import plotly.graph_objects as go
+
         idx_deb = 4
         idx_fin = 10
         x = s.index[idx_deb:]
@@ -272,6 +307,11 @@ class ViewerBilanObservations(View):
                     seuil_irrigation=seuil_irrigation,
                     hauteur_vers_duree_irrigation=hauteur_vers_duree_irrigation)  
 
+                # Enregistrement du bilan du jour de la station de référence
+                resultats.enregistrer_bilan(
+                    self.datastore.ref_station_name, df_bilan,
+                    date=self.datastore.tab_meteo_ref_heure_si.value.index.max())
+
                 plot_sol = self._creer_plot_sol(df_bilan)
                 plot_besoin = self._creer_plot_besoin(df_bilan)
                 plot_titre = pn.pane.Markdown(